@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 '''Class interfacing the App and the OpenFoodFacts's API'''
 
-from typing import Dict, Set, Union, Generator, Any, List, NoReturn
+from typing import (Dict, Set, Union, Generator, Any, List, NoReturn,
+                    Iterable, Optional)
+import codecs
 import dataclasses
+import json
 import re
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from OpenFoodFacts.Product import Product
+from OpenFoodFacts.Cache import Cache, CacheEntry
 
 
 class API:
@@ -13,10 +20,27 @@ class API:
 
     Class attributes:
         BASE_URL:      URL to the API without parameter
+        CATEGORIES_URL: URL to the category taxonomy (with the number
+                       of products of each category)
+        MAX_PAGE_SIZE: Maximum number of results per page of the API
         BASE_PARAMS:   Dictionary containing base parameters for the API
         USEFUL_FIELDS: Collects dynamically the Product attributes names.
-                       Simplifies the collection of the wanted data only.'''
+                       Simplifies the collection of the wanted data only.
+        REQUIRED_FIELDS: The Product attributes without default value,
+                       which every result must contain
+        CHUNK_SIZE:    Size of the chunks read from the API responses
+        RETRY_STATUS:  HTTP status codes worth retrying (rate limiting
+                       and transient server errors)
+
+    Attributes:
+        session: Persistent HTTP session keeping the connections alive
+        timeout: Timeout (in seconds) for connecting and reading
+        cache:   Optional Cache of the API responses
+        profiler: Optional object measuring the HTTP calls through
+                  its record_http(seconds, bytes) method'''
     BASE_URL: str = 'https://fr.openfoodfacts.org/cgi/search.pl'
+    CATEGORIES_URL: str = 'https://fr.openfoodfacts.org/categories.json'
+    MAX_PAGE_SIZE: int = 100
     BASE_PARAMS: Dict[str, Union[int, str]] = {
         'action': 'process',
         'page_size': 20,
@@ -28,44 +52,317 @@ class API:
     USEFUL_FIELDS: Set[str] = {
         field.name for field in dataclasses.fields(Product)
     }
+    REQUIRED_FIELDS: Set[str] = {
+        field.name for field in dataclasses.fields(Product)
+        if field.default is dataclasses.MISSING
+    }
+    CHUNK_SIZE: int = 64 * 1024
+    RETRY_STATUS: Set[int] = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size: int = 10, timeout: float = 10.0,
+                 retries: int = 3, backoff_factor: float = 0.5,
+                 cache: Optional[Cache] = None,
+                 profiler: Optional[Any] = None) -> None:
+        '''Constructor opening a pooled HTTP session. Failed requests
+        are retried up to retries times, waiting backoff_factor * 2^n
+        seconds between tries (Retry-After is honored on 429/503)'''
+        self.timeout = timeout
+        self.cache = cache
+        self.profiler = profiler
+        self.session: requests.Session = requests.Session()
+        adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=self.RETRY_STATUS,
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self) -> None:
+        '''Closes every connection kept alive by the session
+        (and the cache, if any)'''
+        self.session.close()
+        if self.cache:
+            self.cache.close()
 
     def _get_products(self,
                       params: Dict[str, Union[int, str]]
                       ) -> Generator[Product, None, None]:
         '''Private method calling the API with the parameters provided.
         Instanciates a Product object for every products collected in
-        the API response and yields them'''
+        the API response and yields them as soon as they are decoded'''
+        for result in self._get_results(params):
+            product: Optional[Product] = self.to_product(result)
+            if product:
+                yield product
+
+    def _get_results(self,
+                     params: Dict[str, Union[int, str]]
+                     ) -> Generator[Dict[str, Any], None, None]:
+        '''Private method requesting a single page of the API and
+        yielding its raw results one by one, while the response body
+        is still being downloaded'''
         r_params: Dict[str, Union[int, str]] = self.BASE_PARAMS.copy()
         r_params.update(params)
-        r_result: requests.Response = requests.get(self.BASE_URL, r_params)
+        if self.cache:
+            yield from self._iter_json_array(
+                [self._get_cached(r_params)], 'products'
+            )
+            return
+        start: float = time.perf_counter()
+        r_result: requests.Response = self.session.get(
+            self.BASE_URL, params=r_params, stream=True, timeout=self.timeout
+        )
+        if r_result.status_code != requests.codes.ok:
+            r_result.raise_for_status()
+        decoder: codecs.IncrementalDecoder = \
+            codecs.getincrementaldecoder('utf-8')()
+        with r_result:
+            yield from self._iter_json_array(
+                (decoder.decode(chunk) for chunk in self._timed_chunks(
+                    r_result.iter_content(self.CHUNK_SIZE),
+                    time.perf_counter() - start
+                )),
+                'products'
+            )
+
+    def _timed_chunks(self, chunks: Iterable[bytes],
+                      elapsed: float) -> Generator[bytes, None, None]:
+        '''Private method passing the chunks of a response through,
+        measuring the time spent downloading them and their size for
+        the profiler (elapsed is the time spent before the body)'''
+        size: int = 0
+        chunks = iter(chunks)
+        try:
+            while True:
+                start: float = time.perf_counter()
+                chunk: Optional[bytes] = next(chunks, None)
+                elapsed += time.perf_counter() - start
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:  # Even if the body is not read until its end
+            if self.profiler:
+                self.profiler.record_http(elapsed, size)
+
+    def _get_cached(self, r_params: Dict[str, Union[int, str]]) -> str:
+        '''Private method returning the body of the response to the
+        request, from the cache if it is fresh. An expired entry is
+        revalidated with the API (If-None-Match/If-Modified-Since)
+        before being downloaded again. The body is read entirely, so
+        that it can be stored in the cache.'''
+        key: str = Cache.key(r_params)
+        entry: Optional[CacheEntry] = self.cache.get(key)
+        if entry and entry.fresh:
+            return entry.body
+        headers: Dict[str, str] = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        start: float = time.perf_counter()
+        r_result: requests.Response = self.session.get(
+            self.BASE_URL, params=r_params, headers=headers,
+            timeout=self.timeout
+        )
+        if self.profiler:
+            self.profiler.record_http(time.perf_counter() - start,
+                                      len(r_result.content))
+        if entry and r_result.status_code == requests.codes.not_modified:
+            self.cache.refresh(key)
+            return entry.body
         if r_result.status_code != requests.codes.ok:
             r_result.raise_for_status()
-        products: List[Dict[str, Any]] = r_result.json()['products']
-        for result in products:
-            result['name'] = result.pop('product_name')
-            if self._result_complete(result):  # If all data are available
-                for field in ('categories', 'stores'):
-                    result[field] = re.split(
-                        r'\s*,\s*', result[field].lower()
-                    )
-                product: Product = Product(
-                    **{k: result[k] for k in self.USEFUL_FIELDS}
-                )
+        r_result.encoding = 'utf-8'
+        self.cache.set(
+            key, r_result.text, r_result.headers.get('ETag'),
+            r_result.headers.get('Last-Modified')
+        )
+        return r_result.text
+
+    def _get_pages(self, params: Dict[str, Union[int, str]],
+                   max_products: Optional[int] = None,
+                   modified_since: Optional[int] = None
+                   ) -> Generator[Product, None, None]:
+        '''Private method walking the API pages (1..N) until
+        max_products Products have been yielded (if provided) or until
+        the results run out. Only one result is decoded at a time.
+        If modified_since is provided, the results must be sorted by
+        last modification: the walk stops at the first result which
+        has not been modified after this timestamp.'''
+        nb_products: int = 0
+        for result in self._get_page_results(params, modified_since):
+            product: Optional[Product] = self.to_product(result)
+            if product:
                 yield product
+                nb_products += 1
+                if max_products and nb_products >= max_products:
+                    return
+
+    def _get_page_results(self, params: Dict[str, Union[int, str]],
+                          modified_since: Optional[int] = None,
+                          page: int = 1
+                          ) -> Generator[Dict[str, Any], None, None]:
+        '''Private method walking the API pages (page..N) and yielding
+        their raw results until they run out (or, if modified_since
+        is provided, until a result has not been modified since)'''
+        page_size: int = int(params.get(
+            'page_size', self.BASE_PARAMS['page_size']
+        ))
+        while True:
+            nb_results: int = 0
+            for result in self._get_results(dict(params, page=page)):
+                nb_results += 1
+                if modified_since and \
+                        result.get('last_modified_t', 0) <= modified_since:
+                    return
+                yield result
+            if nb_results < page_size:  # Last page reached
+                return
+            page += 1
+
+    @staticmethod
+    def _iter_json_array(chunks: Iterable[str],
+                         key: str) -> Generator[Dict[str, Any], None, None]:
+        '''Private static method decoding incrementally the JSON array
+        stored under key in a JSON document received by chunks.
+        Yields every element of the array as soon as it is complete.
+        Raises ValueError if the document holds no such array.'''
+        decoder: json.JSONDecoder = json.JSONDecoder()
+        chunks = iter(chunks)
+        buffer: str = ''
+        marker: str = '"%s"' % key
+        while marker not in buffer:  # Looks for the beginning of the array
+            chunk: Optional[str] = next(chunks, None)
+            if chunk is None:
+                raise ValueError('No "%s" array in the response' % key)
+            buffer += chunk
+        buffer = buffer[buffer.index(marker) + len(marker):]
+        while True:  # Skips the separator, which may span several chunks
+            buffer = buffer.lstrip(' \t\n\r:')
+            if buffer:
+                break
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Response truncated after "%s"' % key)
+            buffer = chunk
+        if not buffer.startswith('['):
+            raise ValueError('"%s" is not an array in the response' % key)
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip(' \t\n\r,')
+            if buffer.startswith(']'):  # End of the array
+                return
+            try:
+                element, end = decoder.raw_decode(buffer)
+            except ValueError:  # Element incomplete, needs more data
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            yield element
 
-    def _result_complete(self, result: Dict[str, Union[int, str]]) -> bool:
-        '''Private method that checks if the collected metadata from the
-        API contains every required elements (returns True/False)'''
-        for field in self.USEFUL_FIELDS:
+    @classmethod
+    def to_product(cls, result: Dict[str, Any]) -> Optional[Product]:
+        '''Public class method instanciating a Product from a raw
+        result of the API (or of a data dump, which shares its fields).
+        Returns None if some required data are missing.'''
+        result['name'] = result.pop('product_name', None)
+        if not cls._result_complete(result):
+            return None
+        for field in ('categories', 'stores'):
+            result[field] = re.split(
+                r'\s*,\s*', result[field].lower()
+            )
+        return Product(**{
+            k: result[k] for k in cls.USEFUL_FIELDS if result.get(k)
+        })
+
+    @classmethod
+    def _result_complete(cls, result: Dict[str, Union[int, str]]) -> bool:
+        '''Private class method that checks if the collected metadata
+        from the API contains every required elements (returns True/False)'''
+        for field in cls.REQUIRED_FIELDS:
             if field not in result or not result[field]:
                 return False
         return True
 
-    def search(self, category: str,
-               page_size: int = 20) -> Generator[Product, None, None]:
-        '''Public method to query the API based on
-        a category id. Yields associated Products'''
-        return self._get_products({
+    def search(self, category: str, page_size: int = 20,
+               max_products: Optional[int] = None,
+               modified_since: Optional[int] = None
+               ) -> Generator[Product, None, None]:
+        '''Public method to query the API based on a category id.
+        Walks through the result pages (of page_size results each)
+        until max_products are collected (every product if None).
+        With modified_since (a timestamp), only the products modified
+        since then are collected, the most recently modified first.
+        Yields associated Products'''
+        return self._get_pages(self._search_params(category, page_size,
+                                                   modified_since),
+                               max_products, modified_since)
+
+    def search_results(self, category: str, page_size: int = 20,
+                       modified_since: Optional[int] = None,
+                       page: int = 1
+                       ) -> Generator[Dict[str, Any], None, None]:
+        '''Public method querying the API like search(), but yielding
+        the raw results (to be converted with to_product()) from the
+        page provided until the generator is closed or the results
+        run out'''
+        return self._get_page_results(
+            self._search_params(category, page_size, modified_since),
+            modified_since, page
+        )
+
+    def categories(self, min_products: int = 1) -> List[str]:
+        '''Public method collecting the names of the categories of the
+        taxonomy having at least min_products products, largest first'''
+        start: float = time.perf_counter()
+        r_result: requests.Response = self.session.get(
+            self.CATEGORIES_URL, timeout=self.timeout
+        )
+        if self.profiler:
+            self.profiler.record_http(time.perf_counter() - start,
+                                      len(r_result.content))
+        r_result.raise_for_status()
+        return self._category_names(r_result.json(), min_products)
+
+    @classmethod
+    def load_categories(cls, path: str,
+                        min_products: int = 1) -> List[str]:
+        '''Public class method reading the category names from a local
+        copy of the taxonomy (the JSON document of CATEGORIES_URL)'''
+        with open(path, encoding='utf-8') as f:
+            return cls._category_names(json.load(f), min_products)
+
+    @staticmethod
+    def _category_names(taxonomy: Dict[str, Any],
+                        min_products: int) -> List[str]:
+        '''Private static method returning the distinct names (lower
+        case) of the categories of a taxonomy document having at least
+        min_products products, largest first'''
+        tags: List[Dict[str, Any]] = sorted(
+            (tag for tag in taxonomy.get('tags', [])
+             if tag.get('name') and tag.get('products', 0) >= min_products),
+            key=lambda tag: -tag.get('products', 0)
+        )
+        return list(dict.fromkeys(tag['name'].lower() for tag in tags))
+
+    def _search_params(self, category: str, page_size: int,
+                       modified_since: Optional[int] = None
+                       ) -> Dict[str, Union[int, str]]:
+        '''Private method building the parameters of a category search'''
+        params: Dict[str, Union[int, str]] = {
             'tag_0': category,
             'page_size': page_size,
-        })
+        }
+        if modified_since:
+            params['sort_by'] = 'last_modified_t'
+        return params
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''Persistent cache for the OpenFoodFacts's API responses'''
+from dataclasses import dataclass
+from typing import Dict, Optional, Union, Any
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+@dataclass
+class CacheEntry:
+    '''A response stored in the Cache
+
+    Attributes:
+        body:          The raw JSON body of the response
+        etag:          The ETag header of the response (if any)
+        last_modified: The Last-Modified header of the response (if any)
+        fresh:         Whether the entry is younger than the Cache TTL'''
+    body: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+
+
+class Cache:
+    '''On-disk cache of the API responses, stored in a SQLite file.
+    Entries expire after ttl seconds and the least recently used ones
+    are evicted when more than max_entries are stored.
+
+    Attributes:
+        path:        Path to the SQLite file holding the cache
+        ttl:         Time to live (in seconds) of the entries
+        max_entries: Maximum number of entries kept
+        hits:        Number of requests served from the cache
+        misses:      Number of requests sent to the API
+        revalidated: Number of expired entries confirmed unchanged
+                     by the API (HTTP 304)'''
+
+    def __init__(self, path: str, ttl: int = 3600,
+                 max_entries: int = 1000) -> None:
+        '''Constructor opening (or creating) the cache file'''
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self.revalidated: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS Response ('
+                'key TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, '
+                'last_modified TEXT, stored_at REAL NOT NULL, '
+                'accessed_at REAL NOT NULL)'
+            )
+
+    @staticmethod
+    def key(params: Dict[str, Union[int, str]]) -> str:
+        '''Static method computing the key of a request from its
+        parameters (normalized, so that their order does not matter)'''
+        normalized: str = json.dumps(
+            {k: str(v) for k, v in params.items()}, sort_keys=True
+        )
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        '''Returns the entry stored for the key (fresh or not), or None.
+        Counts a hit if the entry is fresh, a miss otherwise.'''
+        now: float = time.time()
+        with self._lock, self._connection:
+            row: Optional[Any] = self._connection.execute(
+                'SELECT body, etag, last_modified, stored_at '
+                'FROM Response WHERE key = ?', (key,)
+            ).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                'UPDATE Response SET accessed_at = ? WHERE key = ?',
+                (now, key)
+            )
+            entry: CacheEntry = CacheEntry(
+                body=row[0], etag=row[1], last_modified=row[2],
+                fresh=now - row[3] < self.ttl
+            )
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def set(self, key: str, body: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> None:
+        '''Stores a response, then evicts the least recently
+        used entries if the cache is full'''
+        now: float = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO Response VALUES (?, ?, ?, ?, ?, ?)',
+                (key, body, etag, last_modified, now, now)
+            )
+            self._connection.execute(
+                'DELETE FROM Response WHERE key IN ('
+                'SELECT key FROM Response ORDER BY accessed_at DESC '
+                'LIMIT -1 OFFSET ?)', (self.max_entries,)
+            )
+
+    def refresh(self, key: str) -> None:
+        '''Marks an expired entry as fresh again, after the API
+        confirmed it has not changed (HTTP 304)'''
+        with self._lock, self._connection:
+            self.revalidated += 1
+            self._connection.execute(
+                'UPDATE Response SET stored_at = ? WHERE key = ?',
+                (time.time(), key)
+            )
+
+    def stats(self) -> Dict[str, int]:
+        '''Returns the counters of the cache'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+        }
+
+    def close(self) -> None:
+        '''Closes the cache file'''
+        self._connection.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+'''Class reading the products of an OpenFoodFacts data export'''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import (Dict, List, Set, Tuple, Optional, Any, Iterable,
+                    Generator, Deque, IO)
+import csv
+import gzip
+import itertools
+import json
+import os
+import re
+from OpenFoodFacts.API import API
+from OpenFoodFacts.Product import Product
+
+
+class Dump:
+    '''Class reading the products of an OpenFoodFacts data export
+    (JSONL or tab-separated CSV, gzip-compressed or not).
+    The file is streamed by chunks of lines, parsed and validated by
+    a pool of processes, and only the products belonging to one of
+    the wished categories are kept. Malformed records (invalid JSON,
+    wrong field types) are skipped and counted.
+
+    Class attributes:
+        PRODUCT_URL: URL to a product Web page, for exports without URL
+
+    Attributes:
+        path:       Path to the data export
+        categories: The wished categories (None: every category)
+        workers:    Number of parsing processes
+        chunk_size: Number of lines parsed at once by a process
+        malformed:  Number of malformed records skipped so far'''
+    PRODUCT_URL: str = 'https://fr.openfoodfacts.org/produit/%s'
+
+    def __init__(self, path: str, categories: Optional[Iterable[str]],
+                 workers: Optional[int] = None,
+                 chunk_size: int = 5000) -> None:
+        '''Constructor (categories None keeps every product, with all
+        its categories)'''
+        self.path = path
+        self.categories: Optional[Set[str]] = (
+            {c.lower() for c in categories} if categories is not None
+            else None
+        )
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.malformed: int = 0
+
+    def products(self) -> Generator[Product, None, None]:
+        '''Public method yielding the Products of the export.
+        At most two chunks per process are in flight, which keeps
+        the memory bounded whatever the size of the file.'''
+        workers: int = self.workers or os.cpu_count() or 1
+        with self._open() as dump, ProcessPoolExecutor(workers) as pool:
+            header: Optional[List[str]] = None
+            if self._is_csv:
+                header = next(dump).rstrip('\n').split('\t')
+            pending: Deque[Future] = deque()
+            while True:
+                lines: List[str] = list(
+                    itertools.islice(dump, self.chunk_size)
+                )
+                if not lines:
+                    break
+                pending.append(pool.submit(
+                    _parse_lines, lines, header, self.categories
+                ))
+                if len(pending) >= 2 * workers:
+                    yield from self._result(pending.popleft())
+            while pending:
+                yield from self._result(pending.popleft())
+
+    def _result(self, future: Future) -> List[Product]:
+        '''Private method returning the Products of a parsed chunk,
+        counting its malformed records'''
+        products, malformed = future.result()
+        self.malformed += malformed
+        return products
+
+    @property
+    def _is_csv(self) -> bool:
+        '''Property method telling whether the export is a CSV file'''
+        return '.csv' in self.path.lower()
+
+    def _open(self) -> IO[str]:
+        '''Private method opening the export as a text file,
+        decompressing it on the fly if it is gzip-compressed'''
+        with open(self.path, 'rb') as f:
+            compressed: bool = f.read(2) == b'\x1f\x8b'
+        if compressed:
+            return gzip.open(self.path, 'rt', encoding='utf-8',
+                             errors='replace')
+        return open(self.path, encoding='utf-8', errors='replace')
+
+
+def _parse_lines(lines: List[str], header: Optional[List[str]],
+                 categories: Optional[Set[str]]
+                 ) -> Tuple[List[Product], int]:
+    '''Function run by the Dump parsing processes (module-level to be
+    picklable). Parses a chunk of lines (CSV if a header is provided,
+    JSONL otherwise) and returns the complete Products belonging to
+    the wished categories (every one if None), with the same rules as
+    the API, and the number of malformed records skipped'''
+    if categories is not None:
+        needles: Set[str] = \
+            categories | {c.replace(' ', '-') for c in categories}
+        lines = [  # Cheap pre-filter, skips most of the decoding work
+            line for line in lines
+            if any(needle in line.lower() for needle in needles)
+        ]
+    records: Iterable[Optional[Dict[str, Any]]]
+    if header:
+        records = csv.DictReader(lines, fieldnames=header, delimiter='\t',
+                                 quoting=csv.QUOTE_NONE)
+    else:
+        records = (_loads(line) for line in lines if line.strip())
+    products: List[Product] = []
+    malformed: int = 0
+    for record in records:
+        try:
+            product: Optional[Product] = _to_product(record, categories)
+        except (ValueError, TypeError, AttributeError):
+            malformed += 1
+            continue
+        if product:
+            products.append(product)
+    return products, malformed
+
+
+def _loads(line: str) -> Optional[Dict[str, Any]]:
+    '''Function decoding a JSONL record (None if it is not a JSON
+    object)'''
+    try:
+        record: Any = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def _to_product(record: Optional[Dict[str, Any]],
+                categories: Optional[Set[str]]) -> Optional[Product]:
+    '''Function returning the Product of a record if it is complete
+    and belongs to the wished categories (every one if None).
+    Raises ValueError, TypeError or AttributeError if it is malformed'''
+    if record is None:
+        raise ValueError('Malformed record')
+    code: str = str(record.get('code') or '')
+    if not code.isdigit():
+        return None
+    tags: Set[str] = {
+        re.sub(r'^\w+:', '', tag).replace('-', ' ')
+        for tag in _split(record.get('categories_tags'))
+    }
+    result: Dict[str, Any] = {
+        'id': int(code),
+        'product_name': record.get('product_name'),
+        'nutrition_grades': (record.get('nutrition_grades')
+                             or record.get('nutrition_grade_fr')),
+        'url': record.get('url') or Dump.PRODUCT_URL % code,
+        'stores': record.get('stores'),
+        'categories': record.get('categories'),
+        'last_modified_t': int(record.get('last_modified_t') or 0),
+    }
+    product: Optional[Product] = API.to_product(result)
+    if not product or categories is None:
+        return product
+    matched: Set[str] = categories & (set(product.categories) | tags)
+    if not matched:
+        return None
+    product.categories = sorted(matched)
+    return product
+
+
+def _split(value: Any) -> List[str]:
+    '''Function normalizing a list field of the exports, which is a
+    list in JSONL and a comma-separated string in CSV'''
+    if not value:
+        return []
+    if isinstance(value, str):
+        return value.split(',')
+    return list(value)
@@ -6,10 +6,12 @@ from typing import List
 
 @dataclass
 class Product:
-    '''Class representing a minimal Product from OpenFoodFacts API'''
+    '''Class representing a minimal Product from OpenFoodFacts API.
+    The fields with a default value are optional in the API results.'''
     id: int
     name: str
     nutrition_grades: str
     url: str
     stores: List[str]
     categories: List[str]
+    last_modified_t: int = 0  # Timestamp of the last upstream change
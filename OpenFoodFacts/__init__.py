@@ -1,3 +1,29 @@
 #!/usr/bin/env python3
-from .API import API
+from typing import Any, Dict
+import importlib
+import sys
 from .Product import Product
+
+# Classes imported on first use only, as they depend on modules slow to
+# import (requests) which most of the App modes do not need
+_LAZY_CLASSES: Dict[str, str] = {
+    'API': '.API',
+    'Cache': '.Cache',
+    'Dump': '.Dump',
+}
+
+
+def __getattr__(name: str) -> Any:
+    '''Imports the lazy classes when they are first accessed'''
+    if name not in _LAZY_CLASSES:
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name)
+        )
+    importlib.import_module(_LAZY_CLASSES[name], __name__)
+    # Importing a submodule binds it in the package under the name of
+    # its class: bind the classes of every imported submodule instead
+    for lazy_name, module_name in _LAZY_CLASSES.items():
+        module: Any = sys.modules.get(__name__ + module_name)
+        if module:
+            globals()[lazy_name] = getattr(module, lazy_name)
+    return globals()[name]
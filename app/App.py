@@ -5,14 +5,21 @@ It pilots every actions for the P5 project, as it is the central
 element of the entire program. Its main method is run() which
 dertermines what action to do based on the Params object provided
 while instanciating the App.'''
-from typing import NoReturn, List, Dict, Optional, Any, Generator
+from typing import (NoReturn, List, Dict, Set, Tuple, Optional, Any,
+                    Generator, Iterable, Callable, Hashable, IO)
+from contextlib import contextmanager
 import db.setup
-from db import DB, DBCategory, DBProduct
+from db import DB, DBCategory, DBProduct, Page, Cursor, MemoryCatalog
 from app import Params
-from OpenFoodFacts import API, Product
-from ui import UI, UIFactory
-import yaml
-import os
+from app.Profiler import Profiler
+from app.LRUCache import LRUCache
+from app.Pipeline import Pipeline
+from OpenFoodFacts import Product
+import atexit
+import itertools
+import json
+import sys
+import threading
 
 
 class App:
@@ -20,19 +27,71 @@ class App:
 
     Attributes:
         db: A DB instance used to interact with the database
-        params: A Params instance used to configure the OC P5 actions'''
+        params: A Params instance used to configure the OC P5 actions
+        profiler: A Profiler instance if the profile mode is on
+        cache: A LRUCache instance holding the results of the read
+               methods for a version of the data: once a snapshot reads
+               a newer one, the results depending on the products
+               written since then (by any process) are dropped
+        catalog: A MemoryCatalog instance serving the read methods
+                 if the memory mode is on'''
     db: DB
     params: Params
+    profiler: Optional[Profiler] = None
+    cache: LRUCache
+    catalog: Optional[MemoryCatalog] = None
 
     def __init__(self, params: Params) -> None:
         '''Constructor'''
         self.params = params
+        self.cache = LRUCache(self.params.cache_size)
+        self._cache_lock: threading.Lock = threading.Lock()
+        if self.params.profile:
+            self.profile(self.params.profile)
+        self._configure_db()
         self._connect_db()
+        if self.params.memory:
+            self.load_catalog()
+
+    def load_catalog(self) -> MemoryCatalog:
+        '''Loads the whole catalog in memory: from then on, the read
+        methods are served by the MemoryCatalog, with ProductRecords
+        instead of DBProducts (which are read only). The favorites are
+        still saved in database.'''
+        with self.db.snapshot() as session:
+            self.catalog = MemoryCatalog(session)
+        return self.catalog
+
+    def profile(self, report_file: Optional[str] = None) -> Profiler:
+        '''Turns on the profiling of the App: queries and HTTP calls are
+        measured, as well as every public method. At exit, the summary
+        is printed and saved as JSON in report_file (if provided).
+        Must be called before connecting to the database.'''
+        self.profiler = Profiler()
+        self.profiler.install(self)
+        atexit.register(self._profile_report, report_file)
+        return self.profiler
+
+    def _profile_report(self, report_file: Optional[str]) -> None:
+        '''Private method emitting the profiling report'''
+        print(self.profiler.report())
+        stats: Dict[str, Any] = self.cache.stats()
+        print('Cache applicatif : %d hit(s), %d miss(es) (%.0f %%)' % (
+            stats['hits'], stats['misses'], 100 * stats['hit_rate']
+        ))
+        if report_file:
+            self.profiler.save(report_file)
 
     def run(self) -> None:
         '''Central method starting up the App'''
         if self.params.interactive:
             self._interactive_mode()
+        elif self.params.import_dump:
+            self._import_mode()
+        elif self.params.search:
+            self._search_mode()
+        elif self.params.batch:
+            self._batch_mode()
         else:
             self._db_mode()
             if self.params.setup_db:
@@ -45,94 +104,420 @@ class App:
         database interaction like. Two options are available:
         1. Creating a new database (setup_db mode)
         2. Updating the database (update_db mode)'''
-        self.api = API()
-        categories = self._categories
+        from OpenFoodFacts import API, Cache
+        cache: Optional[Cache] = None
+        if self.params.http_cache:
+            cache = Cache(self.params.http_cache,
+                          ttl=self.params.http_cache_ttl,
+                          max_entries=self.params.http_cache_size)
+        self.api = API(pool_size=self.params.workers,
+                       timeout=self.params.timeout,
+                       retries=self.params.retries,
+                       cache=cache, profiler=self.profiler)
+        categories: List[str]
         if self.params.setup_db:
             print('Cette opération va supprimer toutes les données '
                   'existantes. Continuer ?  [oN]')
             command: str = input('> ').lower()
-            if command == 'o':
-                db.setup.remove_all(self.params.db_uri)
-            else:
+            if command != 'o':
                 print('Abandon')
                 exit()
-            self._connect_db()  # Reconnect
+            # Built aside, the database is replaced once complete only
+            if not self.params.resume:
+                db.setup.remove_all(self.params.staging_uri)
+            self._connect_db(create=True, uri=self.params.staging_uri)
+            categories = self._categories
         else:
             # Overwrites collected categories from YAML config file
             # Goal : update existing categories only without adding
             # a new one
+            self.max_products_by_category = \
+                self._config.get('max_products_by_category')
             categories = [c.name for c in self.db.get_categories()]
-        for category in categories:
-            for product in self._search_api(category):
-                self.db.add(product)
+        try:
+            complete: bool = self._ingest(categories)
+        finally:
+            if cache:
+                print('Cache HTTP : %(hits)d hit(s), %(misses)d miss(es), '
+                      '%(revalidated)d revalidation(s)' % cache.stats())
+            self.api.close()
+        if self.params.setup_db:
+            if not complete:
+                print('Base de données inchangée : relancer avec '
+                      '--setup_db --resume pour terminer sa création')
+                exit()
+            self.db.session.remove()
+            db.setup.swap(self.params.db_uri, self.params.staging_uri)
+            self._connect_db()
+
+    def _ingest(self, categories: List[str]) -> bool:
+        '''Private method collecting the categories from the API into
+        the database through a Pipeline: params.workers threads fetch
+        the API pages while a thread converts the results into Products
+        and the main thread writes them (the SQLAlchemy session is not
+        thread-safe). While updating, only the products modified since
+        the sync watermark of their category are fetched (and written
+        if already stored), and the watermark moves forward once they
+        are written. The results cached for the products written are
+        dropped once a snapshot reads them.
+        The progress is journaled in the database: if params.resume is
+        set, the run starts from the journal of the interrupted one,
+        which is otherwise emptied.
+        Returns True if every category was collected.'''
+        watermarks: Dict[str, Optional[int]] = (
+            self.db.get_watermarks() if self.params.update_db else {}
+        )
+        checkpoints: Dict[str, Tuple[int, bool]] = {}
+        if self.params.resume:
+            checkpoints = self.db.get_checkpoints()
+        else:
+            self.db.clear_checkpoints()
+        pipeline: Pipeline = Pipeline(
+            self.api, self.db, workers=self.params.workers,
+            batch_size=self.params.batch_size,
+            page_size=min(self.max_products_by_category or
+                          self.api.MAX_PAGE_SIZE, self.api.MAX_PAGE_SIZE),
+            max_products=self.max_products_by_category
+        )
+        pipeline.run(categories, watermarks, checkpoints)
+        for category, error in pipeline.errors.items():
+            print('Echec de la collecte de la catégorie %s (%s)'
+                  % (category, error))
+        for product in pipeline.failed:
+            print('Echec de l\'enregistrement du produit %s (%s)'
+                  % (product.id, product.name))
+        print(pipeline.report())
+        print('%d produit(s) inchangé(s)' % self.db.unchanged)
+        if self.db.unknown:
+            print('%d produit(s) hors catalogue ignoré(s)' % self.db.unknown)
+        if pipeline.errors:
+            return False
+        self.db.clear_checkpoints()
+        return True
+
+    def _import_mode(self) -> None:
+        '''Private method used to seed the database from an
+        OpenFoodFacts data export instead of the API.
+        Only the products of the configured categories are kept.'''
+        from OpenFoodFacts import Dump
+        categories: Optional[List[str]] = (  # None: every category
+            None if self._config['categories'] == 'all'
+            else self._categories
+        )
+        dump: Dump = Dump(self.params.import_dump, categories,
+                          workers=self.params.workers)
+        failed: List[Product] = self.db.add_many(
+            dump.products(), self.params.batch_size
+        )
+        for product in failed:
+            print('Echec de l\'enregistrement du produit %s (%s)'
+                  % (product.id, product.name))
+        if dump.malformed:
+            print('%d enregistrements invalides ignorés' % dump.malformed)
+        print('Import des données OK')
+
+    def _search_mode(self) -> None:
+        '''Private method used to print the products best matching
+        the terms searched (params.search), best match first'''
+        products: List[DBProduct] = list(self.search(self.params.search))
+        for product in products:
+            print('(NUTRISCORE: %s) %s [%s]' % (
+                product.nutrition_grade.upper(), product.name, product.id
+            ))
+        if not products:
+            print('Aucun produit trouvé !')
+
+    def _batch_mode(self) -> None:
+        '''Private method used to look up the substitutes of the product
+        ids (barcodes) read line by line from a file (params.batch, "-"
+        for the standard input). Streams one JSON object per line:
+        the substitutes found, or the error for this line.
+        The ids are looked up by chunks of params.batch_size.'''
+        stream: IO[str] = (sys.stdin if self.params.batch == '-'
+                           else open(self.params.batch))
+        with stream:
+            lines: Iterable[str] = (
+                line.strip() for line in stream if line.strip()
+            )
+            while True:
+                chunk: List[str] = list(
+                    itertools.islice(lines, self.params.batch_size)
+                )
+                if not chunk:
+                    break
+                for result in self._batch_results(chunk):
+                    print(json.dumps(result, ensure_ascii=False))
+                sys.stdout.flush()
+
+    def _batch_results(self, lines: List[str]) \
+            -> Generator[Dict[str, Any], None, None]:
+        '''Private method yielding the batch mode result of each line'''
+        substitutes: Dict[int, List[DBProduct]] = \
+            self.get_substitutes_for_many(
+                int(line) for line in lines if line.isdecimal()
+            )
+        for line in lines:
+            if not line.isdecimal():
+                yield {'input': line, 'error': 'Identifiant invalide'}
+            elif int(line) not in substitutes:
+                yield {'id': int(line), 'error': 'Produit inconnu'}
+            else:
+                yield {'id': int(line), 'substitutes': [{
+                    'id': product.id,
+                    'name': product.name,
+                    'nutrition_grade': product.nutrition_grade,
+                    'url': product.url,
+                } for product in substitutes[int(line)]]}
 
     @property
-    def _categories(self) -> List[str]:
+    def _config(self) -> Dict[str, Any]:
         '''Property method acting as a private attribute which
-        contains the categories selected in the config file.'''
+        contains the config file (and sets the maximum number of
+        products by category, None meaning no limit).'''
+        import yaml
         with open(self.params.categories_file) as catego:
             data: Dict[str, Any] = yaml.load(catego)
-        categories: List[str] = data['categories']
-        self.max_products_by_category: int = data['max_products_by_category']
-        if self.max_products_by_category > 100:
-            # 100 products MAX by category
-            self.max_nb_products_by_category = 100
-        if len(categories) > 5:
-            categories = categories[:4]  # 5 categories MAX
-        return categories
-
-    def _connect_db(self) -> DB:
-        '''Private method to onnect to database with db attribute'''
-        base, session = db.setup.start_up(self.params.db_uri)
+        self.max_products_by_category: Optional[int] = \
+            data.get('max_products_by_category')
+        return data
+
+    @property
+    def _categories(self) -> List[str]:
+        '''Property method acting as a private attribute which
+        contains the categories selected in the config file.
+        "all" selects every category of the taxonomy, read from the
+        local file of the "taxonomy" key if any, from the API otherwise
+        (with at least "min_products_by_category" products).'''
+        data: Dict[str, Any] = self._config
+        if data['categories'] != 'all':
+            return data['categories']
+        from OpenFoodFacts import API
+        min_products: int = data.get('min_products_by_category') or 1
+        if data.get('taxonomy'):
+            return API.load_categories(data['taxonomy'], min_products)
+        if getattr(self, 'api', None):
+            return self.api.categories(min_products)
+        api: API = API(timeout=self.params.timeout,
+                       retries=self.params.retries)
+        try:
+            return api.categories(min_products)
+        finally:
+            api.close()
+
+    def _configure_db(self) -> None:
+        '''Private method setting the options of the database engines
+        (connection pool, and SQLite PRAGMA statements given as
+        "name=value,..." in params.pragmas)'''
+        pragmas: Optional[Dict[str, str]] = None
+        if self.params.pragmas is not None:
+            pragmas = dict(
+                pragma.split('=', 1)
+                for pragma in self.params.pragmas.split(',') if pragma
+            )
+        db.setup.configure(pool_size=self.params.pool_size,
+                           max_overflow=self.params.pool_overflow,
+                           pool_recycle=self.params.pool_recycle,
+                           pragmas=pragmas)
+
+    def _connect_db(self, create: bool = False,
+                    uri: Optional[str] = None) -> DB:
+        '''Private method to onnect to database with db attribute
+        (creating the schema if create is True), params.db_uri unless
+        another uri is provided. The cache is emptied, as its results
+        are of the previous database.'''
+        base, session = db.setup.start_up(uri or self.params.db_uri,
+                                          self.profiler, create)
         self.db = DB(base, session)
+        self.cache.clear()
         return self.db
 
-    def _search_api(self, category: str) \
-            -> Generator[Product, None, None]:
-        '''Private method collecting products by category with api attribute'''
-        products: Generator[Product, None, None] = self.api.search(
-            category, self.max_products_by_category
-        )
-        for product in products:
-            product.categories = [category]
-            yield product
-
     def _interactive_mode(self) -> None:
+        from ui import UI, UIFactory
         ui: UI = UIFactory.factory(self.params.ui)
         ui.start(self)
 
+    @contextmanager
+    def snapshot(self) -> Generator[None, None, None]:
+        '''Context manager running the read methods called inside it on
+        a single snapshot of the database (see DB.snapshot()), so that a
+        listing and the substitutes of its products are consistent even
+        while the database is being updated. Does nothing in memory
+        mode, as the MemoryCatalog is not updated.'''
+        if self.catalog:
+            yield
+            return
+        with self.db.snapshot():
+            yield
+
+    def _cached(self, key: Tuple[Any, ...], compute: Callable[[], Any]) \
+            -> Any:
+        '''Private method returning the result of a read method cached
+        for the key (computed by compute if missing), within a snapshot.
+        The cache is moved to the data version of the snapshot first,
+        if it is newer.'''
+        version: Optional[int] = self.db.data_version()
+        if version is not None and (self.cache.version or 0) < version:
+            self._outdate_cache(version)
+        return self.cache.get(key, compute, version)
+
+    def _outdate_cache(self, version: int) -> None:
+        '''Private method moving the cache to the data version read by
+        the snapshot of the current thread: only the results which may
+        depend on the products written since the version of the cache
+        are dropped (every one if the data has been replaced)'''
+        with self._cache_lock:  # Moved by a single thread
+            if self.cache.version is None:
+                self.cache.clear(version)
+                return
+            if self.cache.version >= version:
+                return  # Moved meanwhile
+            changed: Optional[List[int]] = self.db.get_changes(
+                self.cache.version
+            )
+            if changed is None:
+                self.cache.clear(version)
+                return
+            products: Set[int] = set(changed)
+            categories: Set[int] = self.db.get_category_ids(products)
+
+            def stale(key: Hashable, result: Any) -> bool:
+                '''Tells whether a result may have changed: the listings
+                and substitutes sharing a category with the products
+                written, or listing one of them, the details of these
+                products or of their favorites, and the search results'''
+                kind: str = key[0]
+                if kind == 'details':
+                    return key[1] in products or result is not None and any(
+                        p.id in products for p in result.substitutes
+                    )
+                if kind == 'products':
+                    return (key[1] in categories
+                            or any(p.id in products for p in result))
+                if kind == 'substitutes':
+                    return (not categories.isdisjoint(key[1][1])
+                            or any(p.id in products for p in result))
+                return True
+
+            self.cache.outdate(version, stale)
+
     def get_categories(self) -> Generator[DBCategory, None, None]:
         '''Get all categories'''
-        for category in self.db.get_categories():
+        if self.catalog:
+            yield from self.catalog.get_categories()
+            return
+        with self.db.snapshot():
+            categories: List[DBCategory] = list(self.db.get_categories())
+        for category in categories:
             yield category
 
     def get_products(self, category_id: int) \
             -> Generator[DBProduct, None, None]:
         '''Get all products by category (id)'''
-        products: List[DBProduct] = sorted(
-            self.db.get_products_by_category(category_id),
-            key=lambda p: (p.nutrition_grade, p.name), reverse=True
-        )
+        if self.catalog:
+            yield from self.catalog.get_products_by_category(category_id)
+            return
+        with self.db.snapshot():
+            products: List[DBProduct] = self._cached(
+                ('products', category_id),
+                lambda: self.db.get_products_by_category(category_id)
+            )
         for product in products:
             yield product
 
+    def get_products_page(self, category_id: int,
+                          after: Optional[Cursor] = None,
+                          before: Optional[Cursor] = None) -> Page:
+        '''Get a page of products by category (id), starting after
+        the cursor after or ending before the cursor before'''
+        if self.catalog:
+            return self.catalog.get_products_page(
+                category_id, self.params.page_size, after, before
+            )
+        with self.db.snapshot():
+            return self.db.get_products_page(
+                category_id, self.params.page_size, after, before
+            )
+
     def get_product_details(self, product_id: int) -> DBProduct:
-        '''Get a product details (by id)'''
-        return self.db.get_product_by_id(product_id)
+        '''Get a product details (by id), with its stores and
+        substitutes loaded by the same query'''
+        if self.catalog:
+            return self.catalog.get_product_by_id(product_id)
+        with self.db.snapshot():
+            return self._cached(
+                ('details', product_id),
+                lambda: self.db.get_product_by_id(
+                    product_id, load=('stores', 'substitutes')
+                )
+            )
 
-    def get_substitutes_for(self, product_id: int) \
+    def get_substitutes_for(self, product_id: int, limit: int = 10) \
             -> Generator[DBProduct, None, None]:
-        '''Get substitues for a product (by id)'''
-        for product in self.db.get_substitutes_for(product_id):
+        '''Get the limit best substitues for a product (by id).
+        They are cached by grade and categories of the product, as
+        every product sharing both has the same substitutes.'''
+        if self.catalog:
+            yield from self.catalog.get_substitutes_for(product_id, limit)
+            return
+        with self.db.snapshot():
+            key: Optional[Any] = self.db.get_substitutes_key(product_id)
+            products: List[DBProduct] = self._cached(
+                ('substitutes', key, limit),
+                lambda: self.db.get_substitutes_for(product_id, limit)
+            ) if key else []
+        for product in products:
             yield product
 
+    def get_substitutes_for_many(self, product_ids: Iterable[int],
+                                 limit: int = 10) \
+            -> Dict[int, List[DBProduct]]:
+        '''Get the limit best substitutes for several products (by id)
+        at once. Returns an id -> substitutes dictionary, without the
+        unknown ids.'''
+        if self.catalog:
+            return self.catalog.get_substitutes_for_many(product_ids, limit)
+        with self.db.snapshot():
+            return self.db.get_substitutes_for_many(product_ids, limit)
+
+    def search(self, terms: str, limit: int = 20) \
+            -> Generator[DBProduct, None, None]:
+        '''Get the limit products best matching the search terms
+        (names, stores or categories beginning with them)'''
+        with self.db.snapshot():
+            products: List[DBProduct] = self._cached(
+                ('search', terms, limit),
+                lambda: self.db.search(terms, limit)
+            )
+        for product in products:
+            yield (self.catalog.get_product_by_id(product.id)
+                   if self.catalog else product)
+
     def add_favorite(self, substituted: DBProduct,
                      substituter: DBProduct) -> List[DBProduct]:
         '''Add a new favorite substitution (with id of the substitute
         and the substituted product) and returns both DBProducts'''
-        return self.db.add_favorite(substituted, substituter)
+        if self.catalog:  # Saved with the DBProducts of the records
+            with self.db.unit_of_work():
+                self.db.add_favorite(
+                    self.db.get_product_by_id(substituted.id),
+                    self.db.get_product_by_id(substituter.id)
+                )
+            self.catalog.add_favorite(substituted.id, substituter.id)
+            return [substituted, substituter]
+        with self.db.unit_of_work():
+            favorites: List[DBProduct] = self.db.add_favorite(
+                substituted, substituter
+            )
+        return favorites
 
     def get_favorite_products(self) -> Generator[DBProduct, None, None]:
         '''Get all saved products'''
-        for favorite in self.db.get_favorite_products():
+        if self.catalog:
+            yield from self.catalog.get_favorite_products()
+            return
+        with self.db.snapshot():
+            favorites: List[DBProduct] = self.db.get_favorite_products(
+                load=('stores', 'substitutes')
+            )
+        for favorite in favorites:
             yield favorite
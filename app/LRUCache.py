@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''Class caching the results of the App read methods'''
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Hashable, Optional
+import threading
+
+
+class LRUCache:
+    '''Size-bounded cache of results, evicting the least recently used
+    ones first. A max_size of 0 disables the cache.
+
+    Attributes:
+        max_size: Maximum number of results kept
+        version:  Version of the data the cached results are valid for
+                  (see outdate())
+        hits:     Number of results found in the cache
+        misses:   Number of results computed'''
+
+    def __init__(self, max_size: int = 256) -> None:
+        '''Constructor'''
+        self.max_size = max_size
+        self.version: Optional[int] = None
+        self.hits: int = 0
+        self.misses: int = 0
+        self._results: OrderedDict = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Any],
+            version: Optional[int] = None) -> Any:
+        '''Returns the result cached for the key, computing (and
+        caching) it with compute if it is missing. The results of
+        another version of the data than the cached ones are always
+        computed, and not cached.'''
+        with self._lock:
+            if version == self.version and key in self._results:
+                self.hits += 1
+                self._results.move_to_end(key)
+                return self._results[key]
+            self.misses += 1
+        result: Any = compute()
+        if self.max_size > 0:
+            with self._lock:
+                if version != self.version:  # Outdated meanwhile
+                    return result
+                self._results[key] = result
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_size:
+                    self._results.popitem(last=False)
+        return result
+
+    def clear(self, version: Optional[int] = None) -> None:
+        '''Drops every cached result (after a write to the database),
+        the results cached next being of the version of the data
+        provided'''
+        with self._lock:
+            self._results.clear()
+            self.version = version
+
+    def outdate(self, version: int,
+                stale: Callable[[Hashable, Any], bool]) -> None:
+        '''Moves the cache to a newer version of the data, dropping the
+        cached results which may have changed since the version of the
+        cache: the ones for which stale(key, result) is true'''
+        with self._lock:
+            for key in [key for key, result in self._results.items()
+                        if stale(key, result)]:
+                del self._results[key]
+            self.version = version
+
+    def stats(self) -> Dict[str, Any]:
+        '''Returns the counters and the hit rate of the cache'''
+        with self._lock:
+            lookups: int = self.hits + self.misses
+            return {
+                'size': len(self._results),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        '''Returns the number of cached results'''
+        return len(self._results)
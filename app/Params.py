@@ -10,24 +10,58 @@ class Params:
     '''"Container"-like class meant to hold all parameters for the App'''
     setup_db: bool = False
     update_db: bool = False
+    resume: bool = False
+    import_dump: Optional[str] = None
     user: str = 'OCP5'
     password: str = 'OCP5'
     dbname: str = 'OCP5'
     search: Optional[str] = None
+    batch: Optional[str] = None
     category: Optional[str] = None
     tag: Optional[str] = None
     categories_file: str = 'categories.yml'
     interactive: bool = False
     ui: str = 'console'
+    host: str = '127.0.0.1'
+    port: int = 8000
+    page_size: int = 20
+    cache_size: int = 256
+    memory: bool = False
+    profile: Optional[str] = None
+    workers: int = 4
+    batch_size: int = 500
+    pool_size: int = 5
+    pool_overflow: int = 10
+    pool_recycle: int = 3600
+    pragmas: Optional[str] = None
+    timeout: float = 10.0
+    retries: int = 3
+    http_cache: Optional[str] = None
+    http_cache_ttl: int = 3600
+    http_cache_size: int = 1000
 
     @property
     def db_uri(self) -> str:
         '''Property method returning the database URI.
         Creates dynamically the MySQL URI.'''
+        return self._uri(self.dbname)
+
+    @property
+    def staging_uri(self) -> str:
+        '''Property method returning the URI of the staging database,
+        filled by setup_db before replacing the database with it
+        (file "[DBNAME].staging" for SQLite, database "[DBNAME]_staging"
+        for MySQL)'''
         if 'sqlite' in self.dbname:
-            return self.dbname
+            return self._uri(self.dbname + '.staging')
+        return self._uri(self.dbname + '_staging')
+
+    def _uri(self, dbname: str) -> str:
+        '''Private method returning the URI of a database'''
+        if 'sqlite' in dbname:
+            return dbname
         else:
             return (
                 'mysql+mysqlconnector://%s:%s@localhost/%s?charset=utf8mb4'
-                % (self.user, self.password, self.dbname)
+                % (self.user, self.password, dbname)
             )
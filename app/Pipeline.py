@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+'''Class collecting the products of the API into the database'''
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import (Dict, List, Set, Tuple, Optional, Any, Iterable,
+                    Callable)
+import itertools
+import queue
+import threading
+import time
+from db import DB
+from OpenFoodFacts import Product
+
+
+@dataclass
+class StageStats:
+    '''Measures collected for a stage of the Pipeline
+
+    Attributes:
+        items:     Number of items processed
+        seconds:   Time spent processing them (waiting excluded)
+        max_depth: Maximum number of items waiting in the output queue
+        depths:    Sum of the depths of the output queue at each put
+        puts:      Number of items put in the output queue'''
+    items: int = 0
+    seconds: float = 0.0
+    max_depth: int = 0
+    depths: int = 0
+    puts: int = 0
+
+
+class Pipeline:
+    '''Ingestion pipeline in three stages, connected by bounded queues
+    so that they run concurrently: a full queue blocks the stage
+    feeding it (backpressure).
+    1. fetch: a pool of threads walks the API pages of the categories
+       and queues their raw results
+    2. normalize: a thread converts the results into Products (fields
+       split and validated), up to max_products per category. The
+       incremental walks (since the watermark of their category) are
+       not capped, as their products are updated only, never added:
+       the catalog stays within the products of the capped walks.
+       A product is linked to every category of the run it belongs to
+       upstream, and collected once only even if several categories
+       list it (the other categories listing it are linked to it
+       afterwards).
+    3. write: the calling thread writes the Products by batches, as
+       the SQLAlchemy session is not thread-safe, and moves the sync
+       watermark of each category once all its products are written
+    After each batch, the progress of its categories (page and last
+    product written) is journaled in the DB, so that an interrupted run
+    can be resumed from the page of its last batch (products written
+    again are skipped by the content hash check of DB).
+
+    Class attributes:
+        STAGES: Names of the stages, in order
+
+    Attributes:
+        api:          The API queried
+        db:           The DB written
+        workers:      Number of fetching threads
+        dedupe_size:  Number of product ids remembered to skip the
+                      products already collected (memory stays bounded,
+                      older duplicates are skipped by the content hash
+                      check of DB)
+        batch_size:   Number of products written per transaction
+        on_write:     Function called after each batch written (to
+                      invalidate what was read from the database)
+        page_size:    Number of results per API page
+        max_products: Maximum number of products per category
+        queue_size:   Capacity of the queues between the stages
+        stats:        The StageStats, by stage name
+        duplicates:   Number of products skipped as already collected
+        failed:       The products which could not be written
+        errors:       The error raised while fetching each category
+        elapsed:      Duration of the last run (in seconds)'''
+    STAGES: List[str] = ['fetch', 'normalize', 'write']
+
+    # Markers (with a value) queued behind the results of a category,
+    # and marker queued behind the results of all of them
+    _END: str = 'end'
+    _ERROR: str = 'error'
+    _LINK: str = 'link'  # Product collected with another category
+    _DONE: object = object()
+
+    def __init__(self, api: Any, db: DB, workers: int = 4,
+                 batch_size: int = 500, page_size: int = 20,
+                 max_products: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 dedupe_size: int = 200000,
+                 on_write: Optional[Callable[[], None]] = None) -> None:
+        '''Constructor'''
+        self.api = api
+        self.db = db
+        self.workers = workers
+        self.dedupe_size = dedupe_size
+        self.batch_size = batch_size
+        self.on_write = on_write
+        self.page_size = page_size
+        self.max_products = max_products
+        self.queue_size = queue_size or 2 * batch_size
+        self.stats: Dict[str, StageStats] = {
+            stage: StageStats() for stage in self.STAGES
+        }
+        self.duplicates: int = 0
+        self.failed: List[Product] = []
+        self.errors: Dict[str, Exception] = {}
+        self.elapsed: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+        self._complete: Set[str] = set()  # Categories not to fetch anymore
+        self._wanted: Set[str] = set()  # Categories of the run
+        self._incremental: Set[str] = set()  # Fetched since a watermark
+        self._recent: Dict[int, None] = {}  # Ids collected, oldest first
+
+    def run(self, categories: Iterable[str],
+            watermarks: Optional[Dict[str, Optional[int]]] = None,
+            checkpoints: Optional[Dict[str, Tuple[int, bool]]] = None
+            ) -> None:
+        '''Collects the products of the categories (only the ones
+        modified since the watermark of their category, if provided),
+        resuming from the checkpoints journaled by a previous run,
+        if provided: complete categories are skipped, the others
+        start from the page of their last batch'''
+        watermarks = watermarks or {}
+        checkpoints = checkpoints or {}
+        categories = list(categories)
+        self._wanted = set(categories)
+        self._incremental = {c for c in categories if watermarks.get(c)}
+        pages: Dict[str, int] = {}  # Page to start from, by category
+        for category, (page, done) in checkpoints.items():
+            if done:
+                self._complete.add(category)
+            else:
+                pages[category] = page
+        categories = [c for c in categories if c not in self._complete]
+        results: queue.Queue = queue.Queue(self.queue_size)
+        products: queue.Queue = queue.Queue(self.queue_size)
+        start: float = time.perf_counter()
+        normalizer: threading.Thread = threading.Thread(
+            target=self._normalize, args=(results, products, pages),
+            daemon=True
+        )
+        normalizer.start()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            fetchers = [
+                pool.submit(self._fetch, category, watermarks.get(category),
+                            pages.get(category, 1), results)
+                for category in categories
+            ]
+            feeder: threading.Thread = threading.Thread(
+                target=self._close, args=(fetchers, results), daemon=True
+            )
+            feeder.start()
+            try:
+                self._write(products)
+            finally:
+                self._stop.set()  # Unblocks the stages if write failed
+        normalizer.join()
+        self.elapsed = time.perf_counter() - start
+
+    def report(self) -> str:
+        '''Returns the summary table of the stages'''
+        lines: List[str] = ['%-10s %8s %10s %8s %10s %10s' % (
+            'STAGE', 'ITEMS', 'ITEMS/s', 'BUSY', 'QUEUE AVG', 'QUEUE MAX'
+        )]
+        for stage in self.STAGES:
+            stats: StageStats = self.stats[stage]
+            lines.append('%-10s %8d %10.1f %7.0f%% %10.1f %10d' % (
+                stage, stats.items,
+                stats.items / self.elapsed if self.elapsed else 0.0,
+                100 * stats.seconds / self.elapsed if self.elapsed else 0.0,
+                stats.depths / stats.puts if stats.puts else 0.0,
+                stats.max_depth
+            ))
+        lines.append('%d duplicate(s) skipped' % self.duplicates)
+        return '\n'.join(lines)
+
+    def _fetch(self, category: str, modified_since: Optional[int],
+               page: int, results: queue.Queue) -> None:
+        '''Private method run by the fetching threads: queues the raw
+        results of a category (with their page) from the page
+        provided, then its end marker (or error marker)'''
+        stats: StageStats = self.stats['fetch']
+        pages: Any = self.api.search_results(category, self.page_size,
+                                             modified_since, page)
+        try:
+            for position in itertools.count():
+                if category in self._complete or self._stop.is_set():
+                    break
+                start: float = time.perf_counter()
+                result: Optional[Dict[str, Any]] = next(pages, None)
+                self._measure(stats, start, 1 if result else 0)
+                if result is None:
+                    break
+                self._put(results, (category, result,
+                                    page + position // self.page_size),
+                          stats)
+            self._put(results, (category, (self._END, None), None), stats)
+        except Exception as error:
+            self._put(results, (category, (self._ERROR, error), None),
+                      stats)
+        finally:
+            pages.close()  # Releases the response being downloaded
+
+    def _close(self, fetchers: List[Any], results: queue.Queue) -> None:
+        '''Private method queueing the final marker once every fetching
+        thread is over'''
+        for fetcher in fetchers:
+            fetcher.exception()  # Waits, errors are queued by _fetch
+        self._put(results, self._DONE, self.stats['fetch'])
+
+    def _normalize(self, results: queue.Queue, products: queue.Queue,
+                   pages: Dict[str, int]) -> None:
+        '''Private method run by the normalizing thread: converts the
+        raw results into Products, counted by category (including the
+        products of the pages skipped by a resumed run)'''
+        stats: StageStats = self.stats['normalize']
+        counts: Dict[str, int] = {
+            category: (page - 1) * self.page_size
+            for category, page in pages.items()
+        }
+        latest: Dict[str, int] = {}  # Latest modification, by category
+        while True:
+            item: Any = self._get(results)
+            if item is None or item is self._DONE:
+                self._put(products, self._DONE, stats)
+                return
+            category, result, page = item
+            if isinstance(result, dict):
+                start: float = time.perf_counter()
+                product: Optional[Product] = self.api.to_product(result)
+                self._measure(stats, start)
+                if not product or category in self._complete:
+                    continue
+                counts[category] = counts.get(category, 0) + 1
+                latest[category] = max(latest.get(category, 0),
+                                       product.last_modified_t)
+                # An incremental walk is not capped, the products beyond
+                # the cap would never be fetched again otherwise
+                if self.max_products and \
+                        category not in self._incremental and \
+                        counts[category] >= self.max_products:
+                    self._complete.add(category)  # Stops its fetching
+                if self._seen(product.id):
+                    # Already collected with another category: linked to
+                    # this one too, unless listed in it upstream
+                    if category not in product.categories:
+                        link: Tuple[str, int] = (self._LINK, product.id)
+                        self._put(products, (category, link, page), stats)
+                    continue
+                product.categories = sorted(
+                    self._wanted.intersection(product.categories)
+                    | {category}
+                )
+                item = (category, product, page)
+            elif result[0] == self._END:  # With the watermark to set
+                item = (category, (self._END, latest.get(category)), None)
+            self._put(products, item, stats)
+
+    def _seen(self, product_id: int) -> bool:
+        '''Private method telling whether a product has already been
+        collected, remembering the last dedupe_size products only'''
+        if product_id in self._recent:
+            self.duplicates += 1
+            return True
+        self._recent[product_id] = None
+        if len(self._recent) > self.dedupe_size:
+            del self._recent[next(iter(self._recent))]  # Oldest one
+        return False
+
+    def _write(self, products: queue.Queue) -> None:
+        '''Private method run by the calling thread: writes the Products
+        by batches (with the categories to link to the products already
+        collected), journals the progress of their categories, and moves
+        the watermarks of the complete categories. The products of the
+        incremental walks are written only if already stored.'''
+        stats: StageStats = self.stats['write']
+        batch: List[Product] = []
+        updates: Set[int] = set()  # Products to write if already stored
+        links: Dict[int, Set[str]] = {}  # Categories to link, by product
+        dirty: Set[str] = set()  # Categories with failed products
+        # Page and last product queued, by category
+        progress: Dict[str, Tuple[int, Optional[int]]] = {}
+        while True:
+            item: Any = self._get(products)
+            if item is None:
+                return
+            if item is self._DONE:
+                self._write_batch(batch, updates, links, progress, stats)
+                return
+            category, product, page = item
+            if isinstance(product, Product):
+                batch.append(product)
+                if category in self._incremental:
+                    updates.add(product.id)
+                progress[category] = (page, product.id)
+                if len(batch) >= self.batch_size:
+                    dirty.update(self._write_batch(batch, updates, links,
+                                                   progress, stats))
+                    batch = []
+                continue
+            marker, value = product
+            if marker == self._LINK:  # Written with the next batch
+                links.setdefault(value, set()).add(category)
+                progress[category] = (page, value)
+                continue
+            # End of a category: its products are written first
+            dirty.update(self._write_batch(batch, updates, links, progress,
+                                           stats))
+            batch = []
+            if marker == self._ERROR:
+                self.errors[category] = value
+                continue
+            if value is not None and category not in dirty:
+                self.db.set_watermark(category, value)
+            self.db.save_checkpoints(
+                {category: progress.pop(category, (1, None))}, done=True
+            )
+
+    def _write_batch(self, batch: List[Product], updates: Set[int],
+                     links: Dict[int, Set[str]],
+                     progress: Dict[str, Tuple[int, Optional[int]]],
+                     stats: StageStats) -> Set[str]:
+        '''Private method writing a batch of products (the ones of
+        updates only if already stored), then linking the categories
+        pending (updates and links are emptied), journaling the progress
+        of their categories and calling on_write.
+        Returns the categories of the products which failed.'''
+        if not batch and not links:
+            return set()
+        start: float = time.perf_counter()
+        failed: List[Product] = self.db.add_many(batch, self.batch_size,
+                                                 stored_only=updates)
+        updates.clear()
+        if links:
+            self.db.add_categories_to(links)
+            links.clear()
+        self.db.save_checkpoints(progress)
+        if self.on_write:
+            self.on_write()
+        self._measure(stats, start, len(batch))
+        self.failed.extend(failed)
+        return {category for p in failed for category in p.categories}
+
+    def _put(self, out: queue.Queue, item: Any, stats: StageStats) -> None:
+        '''Private method queueing an item, waiting for room while the
+        pipeline is running, and measuring the depth of the queue'''
+        while not self._stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            with self._lock:
+                depth: int = out.qsize()
+                stats.puts += 1
+                stats.depths += depth
+                stats.max_depth = max(stats.max_depth, depth)
+            return
+
+    def _get(self, source: queue.Queue) -> Any:
+        '''Private method waiting for an item while the pipeline is
+        running (returns None once it is stopped)'''
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _measure(self, stats: StageStats, start: float,
+                 items: int = 1) -> None:
+        '''Private method adding the items processed since start'''
+        with self._lock:
+            stats.items += items
+            stats.seconds += time.perf_counter() - start
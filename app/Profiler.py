@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+'''Class collecting the queries and latencies of the App'''
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Any, Callable, Generator, Iterable
+import functools
+import inspect
+import json
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass
+class Stats:
+    '''Measures collected for an App method (or for the HTTP calls)
+
+    Attributes:
+        calls:       Number of calls
+        seconds:     Total time spent in the calls
+        queries:     Number of SQL queries run during the calls
+        sql_seconds: Time spent running these SQL queries
+        rows:        Number of rows returned (or written) by the calls
+        bytes:       Number of bytes downloaded (HTTP calls only)'''
+    calls: int = 0
+    seconds: float = 0.0
+    queries: int = 0
+    sql_seconds: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+
+
+class Profiler:
+    '''Class collecting the queries and latencies of the App.
+    Hooks on the SQLAlchemy engine events to measure the queries,
+    which are charged to the App method running when they occur.
+
+    Class attributes:
+        OTHER: Name under which the measures outside App methods
+               (ingestion, start up...) are collected
+        HTTP:  Name under which the HTTP calls are collected
+
+    Attributes:
+        stats: The Stats collected, by App method'''
+    OTHER: str = '(other)'
+    HTTP: str = '(http)'
+
+    def __init__(self) -> None:
+        '''Constructor'''
+        self.stats: Dict[str, Stats] = {}
+        self._local: threading.local = threading.local()
+        self._lock: threading.Lock = threading.Lock()
+        self._engines: List[Engine] = []  # Engines already listened to
+
+    def attach_engine(self, engine: Engine) -> None:
+        '''Listens to the queries run by the engine (once, as engines
+        are shared by the connections to a same database)'''
+        if engine in self._engines:
+            return
+        self._engines.append(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_query)
+        event.listen(engine, 'after_cursor_execute', self._after_query)
+
+    def install(self, app: Any,
+                exclude: Iterable[str] = ('run', 'profile', 'snapshot')
+                ) -> None:
+        '''Times every public method of the App (but the excluded ones).
+        The methods are looked up on the class, so that the properties
+        of the App are not evaluated.'''
+        for name, _ in inspect.getmembers(type(app), inspect.isfunction):
+            if not name.startswith('_') and name not in exclude:
+                setattr(app, name, self.wrap(name, getattr(app, name)))
+
+    def wrap(self, name: str, method: Callable) -> Callable:
+        '''Returns the method, timed under name. Generators are timed
+        while they are consumed and their items are counted as rows.'''
+        @functools.wraps(method)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with self._measure(name) as stats:
+                result: Any = method(*args, **kwargs)
+                if not inspect.isgenerator(result):
+                    stats.rows += self._count(result)
+                    return result
+            return self._timed_generator(name, result)
+        return wrapper
+
+    def record_http(self, seconds: float, size: int) -> None:
+        '''Records an HTTP call (hook used by OpenFoodFacts.API)'''
+        with self._lock:
+            stats: Stats = self.stats.setdefault(self.HTTP, Stats())
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.bytes += size
+
+    def report(self) -> str:
+        '''Returns the summary table of the collected measures'''
+        lines: List[str] = [
+            '%-24s %7s %10s %8s %10s %8s %10s' % (
+                'METHOD', 'CALLS', 'TIME (s)', 'QUERIES', 'SQL (s)',
+                'ROWS', 'BYTES'
+            )
+        ]
+        for name, stats in sorted(self.stats.items(),
+                                  key=lambda item: -item[1].seconds):
+            lines.append('%-24s %7d %10.3f %8d %10.3f %8d %10d' % (
+                name, stats.calls, stats.seconds, stats.queries,
+                stats.sql_seconds, stats.rows, stats.bytes
+            ))
+        return '\n'.join(lines)
+
+    def save(self, path: str) -> None:
+        '''Writes the collected measures to a JSON file'''
+        with open(path, 'w') as f:
+            json.dump(
+                {name: asdict(stats) for name, stats in self.stats.items()},
+                f, indent=2
+            )
+
+    def _timed_generator(self, name: str,
+                         generator: Generator) -> Generator:
+        '''Private method timing the consumption of a generator'''
+        while True:
+            with self._measure(name, call=False) as stats:
+                try:
+                    item: Any = next(generator)
+                except StopIteration:
+                    return
+                stats.rows += 1
+            yield item
+
+    @contextmanager
+    def _measure(self, name: str,
+                 call: bool = True) -> Generator[Stats, None, None]:
+        '''Private context manager timing a method and charging it the
+        queries run meanwhile in the same thread'''
+        with self._lock:
+            stats: Stats = self.stats.setdefault(name, Stats())
+            if call:
+                stats.calls += 1
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(name)
+        start: float = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            self._local.stack.pop()
+            with self._lock:
+                stats.seconds += time.perf_counter() - start
+
+    def _current(self) -> str:
+        '''Private method returning the method running in the thread'''
+        stack: List[str] = getattr(self._local, 'stack', [])
+        return stack[-1] if stack else self.OTHER
+
+    def _before_query(self, conn: Any, cursor: Any, statement: str,
+                      parameters: Any, context: Any,
+                      executemany: bool) -> None:
+        '''Engine event: a query is about to run'''
+        context._profiler_start = time.perf_counter()
+
+    def _after_query(self, conn: Any, cursor: Any, statement: str,
+                     parameters: Any, context: Any,
+                     executemany: bool) -> None:
+        '''Engine event: a query has run'''
+        elapsed: float = time.perf_counter() - context._profiler_start
+        with self._lock:
+            stats: Stats = self.stats.setdefault(self._current(), Stats())
+            stats.queries += 1
+            stats.sql_seconds += elapsed
+            if self._current() == self.OTHER and cursor.rowcount > 0:
+                stats.rows += cursor.rowcount  # Rows written
+
+    @staticmethod
+    def _count(result: Any) -> int:
+        '''Private static method counting the rows of a result'''
+        if result is None:
+            return 0
+        items: Any = getattr(result, 'items', result)  # Pages
+        if callable(items):  # Dictionaries
+            items = result
+        try:
+            return len(items)
+        except TypeError:
+            return 1
@@ -1,3 +1,6 @@
 #!/usr/bin/env python3
 from .App import App
 from .Params import Params
+from .LRUCache import LRUCache
+from .Pipeline import Pipeline
+from .Profiler import Profiler
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''Class generating a synthetic catalog of products'''
+from itertools import accumulate
+from typing import List, Generator
+import random
+from OpenFoodFacts import Product
+
+
+class Catalog:
+    '''Class generating a synthetic catalog of products for the
+    benchmarks. Categories and stores follow a Zipf-like skew (a few
+    of them hold most of the products), as in the OpenFoodFacts data.
+
+    Class attributes:
+        GRADES:  The nutrition grades
+        WEIGHTS: Frequency of every nutrition grade
+
+    Attributes:
+        size:       Number of products to generate
+        categories: Names of the generated categories
+        stores:     Names of the generated stores
+        seed:       Seed of the random generator (reproducible catalogs)'''
+    GRADES: str = 'abcde'
+    WEIGHTS: List[float] = [0.15, 0.2, 0.25, 0.2, 0.2]
+
+    def __init__(self, size: int, nb_categories: int = 500,
+                 nb_stores: int = 50, seed: int = 5) -> None:
+        '''Constructor'''
+        self.size = size
+        self.categories: List[str] = [
+            'category %d' % i for i in range(nb_categories)
+        ]
+        self.stores: List[str] = ['store %d' % i for i in range(nb_stores)]
+        self.seed = seed
+
+    def products(self) -> Generator[Product, None, None]:
+        '''Yields the Products of the catalog'''
+        rnd: random.Random = random.Random(self.seed)
+        category_weights: List[float] = self._zipf(len(self.categories))
+        store_weights: List[float] = self._zipf(len(self.stores))
+        for id in range(1, self.size + 1):
+            yield Product(
+                id=id,
+                name='product %d %s' % (id, rnd.choice('abcdefghij')),
+                nutrition_grades=rnd.choices(self.GRADES, self.WEIGHTS)[0],
+                url='https://fr.openfoodfacts.org/produit/%d' % id,
+                stores=rnd.choices(
+                    self.stores, cum_weights=store_weights,
+                    k=rnd.randint(1, 3)
+                ),
+                categories=rnd.choices(
+                    self.categories, cum_weights=category_weights,
+                    k=rnd.randint(1, 4)
+                ),
+            )
+
+    @staticmethod
+    def _zipf(size: int, exponent: float = 1.1) -> List[float]:
+        '''Private static method returning Zipf cumulative weights'''
+        return list(accumulate(1 / (rank ** exponent)
+                               for rank in range(1, size + 1)))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''Micro-benchmarks of the DB class hot paths against SQLite.
+Fills a database with a synthetic Catalog of each requested size, times
+the DB methods, then saves the results as JSON (one file per commit) so
+that they can be compared between commits.
+
+Usage:
+    python -m bench.db_bench [--sizes 10000,100000,1000000]
+                             [--output bench/results]
+                             [--compare bench/results/OTHER.json]'''
+from typing import Dict, List, Any, Callable, Optional
+import getopt
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import db.setup
+from db import DB
+from bench import Catalog
+
+
+def timed(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    '''Function running a function repeat times.
+    Returns the median and minimum durations in milliseconds.'''
+    durations: List[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(durations),
+        'min_ms': min(durations),
+    }
+
+
+def bench_size(size: int, repeat: int = 20) -> Dict[str, Any]:
+    '''Function filling a new SQLite database with size products and
+    timing the DB methods on it. Returns the measures.'''
+    results: Dict[str, Any] = {}
+    directory: str = tempfile.mkdtemp()
+    base, session = db.setup.start_up(
+        'sqlite:///%s' % os.path.join(directory, 'bench.db')
+    )
+    database: DB = DB(base, session)
+    catalog: Catalog = Catalog(size)
+    start: float = time.perf_counter()
+    database.add_many(catalog.products(), batch_size=5000)
+    elapsed: float = time.perf_counter() - start
+    results['fill'] = {'seconds': elapsed, 'products_s': size / elapsed}
+    rnd: random.Random = random.Random(size)
+    ids: List[int] = rnd.sample(range(1, size + 1), repeat)
+    extra: List[Any] = list(Catalog(repeat, seed=size).products())
+    for i, product in enumerate(extra):  # New products, not updates
+        product.id = size + i + 1
+    top_category: int = database.category_names.lookup(
+        {catalog.categories[0]}
+    )[0][catalog.categories[0]]
+    start = time.perf_counter()
+    database.substitutes.build(session)
+    results['substitutes_index_build'] = {
+        'seconds': time.perf_counter() - start
+    }
+    new_products = iter(extra)
+    results['add'] = timed(lambda: database.add(next(new_products)), repeat)
+    results['get_products_by_category'] = timed(
+        lambda: database.get_products_by_category(top_category), 3
+    )
+    results['get_products_page'] = timed(
+        lambda: database.get_products_page(top_category, 20), repeat
+    )
+    substituted = iter(ids)
+    results['get_substitutes_for'] = timed(
+        lambda: database.get_substitutes_for(next(substituted)), repeat
+    )
+    results['get_substitutes_for_many'] = timed(
+        lambda: database.get_substitutes_for_many(ids), 3
+    )
+    searched = iter(ids)
+    results['search'] = timed(
+        lambda: database.search('product %d' % next(searched)), repeat
+    )
+    pairs = iter(zip(ids, ids[1:] + ids[:1]))
+
+    def add_favorite() -> None:
+        '''Adds a favorite substitution between two random products'''
+        substituted_id, substituter_id = next(pairs)
+        database.add_favorite(
+            database.get_product_by_id(substituted_id),
+            database.get_product_by_id(substituter_id)
+        )
+    results['add_favorite'] = timed(add_favorite, repeat)
+    results['get_favorite_products'] = timed(
+        lambda: database.get_favorite_products(), repeat
+    )
+    session.close()
+    shutil.rmtree(directory)
+    return results
+
+
+def commit_id() -> str:
+    '''Function returning the short id of the current git commit'''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> None:
+    '''Function printing the ratio current / previous of the medians'''
+    print('%-10s %-28s %12s %12s %8s' % (
+        'SIZE', 'BENCHMARK', 'BEFORE (ms)', 'AFTER (ms)', 'RATIO'
+    ))
+    for size, benchmarks in current['sizes'].items():
+        for name, measures in benchmarks.items():
+            before: Optional[Dict[str, float]] = \
+                previous['sizes'].get(size, {}).get(name)
+            if 'median_ms' not in measures or not before:
+                continue
+            print('%-10s %-28s %12.3f %12.3f %8.2f' % (
+                size, name, before['median_ms'], measures['median_ms'],
+                measures['median_ms'] / before['median_ms']
+            ))
+
+
+def main() -> None:
+    '''Main function'''
+    options, args = getopt.getopt(
+        sys.argv[1:], '', ['sizes=', 'output=', 'compare=']
+    )
+    sizes: List[int] = [10000, 100000, 1000000]
+    output: str = os.path.join('bench', 'results')
+    previous: Optional[str] = None
+    for option, arg in options:
+        if option == '--sizes':
+            sizes = [int(size) for size in arg.split(',')]
+        elif option == '--output':
+            output = arg
+        elif option == '--compare':
+            previous = arg
+    results: Dict[str, Any] = {'commit': commit_id(), 'sizes': {}}
+    for size in sizes:
+        print('Benchmarking %d products...' % size)
+        results['sizes'][str(size)] = bench_size(size)
+        print(json.dumps(results['sizes'][str(size)], indent=2))
+    os.makedirs(output, exist_ok=True)
+    path: str = os.path.join(output, '%s.json' % results['commit'])
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved in %s' % path)
+    if previous:
+        with open(previous) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
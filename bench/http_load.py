@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''Load test of the http UI.
+Discovers URLs of the server (categories, product pages, details and
+substitutes), then requests them from concurrent keep-alive connections
+for a given duration, and reports the throughput, the latencies and the
+statuses. The server is started apart, for instance with:
+    python main.py --ui=http --memory
+
+Usage:
+    python -m bench.http_load [--url http://127.0.0.1:8000]
+        [--concurrency 100] [--duration 10] [--etag]'''
+from typing import Dict, List, Tuple, Optional, Any
+import asyncio
+import getopt
+import json
+import random
+import statistics
+import sys
+import time
+import urllib.parse
+
+
+class Connection:
+    '''Keep-alive HTTP/1.1 connection to the server
+
+    Attributes:
+        host: The host of the server
+        port: The port of the server'''
+
+    def __init__(self, host: str, port: int) -> None:
+        '''Constructor'''
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, path: str, etag: Optional[str] = None
+                  ) -> Tuple[int, Dict[str, str], bytes]:
+        '''Requests a path (revalidating the ETag, if provided).
+        Returns the status, headers and body of the response.'''
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        request: str = 'GET %s HTTP/1.1\r\nHost: %s\r\n' % (path, self.host)
+        if etag:
+            request += 'If-None-Match: %s\r\n' % etag
+        self._writer.write((request + '\r\n').encode('latin-1'))
+        await self._writer.drain()
+        status: int = int((await self._reader.readline()).split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line: bytes = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body: bytes = await self._reader.readexactly(
+            int(headers.get('content-length', 0))
+        )
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, headers, body
+
+    def close(self) -> None:
+        '''Closes the connection'''
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+async def discover(connection: Connection, max_categories: int = 20
+                   ) -> List[str]:
+    '''Function returning the URLs to request: the first page of the
+    first categories, and the details and substitutes of their
+    products'''
+    _, _, body = await connection.get('/categories')
+    paths: List[str] = []
+    for category in json.loads(body)[:max_categories]:
+        path: str = '/categories/%d/products' % category['id']
+        paths.append(path)
+        _, _, body = await connection.get(path)
+        for product in json.loads(body)['products']:
+            paths.append('/products/%d' % product['id'])
+            paths.append('/products/%d/substitutes' % product['id'])
+    return paths
+
+
+async def worker(connection: Connection, paths: List[str], end: float,
+                 use_etag: bool, latencies: List[float],
+                 statuses: Dict[int, int], seed: int) -> None:
+    '''Function requesting random paths until end'''
+    rnd: random.Random = random.Random(seed)
+    etags: Dict[str, str] = {}
+    while time.perf_counter() < end:
+        path: str = rnd.choice(paths)
+        start: float = time.perf_counter()
+        status, headers, _ = await connection.get(
+            path, etags.get(path) if use_etag else None
+        )
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        if 'etag' in headers:
+            etags[path] = headers['etag']
+    connection.close()
+
+
+async def load(url: str, concurrency: int, duration: float,
+               use_etag: bool) -> Dict[str, Any]:
+    '''Function running the load test. Returns its measures.'''
+    parts: urllib.parse.SplitResult = urllib.parse.urlsplit(url)
+    host: str = parts.hostname or '127.0.0.1'
+    port: int = parts.port or 80
+    probe: Connection = Connection(host, port)
+    paths: List[str] = await discover(probe)
+    probe.close()
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    start: float = time.perf_counter()
+    await asyncio.gather(*(
+        worker(Connection(host, port), paths, start + duration, use_etag,
+               latencies, statuses, seed)
+        for seed in range(concurrency)
+    ))
+    elapsed: float = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'urls': len(paths),
+        'requests': len(latencies),
+        'requests_s': len(latencies) / elapsed,
+        'p50_ms': 1000 * latencies[len(latencies) // 2],
+        'p95_ms': 1000 * latencies[int(len(latencies) * 0.95)],
+        'p99_ms': 1000 * latencies[int(len(latencies) * 0.99)],
+        'mean_ms': 1000 * statistics.mean(latencies),
+        'statuses': statuses,
+    }
+
+
+def main() -> None:
+    '''Main function'''
+    options, args = getopt.getopt(
+        sys.argv[1:], '', ['url=', 'concurrency=', 'duration=', 'etag']
+    )
+    url: str = 'http://127.0.0.1:8000'
+    concurrency: int = 100
+    duration: float = 10.0
+    use_etag: bool = False
+    for option, arg in options:
+        if option == '--url':
+            url = arg
+        elif option == '--concurrency':
+            concurrency = int(arg)
+        elif option == '--duration':
+            duration = float(arg)
+        elif option == '--etag':
+            use_etag = True
+    results: Dict[str, Any] = asyncio.run(
+        load(url, concurrency, duration, use_etag)
+    )
+    print('%(requests)d requests on %(urls)d URLs: %(requests_s).0f req/s'
+          % results)
+    print('latency: p50 %(p50_ms).1f ms, p95 %(p95_ms).1f ms, '
+          'p99 %(p99_ms).1f ms, mean %(mean_ms).1f ms' % results)
+    print('statuses: %s' % ', '.join(
+        '%d x%d' % item for item in sorted(results['statuses'].items())
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+'''Benchmark of the start up time of the CLI.
+Times the import of the main module in new interpreters, then lists the
+modules whose import is the slowest (from python -X importtime).
+
+Usage:
+    python -m bench.startup [--repeat 10] [--top 15]'''
+from typing import Dict, List, Tuple
+import getopt
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_import(repeat: int) -> List[float]:
+    '''Function timing repeat imports of main in new interpreters.
+    Returns the durations in milliseconds.'''
+    durations: List[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'import main'])
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def slowest_imports(top: int) -> List[Tuple[str, float]]:
+    '''Function returning the top modules whose import (including their
+    own imports) is the slowest, with their durations in milliseconds'''
+    output: str = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    ).stderr
+    modules: Dict[str, float] = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        modules[module.strip()] = int(cumulative) / 1000
+    return sorted(modules.items(), key=lambda item: -item[1])[:top]
+
+
+def main() -> None:
+    '''Main function'''
+    options, args = getopt.getopt(sys.argv[1:], '', ['repeat=', 'top='])
+    repeat: int = 10
+    top: int = 15
+    for option, arg in options:
+        if option == '--repeat':
+            repeat = int(arg)
+        elif option == '--top':
+            top = int(arg)
+    durations: List[float] = time_import(repeat)
+    print('import main: median %.1f ms, min %.1f ms (%d runs)' % (
+        statistics.median(durations), min(durations), repeat
+    ))
+    print('%-50s %12s' % ('MODULE', 'CUMUL. (ms)'))
+    for module, duration in slowest_imports(top):
+        print('%-50s %12.1f' % (module, duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,30 @@
 Has for purpose to handle all actions on the database (DDL, DML).
 Built upon SQLAlchemy ORM."""
 
-from typing import NoReturn, List, Dict, Optional, Any, Generator, Union
-from sqlalchemy.orm import Session, Query
+from typing import (NoReturn, List, Dict, Optional, Any, Generator, Union,
+                    Iterable, Set, AbstractSet, Tuple)
+from contextlib import contextmanager
+import hashlib
+import json
+import re
+import threading
+from sqlalchemy import (Table, and_, or_, exists, false, select, text,
+                        inspect)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import (Session, Query, scoped_session, sessionmaker,
+                            selectinload, contains_eager, aliased)
+from sqlalchemy.orm.strategy_options import Load
+from sqlalchemy.sql.expression import Insert, TextClause, Alias
 from sqlalchemy.ext.declarative.api import DeclarativeMeta
 from OpenFoodFacts import Product
 from db.setup import (Product as DBProduct, Store as DBStore,
-                      Category as DBCategory)
+                      Category as DBCategory, IsSoldAt, HasCategory,
+                      ProductSearch, Checkpoint, index_products,
+                      get_reader, data_version, next_version,
+                      replaced_version)
+from db.Interner import Interner
+from db.Page import Page, Cursor
+from db.SubstituteIndex import SubstituteIndex
 
 
 class DB:
@@ -17,158 +35,708 @@ class DB:
 
     Attributes:
         base: the database itself
-        session: the session connected to the database
+        session: the session connected to the database (registry of
+                 the session of each thread, see unit_of_work())
+        snapshots: factory of the read-only sessions of snapshot(),
+                   which hold the version of the data they read
         Product: the ORM Table for the Product table
         Store: the ORM Table for the Store table
         Category: the ORM Table for the Category table
+        store_names: cache of the ids of the stores (by name)
+        category_names: cache of the ids of the categories (by name)
+        substitutes: inverted index scoring the substitutes (built on
+                     first use, refreshed once the data version read
+                     changes, see _substitute_index())
+        unchanged: number of products skipped by add_many as their
+                   content did not change since their last write
+        unknown: number of products skipped by add_many as they were
+                 to be written only if already stored
     '''
 
     base: DeclarativeMeta
-    session: Session
+    session: scoped_session
     Product: DeclarativeMeta
     Store: DeclarativeMeta
     Category: DeclarativeMeta
 
-    def __init__(self, base: DeclarativeMeta, session: Session) -> None:
+    def __init__(self, base: DeclarativeMeta,
+                 session: scoped_session) -> None:
         '''Constructor'''
         self.base = base
         self.session = session
+        self.snapshots: sessionmaker = sessionmaker(
+            bind=get_reader(session.get_bind()), expire_on_commit=False,
+            info={'snapshot': True}
+        )
         self.Product = DBProduct
         self.Store = DBStore
         self.Category = DBCategory
+        self.store_names: Interner = Interner(self.Store, session)
+        self.category_names: Interner = Interner(self.Category, session)
+        self.substitutes: SubstituteIndex = SubstituteIndex()
+        self.unchanged: int = 0
+        self.unknown: int = 0
+        self._substitutes_lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def unit_of_work(self) -> Generator[Session, None, None]:
+        '''Context manager delimiting a unit of work: yields the session
+        of the current thread, commits it (rolls it back on error) then
+        ends it, so that its connection goes back to the pool and the
+        next unit of work reads fresh data. The objects loaded stay
+        readable but are detached: the relationships to use must be
+        loaded with them (see the load parameters).'''
+        try:
+            yield self.session()
+            self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.remove()
 
-    def add(self, product: Product) -> DBProduct:
+    @contextmanager
+    def snapshot(self) -> Generator[Session, None, None]:
+        '''Context manager running the reads of the current thread on a
+        single snapshot of the database, through a read-only connection:
+        with SQLite in WAL mode, they never wait for the writer and do
+        not see its commits until the end of the snapshot. A snapshot
+        opened inside another one is the outer one. The objects loaded
+        are detached at the end, as with unit_of_work().'''
+        registry: Any = self.session.registry
+        previous: Optional[Session] = registry() if registry.has() else None
+        if previous is not None and previous.info.get('snapshot'):
+            yield previous
+            return
+        session: Session = self.snapshots()
+        registry.set(session)
+        try:
+            session.info['version'] = data_version(session)
+            yield session
+        finally:
+            session.close()  # Ends the read transaction
+            if previous is None:
+                registry.clear()
+            else:
+                registry.set(previous)
+
+    def add(self, product: Product) -> Optional[DBProduct]:
         '''Method adding a new product to the database,
         including new store(s) and/or category(ies) if needed.
         Populates link tables too.
-        Returns the new inserted DBProduct'''
-        stores: List[DBStore] = self._add_stores(product.stores)
-        categories: List[DBCategory] = self._add_categories(
-            product.categories
+        Returns the new inserted DBProduct (None if it failed)'''
+        if self.add_many([product]):
+            return None
+        return self.get_product_by_id(product.id)
+
+    def add_many(self, products: Iterable[Product], batch_size: int = 500,
+                 stored_only: AbstractSet[int] = frozenset()
+                 ) -> List[Product]:
+        '''Method adding (or updating) products to the database by
+        batches of batch_size products, with one commit per batch.
+        New stores and categories are created if needed. The products
+        whose id is in stored_only are updated only, never added.
+        Returns the products which could not be written.'''
+        for interner in (self.store_names, self.category_names):
+            if not interner.warmed:
+                interner.warm()
+        failed: List[Product] = []
+        batch: List[Product] = []
+        for product in products:
+            batch.append(product)
+            if len(batch) >= batch_size:
+                failed.extend(self._write_batch(batch, stored_only))
+                batch = []
+        if batch:
+            failed.extend(self._write_batch(batch, stored_only))
+        return failed
+
+    def add_categories_to(self, links: Dict[int, Set[str]]) -> None:
+        '''Method linking products (by id) to more categories (by name),
+        creating the missing ones, in a single transaction. The unknown
+        products are skipped.'''
+        ids: List[int] = list(self._select_hashes(list(links)))
+        if not ids:
+            return
+        categories: Dict[str, int] = self._add_categories(
+            {name for id in ids for name in links[id]}
         )
-        query: Query = self.session.query(self.Product)
-        existing_product: Optional[DBProduct] = query.filter(
-            self.Product.id == product.id
-        ).first()
-        if existing_product:  # If a product exists, updates if
-            new_product: DBProduct = self._update_product(
-                existing_product, product, stores, categories
-            )
-        else:  # Else, inserts a new one
-            new_product = self._add_product(product, stores, categories)
+        self.session.execute(self._insert_ignore(HasCategory), [
+            {'product_id': id, 'category_id': categories[name]}
+            for id in ids for name in links[id]
+        ])
+        for chunk in self._chunks(ids):  # Full-text index
+            self.session.execute(ProductSearch.delete().where(
+                ProductSearch.c.product_id.in_(chunk)
+            ))
+            self.session.execute(index_products(chunk))
+        self._stamp(ids)
+        self.session.commit()
+        for chunk in self._chunks(ids):
+            self.substitutes.refresh(self.session, chunk)
+
+    def _write_batch(self, products: List[Product],
+                     stored_only: AbstractSet[int] = frozenset()
+                     ) -> List[Product]:
+        '''Private method writing a batch of products in a single
+        transaction. If the transaction fails, the products are written
+        one by one to isolate the faulty ones, which are returned.'''
         try:
+            written: List[int] = self._upsert_products(products,
+                                                       stored_only)
             self.session.commit()
-            return new_product
-        except Exception as err:
+            for ids in self._chunks(written):
+                self.substitutes.refresh(self.session, ids)
+            return []
+        except SQLAlchemyError:
             self.session.rollback()
-            pass
+            if len(products) == 1:
+                return products
+        failed: List[Product] = []
+        for product in products:
+            failed.extend(self._write_batch([product], stored_only))
+        return failed
 
-    def _add_product(self, product: Product,
-                     stores: List[DBStore],
-                     categories: List[DBCategory]) -> DBProduct:
+    def _upsert_products(self, products: List[Product],
+                         stored_only: AbstractSet[int] = frozenset()
+                         ) -> List[int]:
         '''Intermediate private method for better code segmentation.
-        Inserts a new product in the Product table.
-        Returns the new inserted DBProduct'''
-        p: DBProduct = self.Product(
-            id=product.id,
-            name=product.name,
-            nutrition_grade=product.nutrition_grades,
-            url=product.url,
-            stores=stores,
-            categories=categories
+        Upserts the products in the Product table with set-based
+        statements and populates the link tables: the stores of a
+        product are replaced, its categories are added to the
+        existing ones. The products whose content hash did not change
+        since their last write are skipped, as well as the products of
+        stored_only which are not stored. The products written are
+        stamped with the next data version.
+        Returns the ids of the written products.'''
+        hashes: Dict[int, str] = {
+            p.id: self._content_hash(p) for p in products
+        }
+        known: Dict[int, str] = self._select_hashes(list(hashes))
+        unknown: Set[int] = {
+            id for id in hashes if id in stored_only and id not in known
+        }
+        products = [
+            p for p in {p.id: p for p in products}.values()
+            if known.get(p.id) != hashes[p.id] and p.id not in unknown
+        ]
+        self.unknown += len(unknown)
+        self.unchanged += len(hashes) - len(products) - len(unknown)
+        if not products:
+            return []
+        product_ids: List[int] = [p.id for p in products]
+        version: int = next_version(self.session)
+        stores: Dict[str, int] = self._add_stores(
+            {name for p in products for name in p.stores}
         )
-        self.session.add(p)
-        return p
-
-    def _add_stores(self, store_names: List[str]) -> List[DBStore]:
-        '''For every store linked in the Product object,
-        collects it if exists or creates a new one.
-        Returns all the new DBStore objects.'''
-        stores: List[DBStore] = []
-        query: Query = self.session.query(self.Store)
-        for store_name in store_names:
-            existing_store: Optional[DBStore] = query.filter(
-                    self.Store.name == store_name
-            ).first()
-            if not existing_store:
-                store = self.Store(name=store_name)
-                self.session.add(store)
-                stores.append(store)
-            else:
-                stores.append(existing_store)
-        return stores
-
-    def _add_categories(self,
-                        category_names: List[str]) -> List[DBCategory]:
-        '''For every category linked in the Product object,
-        collects it if exists or creates a new one.
-        Returns all the new DBCategory objects.'''
-        categories: List[DBCategory] = []
-        query: Query = self.session.query(self.Category)
-        for category_name in category_names:
-            existing_category: Optional[DBCategory] = query.filter(
-                self.Category.name == category_name
-            ).first()
-            if not existing_category:
-                category = self.Category(name=category_name)
-                self.session.add(category)
-                categories.append(category)
-            else:
-                categories.append(existing_category)
-        return categories
-
-    def _update_product(self, existing_product: DBProduct,
-                        product: Product, stores: List[DBStore],
-                        categories: List[DBCategory]) -> DBProduct:
-        '''If a DBProduct already exists in the database,
-        updates it instead of inserting a new one.
-        Returns the said DBProduct.'''
-        existing_product.id = product.id
-        existing_product.name = product.name
-        existing_product.nutrition_grade = product.nutrition_grades
-        existing_product.url = product.url
-        existing_product.stores = stores
-        existing_product.categories = categories
-        return existing_product
+        categories: Dict[str, int] = self._add_categories(
+            {name for p in products for name in p.categories}
+        )
+        self.session.execute(
+            self._upsert(self.Product.__table__,
+                         ('name', 'nutrition_grade', 'grade_rank', 'url',
+                          'content_hash', 'version')),
+            [{
+                'id': p.id,
+                'name': p.name,
+                'nutrition_grade': p.nutrition_grades,
+                'grade_rank': self.Product.rank(p.nutrition_grades),
+                'url': p.url,
+                'content_hash': hashes[p.id],
+                'version': version,
+            } for p in products]
+        )
+        for ids in self._chunks(product_ids):
+            self.session.execute(IsSoldAt.delete().where(
+                IsSoldAt.c.product_id.in_(ids)
+            ))
+        links: Dict[Table, List[Dict[str, int]]] = {
+            IsSoldAt: [
+                {'product_id': p.id, 'store_id': stores[name]}
+                for p in products for name in set(p.stores)
+            ],
+            HasCategory: [
+                {'product_id': p.id, 'category_id': categories[name]}
+                for p in products for name in set(p.categories)
+            ],
+        }
+        for table, rows in links.items():
+            if rows:
+                self.session.execute(self._insert_ignore(table), rows)
+        for ids in self._chunks(product_ids):  # Full-text index
+            self.session.execute(ProductSearch.delete().where(
+                ProductSearch.c.product_id.in_(ids)
+            ))
+            self.session.execute(index_products(ids))
+        return product_ids
+
+    def _stamp(self, product_ids: List[int]) -> None:
+        '''Private method increasing the data version and stamping the
+        products (by id) with it, within the current transaction'''
+        version: int = next_version(self.session)
+        for ids in self._chunks(product_ids):
+            self.session.execute(self.Product.__table__.update().where(
+                self.Product.id.in_(ids)
+            ).values(version=version))
+
+    def _select_hashes(self, product_ids: List[int]) -> Dict[int, str]:
+        '''Private method returning the id -> content hash dictionary
+        of the existing products'''
+        hashes: Dict[int, str] = {}
+        for ids in self._chunks(product_ids):
+            hashes.update(self.session.query(
+                self.Product.id, self.Product.content_hash
+            ).filter(self.Product.id.in_(ids)))
+        return hashes
+
+    @staticmethod
+    def _content_hash(product: Product) -> str:
+        '''Private static method computing the digest of the data
+        written for a product'''
+        content: str = json.dumps([
+            product.name, product.nutrition_grades, product.url,
+            sorted(set(product.stores)), sorted(set(product.categories))
+        ])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get_watermark(self, category_name: str) -> Optional[int]:
+        '''Get the sync watermark of a category (by name): timestamp of
+        the last upstream modification already collected'''
+        return self.session.query(self.Category.synced_until).filter(
+            self.Category.name == category_name
+        ).scalar()
+
+    def get_watermarks(self) -> Dict[str, Optional[int]]:
+        '''Get the sync watermarks of every category (by name)'''
+        return dict(self.session.query(
+            self.Category.name, self.Category.synced_until
+        ))
+
+    def set_watermark(self, category_name: str, timestamp: int) -> None:
+        '''Set the sync watermark of a category (by name)'''
+        self.session.query(self.Category).filter(
+            self.Category.name == category_name
+        ).update({'synced_until': timestamp}, synchronize_session=False)
+        self.session.commit()
+
+    def get_checkpoints(self) -> Dict[str, Tuple[int, bool]]:
+        '''Get the ingestion journal: page to resume from and completion
+        of every category journaled (by name)'''
+        return {
+            category: (page, bool(done))
+            for category, page, done in self.session.execute(select([
+                Checkpoint.c.category, Checkpoint.c.page, Checkpoint.c.done
+            ]))
+        }
+
+    def save_checkpoints(self,
+                         progress: Dict[str, Tuple[int, Optional[int]]],
+                         done: bool = False) -> None:
+        '''Journals the progress of categories (by name): page and id of
+        the last product written, and completion'''
+        if not progress:
+            return
+        self.session.execute(
+            self._upsert(Checkpoint, ('page', 'product_id', 'done')), [
+                {'category': category, 'page': page,
+                 'product_id': product_id, 'done': done}
+                for category, (page, product_id) in progress.items()
+            ]
+        )
+        self.session.commit()
+
+    def clear_checkpoints(self) -> None:
+        '''Empties the ingestion journal'''
+        self.session.execute(Checkpoint.delete())
+        self.session.commit()
+
+    def _add_stores(self, store_names: Set[str]) -> Dict[str, int]:
+        '''Collects the ids of the stores named,
+        creating the missing ones.
+        Returns a name -> id dictionary.'''
+        return self._add_names(self.store_names, store_names)
+
+    def _add_categories(self, category_names: Set[str]) -> Dict[str, int]:
+        '''Collects the ids of the categories named,
+        creating the missing ones.
+        Returns a name -> id dictionary.'''
+        return self._add_names(self.category_names, category_names)
+
+    def _add_names(self, interner: Interner,
+                   names: Set[str]) -> Dict[str, int]:
+        '''Private method shared by _add_stores and _add_categories.
+        Serves the known names from the Interner cache, inserts the
+        missing ones in bulk then collects (and caches) their ids.'''
+        ids, missing = interner.lookup(names)
+        if missing:
+            self.session.execute(
+                self._insert_ignore(interner.table.__table__),
+                [{'name': name} for name in missing]
+            )
+            new_ids: Dict[str, int] = self._select_names(
+                interner.table, missing
+            )
+            interner.add(new_ids)
+            ids.update(new_ids)
+        return ids
+
+    def _select_names(self, table: DeclarativeMeta,
+                      names: Set[str]) -> Dict[str, int]:
+        '''Private method returning the name -> id dictionary
+        of the existing rows of the table named'''
+        ids: Dict[str, int] = {}
+        for chunk in self._chunks(names):
+            ids.update(
+                (name, id) for id, name in self.session.query(
+                    table.id, table.name
+                ).filter(table.name.in_(chunk))
+            )
+        return ids
+
+    def _insert_ignore(self, table: Table) -> Insert:
+        '''Private method building the dialect-native INSERT
+        statement which ignores the already existing rows'''
+        dialect: str = self.session.get_bind().dialect.name
+        if dialect == 'mysql':
+            return table.insert().prefix_with('IGNORE')
+        elif dialect == 'sqlite':
+            return table.insert().prefix_with('OR IGNORE')
+        raise NotImplementedError(
+            'Bulk insertion unavailable for "%s"' % dialect
+        )
+
+    def _upsert(self, table: Table,
+                columns: Tuple[str, ...]) -> Union[Insert, TextClause]:
+        '''Private method building the dialect-native INSERT statement
+        which updates the columns of the already existing rows in place
+        (their dependent rows are kept), to be executed with the values
+        of the primary key and of the columns'''
+        dialect: Any = self.session.get_bind().dialect
+        if dialect.name == 'mysql':
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            statement: Insert = mysql_insert(table)
+            return statement.on_duplicate_key_update(
+                {column: statement.inserted[column] for column in columns}
+            )
+        elif dialect.name == 'sqlite':  # No sqlite.insert() before 1.4
+            quote: Any = dialect.identifier_preparer.quote
+            keys: List[str] = [column.name for column in table.primary_key]
+            return text(
+                'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) '
+                'DO UPDATE SET %s' % (
+                    quote(table.name),
+                    ', '.join(quote(name) for name in keys + list(columns)),
+                    ', '.join(':' + name for name in keys + list(columns)),
+                    ', '.join(quote(name) for name in keys),
+                    ', '.join('%s = excluded.%s' % (quote(name), quote(name))
+                              for name in columns)
+                )
+            )
+        raise NotImplementedError(
+            'Bulk insertion unavailable for "%s"' % dialect.name
+        )
+
+    @staticmethod
+    def _chunks(values: Iterable[Any],
+                size: int = 500) -> Generator[List[Any], None, None]:
+        '''Private static method splitting values in lists of size
+        elements, to keep IN clauses below the database limits'''
+        values = list(values)
+        for i in range(0, len(values), size):
+            yield values[i:i + size]
 
     def get_categories(self) -> List[DBCategory]:
         '''Get all categories'''
         return self.session.query(self.Category)
 
-    def get_products_by_category(self, category_id: int) -> List[DBProduct]:
-        '''Get all products by category (id)'''
-        return self.session.query(self.Category).filter(
-            self.Category.id == category_id
-        ).first().products
+    def get_products_by_category(self, category_id: int,
+                                 load: Iterable[str] = ()
+                                 ) -> List[DBProduct]:
+        '''Get all products by category (id), from the worst
+        nutrition grade to the best one, then by name (descending)'''
+        return self._products_query(category_id, load).order_by(
+            self.Product.grade_rank.desc(), self.Product.name.desc(),
+            self.Product.id.desc()
+        ).all()
+
+    def get_products_page(self, category_id: int, page_size: int,
+                          after: Optional[Cursor] = None,
+                          before: Optional[Cursor] = None,
+                          load: Iterable[str] = ()) -> Page:
+        '''Get a page of page_size products by category (id), in the
+        get_products_by_category order. Keyset pagination: the page
+        starts after the cursor after (or ends before the cursor
+        before), so that any page costs the same as the first one.'''
+        keys: Tuple[Any, ...] = (
+            self.Product.grade_rank, self.Product.name, self.Product.id
+        )
+        query: Query = self._products_query(category_id, load)
+        if before:  # Walks backwards, in ascending order
+            query = query.filter(self._keyset(keys, before, ascending=True))
+            rows: List[DBProduct] = query.order_by(
+                *(key.asc() for key in keys)
+            ).limit(page_size + 1).all()
+            more: bool = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            return Page(rows, self._cursor(rows[-1]) if rows else before,
+                        self._cursor(rows[0]) if more else None)
+        if after:
+            query = query.filter(self._keyset(keys, after, ascending=False))
+        rows = query.order_by(
+            *(key.desc() for key in keys)
+        ).limit(page_size + 1).all()
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        return Page(rows, self._cursor(rows[-1]) if more else None,
+                    self._cursor(rows[0]) if after and rows else None)
+
+    def _products_query(self, category_id: int,
+                        load: Iterable[str] = ()) -> Query:
+        '''Private method querying the products of a category (by id).
+        The EXISTS lets the database walk the (grade_rank, name, id)
+        index in order and stop at the LIMIT instead of sorting.'''
+        return self.session.query(self.Product).options(
+            *self._loading(load)
+        ).filter(exists().where(and_(
+            HasCategory.c.product_id == self.Product.id,
+            HasCategory.c.category_id == category_id
+        )))
+
+    def _loading(self, load: Iterable[str]) -> List[Load]:
+        '''Private method building the loading options of the Product
+        relationships named in load: the selectin strategy loads a
+        relationship of every queried product with one extra query
+        (instead of one lazy query per product and relationship)'''
+        return [selectinload(getattr(self.Product, name)) for name in load]
 
-    def get_product_by_id(self, product_id: int) -> DBProduct:
-        '''Get a product details (by id)'''
-        return self.session.query(self.Product).filter(
+    def _joining(self, query: Query, load: Iterable[str]) -> Query:
+        '''Private method outer joining the Product relationships named
+        in load to the query, and loading them from its rows. The link
+        table then the related table are joined one after the other: as
+        joinedload() joins them together first, SQLite would scan the
+        whole link table to materialize their join.'''
+        for name in load:
+            relationship: Any = getattr(self.Product, name)
+            link: Alias = relationship.property.secondary.alias()
+            target: Any = aliased(relationship.property.mapper.class_)
+            columns: Any = inspect(target).selectable.c
+            query = query.outerjoin(link, and_(*(
+                local == link.c[remote.name] for local, remote
+                in relationship.property.synchronize_pairs
+            ))).outerjoin(target, and_(*(
+                columns[local.name] == link.c[remote.name] for local, remote
+                in relationship.property.secondary_synchronize_pairs
+            ))).options(contains_eager(relationship, alias=target))
+        return query
+
+    @staticmethod
+    def _keyset(keys: Tuple[Any, ...], cursor: Cursor,
+                ascending: bool) -> Any:
+        '''Private static method building the condition selecting the
+        rows after the cursor: (k1, k2, k3) > (c1, c2, c3) if ascending,
+        < otherwise (expanded, as row values are not portable).
+        NULL keys (products without a grade rank) are smaller than any
+        value, as SQLite and MySQL sort them, so that the index of the
+        keys still serves the ORDER BY.'''
+        key, value = keys[0], cursor[0]
+        beyond: Any
+        if value is None:
+            beyond = key.isnot(None) if ascending else false()
+        else:
+            beyond = key > value if ascending else or_(key < value,
+                                                       key.is_(None))
+        if len(keys) == 1:
+            return beyond
+        return or_(beyond, and_(
+            key.is_(None) if value is None else key == value,
+            DB._keyset(keys[1:], cursor[1:], ascending)
+        ))
+
+    @staticmethod
+    def _cursor(product: DBProduct) -> Cursor:
+        '''Private static method returning the cursor of a product'''
+        return (product.grade_rank, product.name, product.id)
+
+    def get_product_by_id(self, product_id: int,
+                          load: Iterable[str] = ()) -> DBProduct:
+        '''Get a product details (by id), joining the relationships
+        named in load to the query (see _joining())'''
+        return self._joining(self.session.query(self.Product), load).filter(
             self.Product.id == product_id
-        ).first()
-
-    def get_substitutes_for(self, product_id: int) \
-            -> List[DBProduct]:
-        '''Get substitutes for a product (by id)'''
-        product: DBProduct = self.get_product_by_id(product_id)
-        query: Query = self.session.query(self.Product).\
-            filter(self.Product.nutrition_grade < product.nutrition_grade).\
-            filter(self.Product.categories.any(id=product.categories[0].id)).\
-            order_by(self.Product.nutrition_grade, self.Product.name)
-        return query.all()
+        ).one_or_none()  # Without LIMIT, which would cut the joined rows
+
+    def data_version(self) -> Optional[int]:
+        '''Get the version of the data read by the snapshot of the
+        current thread (None outside snapshots): it changes whenever
+        a process writes the catalog or the favorites'''
+        registry: Any = self.session.registry
+        return registry().info.get('version') if registry.has() else None
+
+    def get_changes(self, version: int) -> Optional[List[int]]:
+        '''Get the ids of the products written since the data version
+        provided, read by the snapshot of the current thread (None if
+        the data has been replaced since then: every product may have
+        changed)'''
+        if replaced_version(self.session) > version:
+            return None
+        return [id for id, in self.session.query(self.Product.id).filter(
+            self.Product.version > version
+        )]
+
+    def get_category_ids(self, product_ids: Iterable[int]) -> Set[int]:
+        '''Get the ids of the categories of the products (by id)'''
+        category_ids: Set[int] = set()
+        for ids in self._chunks(product_ids):
+            category_ids.update(id for id, in self.session.execute(
+                select([HasCategory.c.category_id]).where(
+                    HasCategory.c.product_id.in_(ids)
+                ).distinct()
+            ))
+        return category_ids
+
+    def _substitute_index(self) -> SubstituteIndex:
+        '''Private method returning the SubstituteIndex, built on first
+        use by a single thread. Once a snapshot reads a newer data
+        version, the entries of the products changed since the version
+        of the index are refreshed (the index is built again only if the
+        data has been replaced), while the other threads keep reading
+        it: its updates are safe for them. A complete index replaces
+        the previous one at once, so that they never see it partly
+        built.'''
+        version: Optional[int] = self.data_version()
+        index: SubstituteIndex = self.substitutes
+        if not self._outdated(index, version):
+            return index
+        if not self._substitutes_lock.acquire(blocking=not index.built):
+            return index  # Being built again by another thread
+        try:
+            index = self.substitutes
+            if self._outdated(index, version):
+                changed: Optional[List[int]] = None
+                if index.built and index.version is not None:
+                    changed = self.get_changes(index.version)
+                if changed is None:
+                    index = SubstituteIndex()
+                    index.build(self.session)
+                    self.substitutes = index
+                for ids in self._chunks(changed or ()):
+                    index.refresh(self.session, ids)
+                index.version = version
+            return index
+        finally:
+            self._substitutes_lock.release()
+
+    @staticmethod
+    def _outdated(index: SubstituteIndex, version: Optional[int]) -> bool:
+        '''Private static method telling whether an index must be built
+        or refreshed to serve a snapshot of the data version provided'''
+        return not index.built or (version is not None
+                                   and (index.version or 0) < version)
+
+    def get_substitutes_key(self, product_id: int
+                            ) -> Optional[Tuple[int, Tuple[int, ...]]]:
+        '''Get the (grade rank, sorted category ids) of a product (by id):
+        products sharing them have the same substitutes'''
+        return self._substitute_index().key(product_id)
+
+    def get_substitutes_for(self, product_id: int, limit: int = 10,
+                            load: Iterable[str] = ()) -> List[DBProduct]:
+        '''Get the limit best substitutes for a product (by id): the
+        products with a better grade sharing the most categories with
+        it, scored with the SubstituteIndex (built on first use)'''
+        ids: List[int] = self._substitute_index().top(product_id, limit)
+        if not ids:
+            return []
+        products: Dict[int, DBProduct] = {
+            p.id: p for p in self.session.query(self.Product).options(
+                *self._loading(load)
+            ).filter(self.Product.id.in_(ids))
+        }
+        return [products[id] for id in ids if id in products]
+
+    def get_substitutes_for_many(self, product_ids: Iterable[int],
+                                 limit: int = 10, load: Iterable[str] = ()
+                                 ) -> Dict[int, List[DBProduct]]:
+        '''Get the limit best substitutes for each product (by id), as
+        get_substitutes_for does, loading the products and all their
+        substitutes with one query (per chunk of ids).
+        Returns an id -> substitutes dictionary, without the ids
+        missing from the database.'''
+        index: SubstituteIndex = self._substitute_index()
+        tops: Dict[int, List[int]] = {
+            id: index.top(id, limit) for id in set(product_ids)
+        }
+        wanted: Set[int] = set(tops).union(*tops.values())
+        products: Dict[int, DBProduct] = {}
+        for ids in self._chunks(wanted):
+            products.update(
+                (p.id, p) for p in self.session.query(self.Product).options(
+                    *self._loading(load)
+                ).filter(self.Product.id.in_(ids))
+            )
+        return {
+            id: [products[s] for s in top if s in products]
+            for id, top in tops.items() if id in products
+        }
+
+    def search(self, terms: str, limit: int = 20,
+               load: Iterable[str] = ()) -> List[DBProduct]:
+        '''Get the limit products best matching the search terms (in
+        their names, stores or categories) with the full-text index.
+        Every term is matched as a prefix.'''
+        words: List[str] = re.findall(r'\w+', terms.lower())
+        if not words:
+            return []
+        dialect: str = self.session.get_bind().dialect.name
+        if dialect == 'sqlite':  # Names weigh more than the other columns
+            query = select([ProductSearch.c.product_id]).where(text(
+                '"ProductSearch" MATCH :query'
+            )).order_by(text('bm25("ProductSearch", 10.0, 2.0, 1.0)'))
+            words = ['"%s"*' % word for word in words]
+        elif dialect == 'mysql':
+            match: str = ('MATCH (name, stores, categories) '
+                          'AGAINST (:query IN BOOLEAN MODE)')
+            query = select([ProductSearch.c.product_id]).where(
+                text(match)
+            ).order_by(text(match + ' DESC'))
+            words = ['+%s*' % word for word in words]
+        else:
+            raise NotImplementedError(
+                'Full-text search unavailable for "%s"' % dialect
+            )
+        ids: List[int] = [id for id, in self.session.execute(
+            query.limit(limit), {'query': ' '.join(words)}
+        )]
+        if not ids:
+            return []
+        products: Dict[int, DBProduct] = {
+            p.id: p for p in self.session.query(self.Product).options(
+                *self._loading(load)
+            ).filter(self.Product.id.in_(ids))
+        }
+        return [products[id] for id in ids if id in products]
 
     def add_favorite(self, substituted: DBProduct,
                      substituter: DBProduct) -> List[DBProduct]:
         '''Add a new reciprocal favorite substitution relation and
-        returns both DBProducts'''
+        returns both DBProducts (attached to the session if they were
+        loaded by a previous unit of work)'''
+        substituted = self.session.merge(substituted)
+        substituter = self.session.merge(substituter)
         substituted.substituted_by.append(substituter)
         substituter.substitutes.append(substituted)
+        substituted.version = substituter.version = next_version(
+            self.session
+        )
         self.session.commit()
         return [substituted, substituter]
 
-    def get_favorite_products(self) -> List[DBProduct]:
+    def get_favorite_products(self,
+                              load: Iterable[str] = ()) -> List[DBProduct]:
         '''Get all saved products'''
-        return self.session.query(self.Product).filter(
+        return self.session.query(self.Product).options(
+            *self._loading(load)
+        ).filter(
             self.Product.substitutes.any(
                 self.Product.id
             )
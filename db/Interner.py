@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''Class caching the ids of the named rows (stores, categories)'''
+from typing import Dict, Set, Tuple, Union
+from sqlalchemy import event
+from sqlalchemy.orm import Session, scoped_session
+from sqlalchemy.ext.declarative.api import DeclarativeMeta
+
+
+class Interner:
+    '''Session-scoped cache of the name -> id dictionary of a table
+    holding named rows (Store or Category). The ids collected during
+    a transaction stay pending (in the info of its Session, as a
+    scoped_session has one Session per thread) until it is committed,
+    and are dropped if it is rolled back, so that the cache never
+    references rows missing from the database.
+
+    Attributes:
+        table:   The ORM Table cached
+        session: The session whose transactions are followed
+        warmed:  Whether the whole table has been loaded'''
+
+    def __init__(self, table: DeclarativeMeta,
+                 session: Union[Session, scoped_session]) -> None:
+        '''Constructor following the transactions of the session (of
+        every Session of a scoped_session)'''
+        self.table = table
+        self.session = session
+        self.warmed: bool = False
+        self._ids: Dict[str, int] = {}
+        event.listen(session, 'after_commit', self._commit)
+        event.listen(session, 'after_soft_rollback', self._rollback)
+
+    def warm(self) -> None:
+        '''Loads every row of the table in the cache'''
+        self._ids.update(
+            (name, id) for id, name in self.session.query(
+                self.table.id, self.table.name
+            )
+        )
+        self.warmed = True
+
+    def lookup(self, names: Set[str]) -> Tuple[Dict[str, int], Set[str]]:
+        '''Returns the ids cached for the names and the names missing'''
+        ids: Dict[str, int] = {}
+        missing: Set[str] = set()
+        pending: Dict[str, int] = self.session.info.get(self, {})
+        for name in names:
+            id: int = pending.get(name) or self._ids.get(name)
+            if id:
+                ids[name] = id
+            else:
+                missing.add(name)
+        return ids, missing
+
+    def add(self, ids: Dict[str, int]) -> None:
+        '''Caches ids collected in the current transaction'''
+        self.session.info.setdefault(self, {}).update(ids)
+
+    def _commit(self, session: Session) -> None:
+        '''Session event: the pending ids of the Session committed are
+        now in the database'''
+        self._ids.update(session.info.pop(self, {}))
+
+    def _rollback(self, session: Session, previous_transaction: object
+                  ) -> None:
+        '''Session event: the pending ids of the Session rolled back
+        may reference rolled back rows'''
+        session.info.pop(self, None)
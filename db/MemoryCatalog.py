@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+'''Class holding a read-only copy of the catalog in memory'''
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple, Optional, Iterable, Iterator
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db.setup import (Product, Store, Category, IsSoldAt, HasCategory,
+                      IsFavoriteSubstituteOf)
+from db.Page import Page, Cursor
+from db.SubstituteIndex import SubstituteIndex
+
+
+class CategoryRecord:
+    '''Category of the MemoryCatalog
+
+    Attributes:
+        id:   The id of the category
+        name: The name of the category'''
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id: int, name: str) -> None:
+        '''Constructor'''
+        self.id = id
+        self.name = name
+
+
+class StoreRecord:
+    '''Store of the MemoryCatalog
+
+    Attributes:
+        id:   The id of the store
+        name: The name of the store'''
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id: int, name: str) -> None:
+        '''Constructor'''
+        self.id = id
+        self.name = name
+
+
+class ProductRecord:
+    '''Product of the MemoryCatalog: a view on one row of its columns,
+    with the attributes of a DBProduct used by the UIs'''
+    __slots__ = ('_catalog', '_row')
+
+    def __init__(self, catalog: 'MemoryCatalog', row: int) -> None:
+        '''Constructor'''
+        self._catalog = catalog
+        self._row = row
+
+    @property
+    def id(self) -> int:
+        '''Property method returning the id of the product'''
+        return self._catalog.ids[self._row]
+
+    @property
+    def name(self) -> str:
+        '''Property method returning the name of the product'''
+        return self._catalog.names[self._row]
+
+    @property
+    def nutrition_grade(self) -> str:
+        '''Property method returning the grade of the product'''
+        return self._catalog.grades[self._catalog.grade_refs[self._row]]
+
+    @property
+    def grade_rank(self) -> Optional[int]:
+        '''Property method returning the rank of the product grade'''
+        return self._catalog.ranks[self._row] or None
+
+    @property
+    def url(self) -> str:
+        '''Property method returning the URL of the product'''
+        return self._catalog.urls[self._row]
+
+    @property
+    def stores(self) -> List[StoreRecord]:
+        '''Property method returning the stores of the product'''
+        catalog: MemoryCatalog = self._catalog
+        return [catalog.stores[ref] for ref in catalog.store_refs[
+            catalog.store_offsets[self._row]:
+            catalog.store_offsets[self._row + 1]
+        ]]
+
+    @property
+    def substitutes(self) -> List['ProductRecord']:
+        '''Property method returning the products saved as substituted
+        by the product'''
+        return [ProductRecord(self._catalog, row)
+                for row in self._catalog.favorites.get(self._row, [])]
+
+
+class MemoryCatalog:
+    '''Read-only copy of the catalog, loaded once in compact columns:
+    one array (or list of interned strings) per Product column, stores
+    and categories referenced by position. Rows are numbered in the
+    listing order of the products (worst grade first, then by name
+    descending), so that a category listing is a sorted array of rows.
+    Serves the read methods of DB with ProductRecord views instead of
+    ORM objects.
+
+    Attributes:
+        ids:           Id of the products, by row
+        names:         Name of the products, by row
+        ranks:         Rank of the grade of the products (0 if none)
+        grades:        The distinct grades
+        grade_refs:    Position of the grade of the products in grades
+        urls:          URL of the products, by row
+        stores:        The stores (shared StoreRecords)
+        store_offsets: Stores of the row r: store_refs[offsets[r]:
+                       offsets[r + 1]]
+        store_refs:    Positions in stores of the stores of the products
+        categories:    The categories (shared CategoryRecords)
+        listings:      Rows of the products of a category (by id)
+        favorites:     Rows of the products substituted by a product
+                       (by row of the substituter)
+        substitutes:   The SubstituteIndex of the products'''
+
+    def __init__(self, session: Session) -> None:
+        '''Constructor loading the catalog from the database'''
+        self.ids: array = array('q')
+        self.names: List[str] = []
+        self.ranks: array = array('b')
+        self.grades: List[str] = []
+        self.grade_refs: array = array('b')
+        self.urls: List[str] = []
+        self._rows: Dict[int, int] = {}
+        grade_refs: Dict[str, int] = {}
+        for id, name, grade, rank, url in session.execute(select([
+            Product.id, Product.name, Product.nutrition_grade,
+            Product.grade_rank, Product.url
+        ]).order_by(Product.grade_rank.desc(), Product.name.desc(),
+                    Product.id.desc())).fetchall():
+            self._rows[id] = len(self.ids)
+            self.ids.append(id)
+            self.names.append(name)
+            self.ranks.append(rank or 0)
+            if grade not in grade_refs:
+                grade_refs[grade] = len(self.grades)
+                self.grades.append(grade)
+            self.grade_refs.append(grade_refs[grade])
+            self.urls.append(url)
+        self._load_stores(session)
+        self._load_categories(session)
+        self.favorites: Dict[int, List[int]] = {}
+        for substituter, substituted in session.execute(select([
+            IsFavoriteSubstituteOf.c.substitute_product_id,
+            IsFavoriteSubstituteOf.c.substituted_product_id
+        ])).fetchall():
+            self.add_favorite(substituted, substituter)
+
+    def _load_stores(self, session: Session) -> None:
+        '''Private method loading the stores and their products'''
+        self.stores: List[StoreRecord] = []
+        positions: Dict[int, int] = {}
+        for id, name in session.execute(
+            select([Store.id, Store.name]).order_by(Store.id)
+        ):
+            positions[id] = len(self.stores)
+            self.stores.append(StoreRecord(id, name))
+        refs: List[List[int]] = [[] for _ in self.ids]
+        for product_id, store_id in session.execute(
+            select([IsSoldAt.c.product_id, IsSoldAt.c.store_id])
+        ).fetchall():
+            refs[self._rows[product_id]].append(positions[store_id])
+        self.store_offsets: array = array('l', [0])
+        self.store_refs: array = array('l')
+        for row_refs in refs:
+            self.store_refs.extend(row_refs)
+            self.store_offsets.append(len(self.store_refs))
+
+    def _load_categories(self, session: Session) -> None:
+        '''Private method loading the categories, their listings and
+        the SubstituteIndex'''
+        self.categories: List[CategoryRecord] = [
+            CategoryRecord(id, name) for id, name in session.execute(
+                select([Category.id, Category.name]).order_by(Category.id)
+            )
+        ]
+        listings: Dict[int, List[int]] = {
+            category.id: [] for category in self.categories
+        }
+        rows: List[Tuple[int, int, int]] = []
+        for product_id, category_id in session.execute(select([
+            HasCategory.c.product_id, HasCategory.c.category_id
+        ])).fetchall():
+            row: int = self._rows[product_id]
+            listings[category_id].append(row)
+            rows.append((product_id, self.ranks[row], category_id))
+        self.listings: Dict[int, array] = {
+            id: array('l', sorted(category_rows))
+            for id, category_rows in listings.items()
+        }
+        self.substitutes: SubstituteIndex = SubstituteIndex()
+        self.substitutes.update(rows)
+        self.substitutes.built = True
+
+    def __len__(self) -> int:
+        '''Returns the number of products'''
+        return len(self.ids)
+
+    def get_categories(self) -> List[CategoryRecord]:
+        '''Get all categories'''
+        return self.categories
+
+    def get_products_by_category(self, category_id: int
+                                 ) -> Iterator[ProductRecord]:
+        '''Get all products by category (id), in the DB order'''
+        return self._records(self.listings.get(category_id, ()))
+
+    def get_products_page(self, category_id: int, page_size: int,
+                          after: Optional[Cursor] = None,
+                          before: Optional[Cursor] = None) -> Page:
+        '''Get a page of page_size products by category (id), after the
+        cursor after (or before the cursor before), as DB does'''
+        rows: array = self.listings.get(category_id, array('l'))
+        if before:
+            end: int = self._position(rows, before, True)
+            start: int = max(end - page_size, 0)
+            items: List[ProductRecord] = list(
+                self._records(rows[start:end])
+            )
+            return Page(items, self._cursor(items[-1]) if items else before,
+                        self._cursor(items[0]) if start > 0 else None)
+        start = self._position(rows, after) if after else 0
+        end = start + page_size
+        items = list(self._records(rows[start:end]))
+        return Page(items,
+                    self._cursor(items[-1]) if end < len(rows) else None,
+                    self._cursor(items[0]) if after and items else None)
+
+    def get_product_by_id(self, product_id: int) -> Optional[ProductRecord]:
+        '''Get a product by id'''
+        row: Optional[int] = self._rows.get(product_id)
+        return ProductRecord(self, row) if row is not None else None
+
+    def get_substitutes_for(self, product_id: int,
+                            limit: int = 10) -> List[ProductRecord]:
+        '''Get the limit best substitutes for a product (by id)'''
+        return list(self._records(
+            self._rows[id] for id in self.substitutes.top(product_id, limit)
+        ))
+
+    def get_substitutes_for_many(self, product_ids: Iterable[int],
+                                 limit: int = 10
+                                 ) -> Dict[int, List[ProductRecord]]:
+        '''Get the limit best substitutes for each product (by id),
+        without the unknown ids'''
+        return {id: self.get_substitutes_for(id, limit)
+                for id in set(product_ids) if id in self._rows}
+
+    def add_favorite(self, substituted_id: int, substituter_id: int) -> None:
+        '''Records a favorite substitution already saved in database'''
+        substituted: int = self._rows[substituted_id]
+        substitutes: List[int] = self.favorites.setdefault(
+            self._rows[substituter_id], []
+        )
+        if substituted not in substitutes:
+            substitutes.append(substituted)
+
+    def get_favorite_products(self) -> List[ProductRecord]:
+        '''Get all saved products'''
+        return list(self._records(self.favorites))
+
+    def _records(self, rows: Iterable[int]) -> Iterator[ProductRecord]:
+        '''Private method returning the ProductRecords of rows'''
+        return (ProductRecord(self, row) for row in rows)
+
+    def _position(self, rows: array, cursor: Cursor,
+                  before: bool = False) -> int:
+        '''Private method returning the position following the cursor
+        in the sorted rows (the position of the cursor if before).
+        A cursor naming an unknown product (since removed, or forged)
+        is placed by its values, as DB does.'''
+        row: Optional[int] = self._rows.get(cursor[2])
+        if row is not None:
+            return (bisect_left if before else bisect_right)(rows, row)
+        key: Tuple[int, str, int] = (cursor[0] or 0, cursor[1], cursor[2])
+        low: int = 0
+        high: int = len(rows)
+        while low < high:  # Rows in descending order of their keys
+            middle: int = (low + high) // 2
+            if self._key(rows[middle]) < key:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _key(self, row: int) -> Tuple[int, str, int]:
+        '''Private method returning the sort key of a row'''
+        return (self.ranks[row], self.names[row], self.ids[row])
+
+    @staticmethod
+    def _cursor(product: ProductRecord) -> Cursor:
+        '''Private static method returning the cursor of a product'''
+        return (product.grade_rank, product.name, product.id)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+'''Class representing a page of a keyset-paginated listing'''
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Any
+
+# Position of a product in a listing: (grade_rank, name, id)
+Cursor = Tuple[int, str, int]
+
+
+@dataclass
+class Page:
+    '''A page of a keyset-paginated listing
+
+    Attributes:
+        items:           The rows of the page
+        next_cursor:     Cursor to give to get the next page
+                         (None if the page is the last one)
+        previous_cursor: Cursor to give to get the previous page
+                         (None if the page is the first one)'''
+    items: List[Any] = field(default_factory=list)
+    next_cursor: Optional[Cursor] = None
+    previous_cursor: Optional[Cursor] = None
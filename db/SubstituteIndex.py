@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+'''Class scoring the substitutes of the products in memory'''
+from typing import Dict, List, Set, Tuple, Iterable, Optional
+from bisect import bisect_left, insort
+import heapq
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db.setup import Product, HasCategory
+
+
+class SubstituteIndex:
+    '''Precomputed inverted index category -> products, used to score
+    the substitutes of a product by the number of categories they share
+    with it. The posting lists are split by grade rank and sorted by
+    product id, so that only the products with a better grade are ever
+    scanned, in the order of the ranking ties.
+    A lookup scans the postings of the product from the smallest one
+    (prefix filtering: a product sharing s of its m categories is in at
+    least one of its m - s + 1 smallest postings) and stops as soon as
+    the k best substitutes found can no longer be beaten, so that it
+    does not cost the size of the categories of the product.
+
+    Class attributes:
+        MAX_SCANNED: Maximum number of entries of the postings scanned
+                     by a lookup, which returns the best substitutes
+                     found so far beyond (only the products of large
+                     categories sharing few of them with the others
+                     need more)
+        FEW_CHANGES: Maximum number of changes of a posting list
+                     applied by bisection, instead of sorting it again
+
+    Attributes:
+        built:   Whether the index has been loaded from the database
+        version: The version of the data it was loaded from (None if
+                 unknown)'''
+    MAX_SCANNED: int = 3000
+    FEW_CHANGES: int = 64
+
+    def __init__(self) -> None:
+        '''Constructor of an empty index'''
+        self.built: bool = False
+        self.version: Optional[int] = None
+        # category id -> one sorted list of product ids per grade rank
+        self._postings: Dict[int, List[List[int]]] = {}
+        # product id -> (grade rank, category ids)
+        self._products: Dict[int, Tuple[int, Tuple[int, ...]]] = {}
+
+    def build(self, session: Session) -> None:
+        '''Loads the whole index from the database'''
+        self._postings.clear()
+        self._products.clear()
+        self.update(self._load(session))
+        self.built = True
+
+    def refresh(self, session: Session, product_ids: List[int]) -> None:
+        '''Reloads the entries of some products from the database
+        (after they have been written), if the index is built'''
+        if self.built:
+            self.update(self._load(session, product_ids))
+
+    def update(self, rows: Iterable[Tuple[int, int, int]]) -> None:
+        '''Replaces the entries of the products from (product id,
+        grade rank, category id) rows, grouped by product id'''
+        categories: Dict[int, List[int]] = {}
+        ranks: Dict[int, int] = {}
+        for product_id, rank, category_id in rows:
+            ranks[product_id] = rank
+            categories.setdefault(product_id, []).append(category_id)
+        # Changes of the posting lists, by (category id, grade rank)
+        removed: Dict[Tuple[int, int], Set[int]] = {}
+        added: Dict[Tuple[int, int], List[int]] = {}
+        entries: Dict[int, Optional[Tuple[int, Tuple[int, ...]]]] = {}
+        for product_id, rank in ranks.items():
+            entry: Optional[Tuple[int, Tuple[int, ...]]] = \
+                self._products.get(product_id)
+            if entry:
+                for category_id in entry[1]:
+                    removed.setdefault((category_id, entry[0]),
+                                       set()).add(product_id)
+            entries[product_id] = None
+            if not rank or rank > len(Product.GRADES):
+                continue
+            entries[product_id] = (rank, tuple(categories[product_id]))
+            for category_id in categories[product_id]:
+                added.setdefault((category_id, rank), []).append(product_id)
+        # Copy on write, so that the lookups of other threads read either
+        # list, never one being changed: the entries are added first and
+        # removed last, as they are read through the postings
+        for product_id, entry in entries.items():
+            if entry:
+                self._products[product_id] = entry
+        for category_id, rank in removed.keys() | added.keys():
+            if category_id not in self._postings:
+                self._postings[category_id] = [[] for _ in Product.GRADES]
+            self._postings[category_id][rank - 1] = self._merge(
+                self._postings[category_id][rank - 1],
+                removed.get((category_id, rank), set()),
+                added.get((category_id, rank), [])
+            )
+        for product_id, entry in entries.items():
+            if not entry:
+                self._products.pop(product_id, None)
+
+    def top(self, product_id: int, k: int) -> List[int]:
+        '''Returns the ids of the k best substitutes for the product:
+        products with a better grade, sorted by number of shared
+        categories then by grade (then by id)'''
+        entry: Optional[Tuple[int, Tuple[int, ...]]] = \
+            self._products.get(product_id)
+        if not entry or k <= 0:
+            return []
+        rank, categories = entry
+        wanted: Set[int] = set(categories)
+        postings: List[List[List[int]]] = sorted(
+            (self._postings[category_id][:rank - 1]
+             for category_id in wanted),
+            key=lambda ranked: sum(map(len, ranked))
+        )
+        products: Dict[int, Tuple[int, Tuple[int, ...]]] = self._products
+        scores: Dict[int, int] = {}  # Shared categories, by product seen
+        ranking: List[Tuple[int, int, int]] = []  # (-score, rank, id)
+        scanned: int = 0
+        for position, ranked in enumerate(postings):
+            # Best score of the products unseen, which are in this
+            # posting or in the larger ones only
+            best: int = len(postings) - position
+            above: int = sum(1 for key in ranking if -key[0] > best)
+            # The products seen with the best score can only be beaten
+            # by the products of this posting ranked before them
+            ties: List[Tuple[int, int]] = sorted(
+                key[1:] for key in ranking if -key[0] == best
+            )
+            final: Set[int] = set()  # Products seen which can't be beaten
+            for grade_rank, ids in enumerate(ranked, 1):
+                if scanned + len(ids) > self.MAX_SCANNED:
+                    ids = ids[:self.MAX_SCANNED - scanned]
+                scanned += len(ids)
+                for id in ids:
+                    score: Optional[int] = scores.get(id)
+                    if score is None:
+                        found: Optional[Tuple[int, Tuple[int, ...]]] = \
+                            products.get(id)
+                        if not found:  # Removed since the postings read
+                            continue
+                        score = scores[id] = len(wanted.intersection(
+                            found[1]
+                        ))
+                        ranking.append((-score, grade_rank, id))
+                    if ties and ties[0] <= (grade_rank, id):
+                        while ties and ties[0] <= (grade_rank, id):
+                            final.add(heapq.heappop(ties)[1])
+                        if above + len(final) >= k:
+                            return self._best(ranking, k)
+                    if score == best:
+                        final.add(id)
+                        if above + len(final) >= k:
+                            return self._best(ranking, k)
+                if scanned >= self.MAX_SCANNED:
+                    return self._best(ranking, k)
+        return self._best(ranking, k)
+
+    def key(self, product_id: int) -> Optional[Tuple[int, Tuple[int, ...]]]:
+        '''Returns the (grade rank, sorted category ids) of a product,
+        which its substitutes only depend on (None if not indexed)'''
+        entry: Optional[Tuple[int, Tuple[int, ...]]] = \
+            self._products.get(product_id)
+        if not entry:
+            return None
+        return entry[0], tuple(sorted(entry[1]))
+
+    @staticmethod
+    def _best(ranking: List[Tuple[int, int, int]], k: int) -> List[int]:
+        '''Private static method returning the ids of the k best
+        products of a ranking of (-score, grade rank, id) keys'''
+        return [key[2] for key in heapq.nsmallest(k, ranking)]
+
+    @staticmethod
+    def _merge(ids: List[int], removed: Set[int],
+               added: List[int]) -> List[int]:
+        '''Private static method returning a copy of the sorted posting
+        list ids without the removed ids, with the added ones (changed
+        by bisection if they are few, sorted again otherwise)'''
+        if len(removed) + len(added) <= SubstituteIndex.FEW_CHANGES:
+            ids = list(ids)
+            for id in removed:
+                position: int = bisect_left(ids, id)
+                if position < len(ids) and ids[position] == id:
+                    del ids[position]
+            for id in added:
+                insort(ids, id)
+            return ids
+        if removed:
+            ids = [id for id in ids if id not in removed]
+        ids = ids + added
+        ids.sort()  # Merges the sorted runs in linear time
+        return ids
+
+    @staticmethod
+    def _load(session: Session, product_ids: Optional[List[int]] = None
+              ) -> Iterable[Tuple[int, int, int]]:
+        '''Private static method selecting the (product id, grade rank,
+        category id) rows of the products (every product if None)'''
+        query = select([
+            Product.id, Product.grade_rank, HasCategory.c.category_id
+        ]).select_from(Product.__table__.join(
+            HasCategory, HasCategory.c.product_id == Product.id
+        ))
+        if product_ids is not None:
+            query = query.where(Product.id.in_(product_ids))
+        return session.execute(query)
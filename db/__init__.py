@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
 from .DB import DB
+from .Page import Page, Cursor
+from .MemoryCatalog import MemoryCatalog
 from db.setup import (Product as DBProduct, Store as DBStore,
                       Category as DBCategory)
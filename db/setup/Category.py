@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 '''Class defining the Category Table in the database'''
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, BigInteger, String
 from sqlalchemy.orm import relationship, backref
 from db.setup import Base, HasCategory, repr_mixin
 
@@ -11,6 +11,9 @@ class Category(Base, repr_mixin):
     Attributes:
         id:       The id Column
         name:     The name Column
+        synced_until: The synced_until Column, sync watermark: timestamp
+                  of the last upstream modification already collected
+                  for the category
         products: A relationship containing every DBProducts linked
                   to the category through the HasCategory link table'''
     __tablename__ = 'Category'
@@ -18,5 +21,6 @@ class Category(Base, repr_mixin):
     id = Column(Integer(), autoincrement=True,
                 primary_key=True, nullable=False)
     name = Column(String(255), nullable=False, unique=True)
+    synced_until = Column(BigInteger(), nullable=True)
     products = relationship('Product', secondary=HasCategory,
                             backref='Category')
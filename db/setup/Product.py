@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 '''Class defining the Product Table in the database'''
-from sqlalchemy import Column, BigInteger, String
+from typing import Optional
+from sqlalchemy import (Column, BigInteger, Integer, SmallInteger, String,
+                        Index, text)
 from sqlalchemy.orm import relationship, backref
 from db.setup import (Base, IsSoldAt, HasCategory,
                       IsFavoriteSubstituteOf, repr_mixin)
@@ -13,8 +15,18 @@ class Product(Base, repr_mixin):
         id:              The id Column
         name:            The name Column
         nutrition_grade: The nutrition_grade Column ("nutriscore")
+        grade_rank:      The grade_rank Column, compact integer encoding
+                         of nutrition_grade (a: 1, ..., e: 5) indexed
+                         with name for the substitutes queries
         url:             The url Column (link to the OpenFoodFacts Web page
                          for the product)
+        content_hash:    The content_hash Column, digest of the data of
+                         the product when it was last written (used to
+                         skip the writes of unchanged products)
+        version:         The version Column, version of the data written
+                         by the last write of the product (or of its
+                         categories or favorites), indexed to read the
+                         products changed since a version
         stores:          A relationship containing every DBStores linked
                          to the product through the IsSoldAt link table
         categories:      A relationship containing every DBCategories linked
@@ -25,13 +37,30 @@ class Product(Base, repr_mixin):
         substitutes:     A relationship containing every DBProducts linked
                          to the product through the IsFavoriteSubstituteOf
                          link table (contains the substituted products)
+
+    Class attributes:
+        GRADES: The nutrition grades, from the best to the worst
         '''
     __tablename__ = 'Product'
+    __table_args__ = (
+        Index('ix_Product_grade_rank_name_id', 'grade_rank', 'name', 'id'),
+    )
+    GRADES: str = 'abcde'
 
     id = Column(BigInteger(), nullable=False, primary_key=True)
-    name = Column(String(255), nullable=False)
-    nutrition_grade = Column(String(1), nullable=False)
+    name = Column(String(255), nullable=False, index=True)
+    nutrition_grade = Column(String(1), nullable=False, index=True)
+    grade_rank = Column(
+        SmallInteger(), nullable=True,
+        info={'migration': text(  # Fills the column of existing databases
+            'UPDATE Product SET grade_rank = CASE nutrition_grade %s END'
+            % ' '.join("WHEN '%s' THEN %d" % (grade, rank)
+                       for rank, grade in enumerate(GRADES, 1))
+        )}
+    )
     url = Column(String(255), nullable=False)
+    content_hash = Column(String(40), nullable=True)
+    version = Column(Integer(), nullable=True, index=True)
     stores = relationship('Store', secondary=IsSoldAt, backref='Product')
     categories = relationship('Category', secondary=HasCategory,
                               backref='Product')
@@ -47,3 +76,12 @@ class Product(Base, repr_mixin):
         secondaryjoin=id == IsFavoriteSubstituteOf.c.substituted_product_id,
         backref='SubtitutedProduct'
     )
+
+    @classmethod
+    def rank(cls, nutrition_grade: str) -> Optional[int]:
+        '''Class method encoding a nutrition grade as an integer
+        (1 for "a", the best, to 5 for "e"). None if unknown.'''
+        if not nutrition_grade or len(nutrition_grade) != 1:
+            return None
+        rank: int = cls.GRADES.find(nutrition_grade.lower()) + 1
+        return rank or None
@@ -3,11 +3,23 @@
 It doesn't respect the PEP8 due to SQLAlchemy bad adequation of it.
 This package file is intended to clean up the database's other class files.
 """
-from sqlalchemy import (Table, Column, Integer, BigInteger,
-                        ForeignKey, create_engine)
+from sqlalchemy import (Table, Column, Integer, BigInteger, String,
+                        Text, Boolean, ForeignKey, Index, DDL,
+                        create_engine, inspect, select, func, event)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
-from sqlalchemy.orm import sessionmaker, Session
-from typing import Tuple
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.schema import CreateColumn, CreateTable
+from sqlalchemy.sql.expression import Select, Insert
+from typing import Tuple, Set, List, Optional, Any, Dict, Iterable
+from functools import partial
+import os
+import pathlib
+import sqlite3
 
 
 class repr_mixin:
@@ -20,21 +32,344 @@ class repr_mixin:
 
 Base: DeclarativeMeta = declarative_base()  # Instanciate DB
 
+# Version of the schema, to increase whenever the tables change
+# so that existing databases are migrated on their next start up
+SCHEMA_VERSION: int = 8
 
-def start_up(_DB_URI: str) -> Tuple[DeclarativeMeta, Session]:
+# Engines already created in the process, by URI, and their read-only
+# engines (SQLite), by URI of the engine
+_engines: Dict[str, Engine] = {}
+_readers: Dict[str, Engine] = {}
+
+# Options of the engines (pools) and PRAGMA statements run on every
+# new SQLite connection, set by configure()
+_engine_options: Dict[str, Any] = {
+    'pool_size': 5, 'max_overflow': 10,
+    'pool_pre_ping': True, 'pool_recycle': 3600,
+}
+_sqlite_pragmas: Dict[str, Any] = {
+    'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536,
+}
+
+
+def configure(pool_size: int = 5, max_overflow: int = 10,
+              pool_pre_ping: bool = True, pool_recycle: int = 3600,
+              pragmas: Optional[Dict[str, Any]] = None) -> None:
+    '''Function setting the options of the engines of the process:
+    size and overflow of the connection pools (ignored by SQLite),
+    liveness check of the connections before their use (pre_ping),
+    lifetime (in seconds) of the connections, and PRAGMA statements
+    run on every new SQLite connection (by default WAL journal,
+    NORMAL synchronous and 64 MiB page cache).
+    The engines already created are disposed of, to be created again
+    with these options.'''
+    _engine_options.update(pool_size=pool_size, max_overflow=max_overflow,
+                           pool_pre_ping=pool_pre_ping,
+                           pool_recycle=pool_recycle)
+    if pragmas is not None:
+        _sqlite_pragmas.clear()
+        _sqlite_pragmas.update(pragmas)
+    for engine in list(_engines.values()) + list(_readers.values()):
+        engine.dispose()
+    _engines.clear()
+    _readers.clear()
+
+
+def get_engine(_DB_URI: str) -> Engine:
+    '''Function returning the engine of the DB, created once
+    per process and URI with the options set by configure().
+    A SQLite file is written through a single connection, shared by
+    the threads in turn (they wait for it instead of failing on a
+    locked database).'''
+    if _DB_URI not in _engines:
+        options: Dict[str, Any] = dict(_engine_options)
+        if _sqlite_file(_DB_URI):
+            options.update(poolclass=QueuePool, pool_size=1, max_overflow=0,
+                           connect_args={'check_same_thread': False})
+        elif _DB_URI.startswith('sqlite'):  # In memory: pool not sized
+            del options['pool_size'], options['max_overflow']
+        engine: Engine = create_engine(_DB_URI, **options)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _set_pragmas)
+        _engines[_DB_URI] = engine
+    return _engines[_DB_URI]
+
+
+def get_reader(engine: Engine) -> Engine:
+    '''Function returning the engine reading the DB of an engine,
+    created once per process. With a SQLite file, its connections open
+    the file read only and begin their transactions explicitly, so that
+    a transaction reads a single snapshot of the database which, in WAL
+    mode, neither blocks on the writer nor is blocked by it. The other
+    databases are read through the engine itself (their transactions
+    already read a snapshot).'''
+    path: Optional[str] = _sqlite_file(str(engine.url))
+    if not path:
+        return engine
+    if str(engine.url) not in _readers:
+        reader: Engine = create_engine(
+            'sqlite://', poolclass=QueuePool,
+            creator=partial(
+                sqlite3.connect,
+                pathlib.Path(path).absolute().as_uri() + '?mode=ro',
+                uri=True, check_same_thread=False
+            ),
+            **_engine_options
+        )
+        event.listen(reader, 'connect', _set_reader_pragmas)
+        event.listen(reader, 'begin',
+                     lambda connection: connection.execute('BEGIN'))
+        _readers[str(engine.url)] = reader
+    return _readers[str(engine.url)]
+
+
+def _sqlite_file(_DB_URI: str) -> Optional[str]:
+    '''Function returning the path of the file of a SQLite DB
+    (None for other databases, or SQLite in memory)'''
+    if not _DB_URI.startswith('sqlite:///'):
+        return None
+    path: str = _DB_URI[len('sqlite:///'):].split('?')[0]
+    return path if path and path != ':memory:' else None
+
+
+def _set_pragmas(connection: Any, record: Any) -> None:
+    '''Function running the configured PRAGMA statements on a new
+    SQLite connection'''
+    cursor: Any = connection.cursor()
+    for name, value in _sqlite_pragmas.items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+def _set_reader_pragmas(connection: Any, record: Any) -> None:
+    '''Function preparing a new read-only SQLite connection: its
+    transactions are begun by the "begin" event instead of the driver
+    (which would not begin them before reading), and the configured
+    PRAGMA statements which do not write are run'''
+    connection.isolation_level = None
+    cursor: Any = connection.cursor()
+    for name, value in _sqlite_pragmas.items():
+        if name not in ('journal_mode', 'synchronous'):
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+def start_up(_DB_URI: str, profiler: Optional[Any] = None,
+             create: bool = False
+             ) -> Tuple[DeclarativeMeta, scoped_session]:
     '''Function creating the engine and session for the DB
-    Returns the base and the session.'''
-    engine = create_engine(_DB_URI)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return (Base, Session())
+    (attaching the profiler, if any, to the engine events).
+    The schema is created or migrated only if create is True or if
+    the version stamp of the database is missing or outdated.
+    Returns the base and the session: a registry of short-lived
+    sessions (one per thread, ended by DB.unit_of_work()), whose
+    objects stay readable once committed.'''
+    engine: Engine = get_engine(_DB_URI)
+    if profiler:
+        profiler.attach_engine(engine)
+        profiler.attach_engine(get_reader(engine))
+    if create or schema_version(engine) != SCHEMA_VERSION:
+        existing: Set[str] = set(inspect(engine).get_table_names())
+        Base.metadata.create_all(engine)
+        migrate(engine, existing)
+        with engine.begin() as connection:
+            connection.execute(SchemaVersion.delete())
+            connection.execute(SchemaVersion.insert(),
+                               version=SCHEMA_VERSION)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    return (Base, scoped_session(Session))
+
+
+def schema_version(engine: Engine) -> Optional[int]:
+    '''Function returning the version stamp of the database
+    (None if it is missing)'''
+    try:
+        return engine.execute(select([SchemaVersion.c.version])).scalar()
+    except DBAPIError:  # No stamp table yet
+        return None
+
+
+def migrate(engine: Engine, existing: Iterable[str] = ()) -> None:
+    '''Function upgrading the tables of an existing database to the
+    current schema: adds the missing columns (then runs the statement
+    stored in their "migration" info to fill them) and the missing
+    indexes. Tables created by create_all() are already up to date,
+    but the ones missing from existing (the tables found before
+    create_all()) are filled by the statement of their "migration"
+    info, if any.'''
+    inspector: Inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            if 'migration' in table.info:
+                with engine.begin() as connection:
+                    connection.execute(table.info['migration'])
+            continue
+        if 'fulltext' in table.info:  # FTS5 tables cannot be altered
+            continue
+        columns: Set[str] = {
+            c['name'] for c in inspector.get_columns(table.name)
+        }
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            with engine.begin() as connection:
+                connection.execute('ALTER TABLE %s ADD COLUMN %s' % (
+                    engine.dialect.identifier_preparer.format_table(table),
+                    CreateColumn(column).compile(dialect=engine.dialect)
+                ))
+                if 'migration' in column.info:
+                    connection.execute(column.info['migration'])
+        indexes: Set[str] = {
+            i['name'] for i in inspector.get_indexes(table.name)
+        }
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
 
 
 def remove_all(_DB_URI: str) -> None:
-    '''Function creating the engine for the DB and drops all tables'''
-    engine = create_engine(_DB_URI)
-    Base.metadata.drop_all(engine)
+    '''Function dropping all tables of the DB'''
+    Base.metadata.drop_all(get_engine(_DB_URI))
+
+
+def swap(_DB_URI: str, _STAGING_URI: str) -> None:
+    '''Function replacing the DB by the staging DB in one atomic step,
+    so that its readers never see it empty or partly filled.
+    With SQLite, the staging tables are copied over the DB tables in a
+    single transaction, then the staging file is removed: the DB file
+    is not replaced, as the connections of other processes (and its
+    WAL files) would keep serving the previous one.
+    With MySQL, every table is moved at once by a single RENAME TABLE
+    (the previous tables going to the staging database, to be
+    dropped afterwards).'''
+    live: Engine = get_engine(_DB_URI)
+    staging: Engine = get_engine(_STAGING_URI)
+    staging.dispose()
+    if live.dialect.name == 'sqlite':
+        _copy_sqlite(live, staging.url.database)
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(staging.url.database + suffix):
+                os.remove(staging.url.database + suffix)
+        return
+    quote: Any = live.dialect.identifier_preparer.quote
+    existing: Set[str] = set(inspect(live).get_table_names())
+    renames: List[str] = []
+    previous: List[str] = []  # Tables replaced, to drop
+    for table in Base.metadata.sorted_tables:
+        name: str = '%s.%s' % (quote(live.url.database), quote(table.name))
+        if table.name in existing:
+            previous.append('%s.%s' % (quote(staging.url.database),
+                                       quote(table.name + '_previous')))
+            renames.append('%s TO %s' % (name, previous[-1]))
+        renames.append('%s.%s TO %s' % (
+            quote(staging.url.database), quote(table.name), name
+        ))
+    with live.begin() as connection:
+        version: int = data_version(connection)
+        for table_name in reversed(previous):  # Left by a failed swap
+            connection.execute('DROP TABLE IF EXISTS %s' % table_name)
+        connection.execute('RENAME TABLE %s' % ', '.join(renames))
+        for table_name in reversed(previous):
+            connection.execute('DROP TABLE %s' % table_name)
+        _follow_version(connection, version)
+
+
+def _copy_sqlite(live: Engine, path: str) -> None:
+    '''Function replacing the rows of every table of a SQLite DB by the
+    rows of the same table in the SQLite file at path, in a single
+    transaction: in WAL mode, the readers see the previous rows until
+    it is committed, then the new ones'''
+    quote: Any = live.dialect.identifier_preparer.quote
+    with live.connect() as connection:
+        connection.execute('ATTACH DATABASE ? AS staging', path)
+        try:
+            with connection.begin():
+                version: int = data_version(connection)
+                for table in reversed(Base.metadata.sorted_tables):
+                    connection.execute('DELETE FROM %s' % quote(table.name))
+                for table in Base.metadata.sorted_tables:
+                    columns: str = ', '.join(quote(c.name)
+                                             for c in table.columns)
+                    connection.execute(
+                        'INSERT INTO %s (%s) SELECT %s FROM staging.%s' % (
+                            quote(table.name), columns, columns,
+                            quote(table.name)
+                        )
+                    )
+                _follow_version(connection, version)
+        finally:
+            connection.execute('DETACH DATABASE staging')
+
+
+def data_version(connection: Any) -> int:
+    '''Function returning the version of the data (0 if missing), read
+    by the connection (or session) provided'''
+    return connection.execute(
+        select([func.max(DataVersion.c.version)])
+    ).scalar() or 0
+
 
+def _follow_version(connection: Any, previous: int) -> None:
+    '''Function setting the version of the data of a DB just replaced
+    beyond the version of the previous data (and of its products)'''
+    version: int = max(data_version(connection), previous) + 1
+    connection.execute(DataVersion.delete())
+    connection.execute(DataVersion.insert().values(version=version,
+                                                   replaced=version))
+
+
+# Instanciate the table holding the version stamp of the schema
+SchemaVersion: Table = Table(
+    'SchemaVersion', Base.metadata,
+    Column('version', Integer(), nullable=False, primary_key=True)
+)
+
+# Instanciate the table holding the version of the data, increased by
+# every transaction writing the catalog or the favorites, so that the
+# readers of every process notice the writes of the others, and the
+# version of its last replacement (the products written since then are
+# stamped with the version of their write)
+DataVersion: Table = Table(
+    'DataVersion', Base.metadata,
+    Column('version', Integer(), nullable=False, primary_key=True,
+           autoincrement=False),
+    Column('replaced', Integer(), nullable=True)
+)
+DataVersion.info['migration'] = DataVersion.insert().values(version=1,
+                                                            replaced=1)
+DataVersion.c.replaced.info['migration'] = DataVersion.update().values(
+    replaced=DataVersion.c.version  # The products are not stamped yet
+)
+
+
+def next_version(connection: Any) -> int:
+    '''Function increasing the version of the data, within the
+    transaction of the connection (or session) provided.
+    Returns the new version.'''
+    connection.execute(
+        DataVersion.update().values(version=DataVersion.c.version + 1)
+    )
+    return data_version(connection)
+
+
+def replaced_version(connection: Any) -> int:
+    '''Function returning the version of the last replacement of the
+    data (0 if missing), read by the connection (or session) provided'''
+    return connection.execute(
+        select([func.max(DataVersion.c.replaced)])
+    ).scalar() or 0
+
+
+# Instanciate the ingestion journal: page to resume from (and last
+# product written) of the categories being collected, so that an
+# interrupted setup/update can be resumed
+Checkpoint: Table = Table(
+    'Checkpoint', Base.metadata,
+    Column('category', String(255), nullable=False, primary_key=True),
+    Column('page', Integer(), nullable=False),
+    Column('product_id', BigInteger(), nullable=True),
+    Column('done', Boolean(), nullable=False, default=False)
+)
 
 # Instanciate link table between Product and Store
 IsSoldAt: Table = Table(
@@ -51,7 +386,11 @@ HasCategory: Table = Table(
     Column('product_id', BigInteger(), ForeignKey('Product.id'),
            nullable=False, primary_key=True),
     Column('category_id', Integer(), ForeignKey('Category.id'),
-           nullable=False, primary_key=True)
+           nullable=False, primary_key=True),
+    # Access path from a category to its products (the primary key
+    # only serves the product -> categories direction)
+    Index('ix_HasCategory_category_id_product_id',
+          'category_id', 'product_id')
 )
 
 # Instanciate link table between Product (to substitute)
@@ -64,6 +403,65 @@ IsFavoriteSubstituteOf: Table = Table(
            nullable=False, primary_key=True)
 )
 
+# Instanciate the full-text index of the products: a FTS5 virtual
+# table with SQLite, a table with a FULLTEXT index with MySQL.
+# Its key is named rowid so that the FTS5 rows are keyed by product id.
+ProductSearch: Table = Table(
+    'ProductSearch', Base.metadata,
+    Column('rowid', BigInteger(), key='product_id',
+           nullable=False, primary_key=True, autoincrement=False),
+    Column('name', Text(), nullable=False),
+    Column('stores', Text(), nullable=True),
+    Column('categories', Text(), nullable=True),
+    info={'fulltext': ('name', 'stores', 'categories')}
+)
+event.listen(ProductSearch, 'after_create', DDL(
+    'CREATE FULLTEXT INDEX ix_ProductSearch_fulltext '
+    'ON ProductSearch (name, stores, categories)'
+).execute_if(dialect='mysql'))
+
+
+@compiles(CreateTable, 'sqlite')
+def _create_sqlite_table(create: CreateTable, compiler: Any,
+                         **kw: Any) -> str:
+    '''Function compiling the full-text tables as FTS5 virtual tables
+    with SQLite (indexing the prefixes of 2 and 3 characters)'''
+    table: Table = create.element
+    if 'fulltext' not in table.info:
+        return compiler.visit_create_table(create, **kw)
+    return "CREATE VIRTUAL TABLE %s USING fts5(%s, prefix='2 3')" % (
+        compiler.preparer.format_table(table),
+        ', '.join(table.info['fulltext'])
+    )
+
+
+def search_documents(product_ids: Optional[Iterable[int]] = None
+                     ) -> Select:
+    '''Function returning the query selecting the ProductSearch rows
+    (id, name, stores and categories) of the products
+    (every product if None)'''
+    stores: Any = select([func.group_concat(Store.name)]).where(
+        (IsSoldAt.c.product_id == Product.id)
+        & (IsSoldAt.c.store_id == Store.id)
+    ).as_scalar()
+    categories: Any = select([func.group_concat(Category.name)]).where(
+        (HasCategory.c.product_id == Product.id)
+        & (HasCategory.c.category_id == Category.id)
+    ).as_scalar()
+    query: Select = select([Product.id, Product.name, stores, categories])
+    if product_ids is not None:
+        query = query.where(Product.id.in_(list(product_ids)))
+    return query
+
+
+def index_products(product_ids: Optional[Iterable[int]] = None) -> Insert:
+    '''Function returning the statement filling ProductSearch with the
+    rows of the products (every product if None)'''
+    return ProductSearch.insert().from_select(
+        list(ProductSearch.c), search_documents(product_ids)
+    )
+
+
 # Finally imports the Table Class
 # This occurs at the end of the package file because
 # previous data are required for them to work fine
@@ -71,3 +469,6 @@ IsFavoriteSubstituteOf: Table = Table(
 from .Product import Product
 from .Store import Store
 from .Category import Category
+
+# Fills the full-text index of the databases created before it
+ProductSearch.info['migration'] = index_products()
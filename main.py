@@ -25,12 +25,42 @@ def usage() -> None:
         '\nMODES:',
         '   --setup_db       Sets up database (flag)',
         '   --update_db      Updates database content (flag)',
+        '   --import_dump    Imports an OpenFoodFacts data export (JSONL or',
+        '                    CSV, gzip-compressed or not) into the database',
+        '   --search         Prints the products matching the terms provided',
+        '   --batch          Prints (as JSON lines) the substitutes of the',
+        '                    product ids read line by line from the file',
+        '                    provided ("-" for the standard input)',
         '   -i --interactive DEFAULT: Active interactive mode (flag)',
         '\nOPTIONS:',
         '   --categories File containing the wished categories in database',
+        '   --ui         UI of the interactive mode: "console" (default) or',
+        '                "http" (JSON server for other tools, see --host)',
+        '   --host       Address listened to by the http UI (127.0.0.1)',
+        '   --port       Port listened to by the http UI (8000)',
         '   -u --user    Username for MySQL database (useless for SQLite)',
         '   -p --pass    Password for MySQL database (useless for SQLite)',
         '   -d --dbname  Database to use (for SQLite: "sqlite:///[DBNAME]")',
+        '   -w --workers Number of categories fetched concurrently from the',
+        '                API while setting up/updating the database',
+        '   --batch_size Number of products written per transaction',
+        '   --resume     Resumes an interrupted --setup_db/--update_db',
+        '                from the last batch written',
+        '   --pool_size  Number of connections kept open (MySQL)',
+        '   --pool_overflow Number of extra connections allowed (MySQL)',
+        '   --pool_recycle Lifetime (in seconds) of the connections',
+        '   --pragmas    PRAGMA statements of the SQLite connections, as',
+        '                "name=value,..." (default: journal_mode=WAL,',
+        '                synchronous=NORMAL,cache_size=-65536; "" for none)',
+        '   --timeout    Timeout (in seconds) for the API requests',
+        '   --retries    Number of retries for failed API requests',
+        '   --http_cache File caching the API responses (disabled if absent)',
+        '   --http_cache_ttl Lifetime (in seconds) of the cached responses',
+        '   --cache_size Number of results cached by the interactive mode',
+        '   --memory     Loads the whole catalog in memory at start up',
+        '                (faster navigation, read only but the favorites)',
+        '   --profile    Measures queries and latencies, prints a summary',
+        '                at exit and saves it as JSON in the file provided',
         '',
         '   -h --help    Displays this help guide',
         '\nREQUIREMENTS:',
@@ -49,10 +79,16 @@ def parse_options() -> Params:
     params: Dict[str, Any] = {}
     try:
         options, args = getopt.getopt(
-            sys.argv[1:], 'ic:u:p:d:h', [
-                'setup_db', 'update_db', 'interactive',
-                'categories', 'user', 'pass', 'dbname',
-                'help'
+            sys.argv[1:], 'ic:u:p:d:w:h', [
+                'setup_db', 'update_db', 'import_dump=', 'search=',
+                'batch=', 'interactive',
+                'categories', 'ui=', 'host=', 'port=',
+                'user', 'pass', 'dbname',
+                'workers=', 'batch_size=', 'resume', 'pool_size=',
+                'pool_overflow=', 'pool_recycle=', 'pragmas=',
+                'timeout=', 'retries=',
+                'http_cache=', 'http_cache_ttl=', 'cache_size=', 'memory',
+                'profile=', 'help'
             ]
         )
     except getopt.GetoptError as err:
@@ -60,29 +96,78 @@ def parse_options() -> Params:
         usage()
         exit()
     modes = []
-    for option, arg in options:
-        # MODES
-        if option == '--setup_db':
-            params['setup_db'] = True
-            modes.append('setup_db')
-        elif option == '--update_db':
-            params['update_db'] = True
-            modes.append('update_db')
-        elif option in ('-i', '--interactive'):
-            params['interactive'] = True
-            modes.append('interactive')
-        # OPTIONS
-        elif option in ('-u', '--user'):
-            params['user'] = arg
-        elif option in ('-p', '--pass'):
-            params['password'] = arg
-        elif option in ('-d', '--dbname'):
-            params['dbname'] = arg
-        elif option == 'categories':
-            params['categories_file'] = arg
-        elif option in ('-h', '--help'):
-            usage()
-            exit()
+    try:
+        for option, arg in options:
+            # MODES
+            if option == '--setup_db':
+                params['setup_db'] = True
+                modes.append('setup_db')
+            elif option == '--update_db':
+                params['update_db'] = True
+                modes.append('update_db')
+            elif option == '--import_dump':
+                params['import_dump'] = arg
+                modes.append('import_dump')
+            elif option == '--search':
+                params['search'] = arg
+                modes.append('search')
+            elif option == '--batch':
+                params['batch'] = arg
+                modes.append('batch')
+            elif option in ('-i', '--interactive'):
+                params['interactive'] = True
+                modes.append('interactive')
+            # OPTIONS
+            elif option == '--ui':
+                params['ui'] = arg
+            elif option == '--host':
+                params['host'] = arg
+            elif option == '--port':
+                params['port'] = int(arg)
+            elif option in ('-u', '--user'):
+                params['user'] = arg
+            elif option in ('-p', '--pass'):
+                params['password'] = arg
+            elif option in ('-d', '--dbname'):
+                params['dbname'] = arg
+            elif option == 'categories':
+                params['categories_file'] = arg
+            elif option in ('-w', '--workers'):
+                params['workers'] = int(arg)
+            elif option == '--batch_size':
+                params['batch_size'] = int(arg)
+            elif option == '--resume':
+                params['resume'] = True
+            elif option == '--pool_size':
+                params['pool_size'] = int(arg)
+            elif option == '--pool_overflow':
+                params['pool_overflow'] = int(arg)
+            elif option == '--pool_recycle':
+                params['pool_recycle'] = int(arg)
+            elif option == '--pragmas':
+                params['pragmas'] = arg
+            elif option == '--timeout':
+                params['timeout'] = float(arg)
+            elif option == '--retries':
+                params['retries'] = int(arg)
+            elif option == '--http_cache':
+                params['http_cache'] = arg
+            elif option == '--http_cache_ttl':
+                params['http_cache_ttl'] = int(arg)
+            elif option == '--cache_size':
+                params['cache_size'] = int(arg)
+            elif option == '--memory':
+                params['memory'] = True
+            elif option == '--profile':
+                params['profile'] = arg
+            elif option in ('-h', '--help'):
+                usage()
+                exit()
+    except ValueError as err:  # Non-numeric value of a numeric option
+        print('\033[1mSome error occurred : "option %s: %s"\033[0m'
+              % (option, str(err)))
+        usage()
+        exit()
     if len(modes) != 1:  # If more (or no) modes selected
         for mode in modes:
             params[mode] = False
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''Tests of the API class'''
+from typing import List, Dict, Any
+import json
+import unittest
+from OpenFoodFacts import API
+
+
+class APIParsingTest(unittest.TestCase):
+    '''Tests of the incremental decoding of the API responses, whatever
+    the chunks the response body is received by'''
+    PRODUCTS: List[Dict[str, Any]] = [
+        {'code': '1', 'product_name': 'a "product": [1]'},
+        {'code': '2', 'product_name': 'b', 'stores': 'x, y'},
+        {'code': '3', 'product_name': 'c ]'},
+    ]
+
+    def test_every_split(self) -> None:
+        '''Every split of the response in two or three chunks yields
+        every product, separators split across chunks included'''
+        body: str = '{"count": 3, "products" \n: \n' + json.dumps(
+            self.PRODUCTS, indent=1
+        ) + ', "page": 1}'
+        for first in range(len(body) + 1):
+            for second in range(first, len(body) + 1, 7):
+                chunks: List[str] = [body[:first], body[first:second],
+                                     body[second:]]
+                with self.subTest(chunks=chunks):
+                    self.assertEqual(self._parse(chunks), self.PRODUCTS)
+
+    def test_empty_array(self) -> None:
+        '''An empty array yields no product'''
+        self.assertEqual(self._parse(['{"products"', ':', '[', ']}']), [])
+
+    def test_missing_array(self) -> None:
+        '''A response without the array raises ValueError'''
+        for body in ('{"count": 0}', '', '{"products"', '{"products": 1}',
+                     '{"products": {"code": "1"}}'):
+            with self.subTest(body=body):
+                with self.assertRaises(ValueError):
+                    self._parse([body[:5], body[5:]])
+
+    def test_truncated_array(self) -> None:
+        '''A response truncated within an element raises ValueError'''
+        body: str = json.dumps({'products': self.PRODUCTS})
+        with self.assertRaises(ValueError):
+            self._parse([body[:40]])
+
+    def test_to_product(self) -> None:
+        '''Only the complete results become Products, with lists of
+        stores and categories'''
+        result: Dict[str, Any] = {
+            'id': 1, 'product_name': 'a', 'nutrition_grades': 'b',
+            'url': 'url', 'stores': 'X, y', 'categories': 'Pizzas',
+            'last_modified_t': 2,
+        }
+        product: Any = API.to_product(dict(result))
+        self.assertEqual((product.name, product.stores, product.categories,
+                          product.last_modified_t),
+                         ('a', ['x', 'y'], ['pizzas'], 2))
+        result['stores'] = ''
+        self.assertIsNone(API.to_product(result))
+
+    @staticmethod
+    def _parse(chunks: List[str]) -> List[Dict[str, Any]]:
+        '''Returns the products decoded from the chunks'''
+        return list(API._iter_json_array(chunks, 'products'))
+
+
+if __name__ == '__main__':
+    unittest.main()
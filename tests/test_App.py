@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+'''Tests of the App class'''
+from typing import List, Dict, Callable, Iterable, Any
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import db.setup
+from app import App, Params
+from db import DB
+from db.setup import IsFavoriteSubstituteOf
+from OpenFoodFacts import Product
+
+
+class AppQueriesTest(unittest.TestCase):
+    '''Tests of the number of queries of the App read methods: each one
+    is served by a fixed number of queries, however many rows (and
+    relationships of theirs) it returns
+
+    Class attributes:
+        SIZES: Numbers of products of the databases compared'''
+    SIZES: List[int] = [6, 30]
+
+    def setUp(self) -> None:
+        '''Creates a directory for the databases'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        '''Removes the databases'''
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_get_products(self) -> None:
+        '''One query for the products of a category'''
+        self._assert_queries(1, lambda app: [
+            p.name for p in app.get_products(self.category_id)
+        ])
+
+    def test_get_product_details(self) -> None:
+        '''One query for a product, its stores and its substitutes'''
+        self._assert_queries(1, lambda app: self._details(
+            app.get_product_details(1)
+        ))
+
+    def test_get_substitutes_for(self) -> None:
+        '''One query for the substitutes of a product'''
+        self._assert_queries(1, lambda app: [
+            p.name for p in app.get_substitutes_for(4)  # Graded "e"
+        ])
+
+    def test_get_favorite_products(self) -> None:
+        '''One query for the favorites, plus one per relationship'''
+        self._assert_queries(3, lambda app: [
+            self._details(p) for p in app.get_favorite_products()
+        ])
+
+    def _assert_queries(self, expected: int,
+                        method: Callable[[App], Any]) -> None:
+        '''Checks that method issues the expected number of queries
+        (the transaction statements and the reading of the data version
+        of the snapshot aside) for every size of database'''
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                app: App = self._app(size)
+                statements: List[str] = []
+                for engine in self._engines(app):
+                    event.listen(
+                        engine, 'before_cursor_execute',
+                        lambda conn, cursor, statement, *args:
+                            statements.append(statement)
+                    )
+                results: Any = method(app)
+                queries: List[str] = [
+                    s for s in statements if s.strip().upper() != 'BEGIN'
+                ]
+                self.assertTrue(results)
+                self.assertEqual(len(queries), expected + 1, queries)
+
+    def _app(self, size: int) -> App:
+        '''Returns an App on a new database of size products, all in
+        the category whose id is kept in category_id (and in one other),
+        half of them saved as favorites, whose index of substitutes is
+        already built'''
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name,
+                                               '%d.db' % size)
+        app: App = App(Params(dbname=uri, cache_size=0))
+        products: List[Product] = [
+            Product(id=id, name='product %d' % id, url='url',
+                    nutrition_grades='abcde'[id % 5],
+                    stores=['store %d' % (id % 3), 'store'],
+                    categories=['category', 'category %d' % (id % 2)])
+            for id in range(1, size + 1)
+        ]
+        with app.db.unit_of_work():
+            app.db.add_many(products)
+        with app.db.unit_of_work() as session:
+            session.execute(IsFavoriteSubstituteOf.insert(), [
+                {'substitute_product_id': id, 'substituted_product_id': id + 1}
+                for id in range(1, size, 2)
+            ])
+        list(app.get_substitutes_for(1))  # Builds the index
+        self.category_id: int = next(
+            c.id for c in app.get_categories() if c.name == 'category'
+        )
+        return app
+
+    @staticmethod
+    def _engines(app: App) -> List[Engine]:
+        '''Returns the engines of the database of the App (writing and
+        reading)'''
+        engine: Engine = app.db.session.get_bind()
+        return [engine, db.setup.get_reader(engine)]
+
+    @staticmethod
+    def _details(product: Any) -> List[Any]:
+        '''Returns the data of a product shown by its details page'''
+        return [product.name, [s.name for s in product.stores],
+                [p.name for p in product.substitutes]]
+
+
+class AppVersionTest(unittest.TestCase):
+    '''Tests of the results cached by the App (cache and index of the
+    substitutes) once another process writes the database'''
+
+    def setUp(self) -> None:
+        '''Creates an App on a new database, with cache'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name, 't.db')
+        self.app: App = App(Params(dbname=uri, cache_size=100))
+        base, session = db.setup.start_up(uri)
+        self.other: DB = DB(base, session)  # Writer of another process
+        self._write([self._product(1, 'e'), self._product(2, 'c')])
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_writes_of_other_processes_read(self) -> None:
+        '''The products and substitutes written by another process
+        are read once written, instead of the ones cached'''
+        category_id: int = next(self.app.get_categories()).id
+        self.assertEqual(self._ids(self.app.get_products(category_id)),
+                         [1, 2])
+        self.assertEqual(self._ids(self.app.get_substitutes_for(1)), [2])
+        self._write([self._product(3, 'a')])
+        self.assertEqual(self._ids(self.app.get_products(category_id)),
+                         [1, 2, 3])
+        self.assertEqual(self._ids(self.app.get_substitutes_for(1)),
+                         [3, 2])
+
+    def test_results_of_unchanged_products_kept(self) -> None:
+        '''Once another process writes, the index of the substitutes is
+        refreshed instead of built again, and only the cached results
+        depending on the products written are dropped'''
+        self.app.get_product_details(1)
+        self.app.get_product_details(2)
+        self.assertEqual(self._ids(self.app.get_substitutes_for(1)), [2])
+        index: Any = self.app.db.substitutes
+        self._write([self._product(3, 'a', 'other'),
+                     Product(id=2, name='renamed', url='url',
+                             nutrition_grades='c', stores=['store'],
+                             categories=['category'])])
+        hits: int = self.app.cache.hits
+        self.assertEqual(self.app.get_product_details(1).name, 'product 1')
+        self.assertEqual(self.app.get_product_details(2).name, 'renamed')
+        self.assertEqual(self.app.cache.hits, hits + 1)
+        self.assertEqual(self._ids(self.app.get_substitutes_for(1)), [2])
+        self.assertIs(self.app.db.substitutes, index)
+
+    def _write(self, products: List[Product]) -> None:
+        '''Writes products through the other DB'''
+        with self.other.unit_of_work():
+            self.other.add_many(products)
+
+    @staticmethod
+    def _product(id: int, grade: str, category: str = 'category'
+                 ) -> Product:
+        '''Returns a product of the category'''
+        return Product(id=id, name='product %d' % id, url='url',
+                       nutrition_grades=grade, stores=['store'],
+                       categories=[category])
+
+    @staticmethod
+    def _ids(products: Iterable[Any]) -> List[int]:
+        '''Returns the ids of products'''
+        return [p.id for p in products]
+
+
+class AppBatchTest(unittest.TestCase):
+    '''Tests of the batch mode: one JSON record per line read, the
+    substitutes of the product or the error of this line'''
+
+    def setUp(self) -> None:
+        '''Creates an App in batch mode on a new database'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name, 't.db')
+        self.path: str = os.path.join(self.directory.name, 'ids.txt')
+        self.app: App = App(Params(dbname=uri, batch=self.path,
+                                   batch_size=2))
+        with self.app.db.unit_of_work():
+            self.app.db.add_many([
+                Product(id=id, name='product %d' % id, url='url',
+                        nutrition_grades=grade, stores=['store'],
+                        categories=['category'])
+                for id, grade in ((1, 'e'), (2, 'a'))
+            ])
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_one_record_per_line(self) -> None:
+        '''Every line gets its record, in order, invalid ones too
+        (non ASCII digits included)'''
+        records: List[Dict[str, Any]] = self._run(
+            ['1', 'abc', '\u00b2', '', '99', '2']
+        )
+        self.assertEqual(records, [
+            {'id': 1, 'substitutes': [{'id': 2, 'name': 'product 2',
+                                       'nutrition_grade': 'a',
+                                       'url': 'url'}]},
+            {'input': 'abc', 'error': 'Identifiant invalide'},
+            {'input': '\u00b2', 'error': 'Identifiant invalide'},
+            {'id': 99, 'error': 'Produit inconnu'},
+            {'id': 2, 'substitutes': []},
+        ])
+
+    def _run(self, lines: List[str]) -> List[Dict[str, Any]]:
+        '''Runs the batch mode on lines, returns the records printed'''
+        with open(self.path, 'w') as ids:
+            ids.write('\n'.join(lines) + '\n')
+        output: io.StringIO = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.app.run()
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+if __name__ == '__main__':
+    unittest.main()
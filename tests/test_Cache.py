@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''Tests of the Cache class'''
+from typing import Optional
+import os
+import tempfile
+import time
+import unittest
+from OpenFoodFacts.Cache import Cache, CacheEntry
+
+
+class CacheTest(unittest.TestCase):
+    '''Tests of the storage, expiry and eviction of the responses'''
+
+    def setUp(self) -> None:
+        '''Creates a Cache in a new file'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.directory.name, 'cache.db')
+        self.cache: Cache = Cache(self.path, ttl=3600, max_entries=2)
+
+    def tearDown(self) -> None:
+        '''Removes the Cache file'''
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_key_normalized(self) -> None:
+        '''The key of a request ignores the order and the types of
+        its parameters'''
+        self.assertEqual(Cache.key({'page': 1, 'tag': 'pizzas'}),
+                         Cache.key({'tag': 'pizzas', 'page': '1'}))
+        self.assertNotEqual(Cache.key({'page': 1}), Cache.key({'page': 2}))
+
+    def test_get_set(self) -> None:
+        '''A response stored is served fresh, with its headers, and
+        counted as a hit'''
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', '{}', etag='"1"', last_modified='date')
+        self.assertEqual(self.cache.get('a'),
+                         CacheEntry('{}', '"1"', 'date', True))
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'revalidated': 0})
+
+    def test_persistent(self) -> None:
+        '''The responses stored are served by the next Cache of the
+        file'''
+        self.cache.set('a', '{}')
+        self.cache.close()
+        self.cache = Cache(self.path)
+        entry: Optional[CacheEntry] = self.cache.get('a')
+        self.assertEqual(entry.body if entry else None, '{}')
+
+    def test_expiry_and_refresh(self) -> None:
+        '''An expired entry is still served (to be revalidated), not
+        fresh, until refreshed'''
+        self.cache.ttl = 0
+        self.cache.set('a', '{}')
+        entry: Optional[CacheEntry] = self.cache.get('a')
+        self.assertFalse(entry.fresh if entry else True)
+        self.cache.ttl = 3600
+        self.cache.refresh('a')
+        entry = self.cache.get('a')
+        self.assertTrue(entry.fresh if entry else False)
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'revalidated': 1})
+
+    def test_least_recently_used_evicted(self) -> None:
+        '''Beyond max_entries, the least recently read entries are
+        evicted'''
+        self.cache.set('a', 'a')
+        time.sleep(0.01)
+        self.cache.set('b', 'b')
+        time.sleep(0.01)
+        self.cache.get('a')
+        time.sleep(0.01)
+        self.cache.set('c', 'c')
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
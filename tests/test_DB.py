@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+'''Tests of the DB class'''
+from typing import List, Set, Optional
+import os
+import tempfile
+import unittest
+import db.setup
+from db import DB, DBProduct, MemoryCatalog, Page, Cursor
+from db.setup import IsFavoriteSubstituteOf
+from OpenFoodFacts import Product
+
+
+class DBPagingTest(unittest.TestCase):
+    '''Tests of the keyset pagination of the products of a category,
+    with products whose grade has no rank (NULL grade_rank)'''
+    GRADES: List[str] = ['a', 'unknown', 'e', 'not-applicable', 'b',
+                         'unknown', 'c', 'a', 'unknown', 'd']
+
+    def setUp(self) -> None:
+        '''Fills a new SQLite database with the products of a category'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name, 't.db')
+        base, session = db.setup.start_up(uri, create=True)
+        self.db: DB = DB(base, session)
+        with self.db.unit_of_work():
+            self.db.add_many([
+                Product(id=id, name='product %d' % (id % 4), url='url',
+                        nutrition_grades=grade, stores=['store'],
+                        categories=['category'])
+                for id, grade in enumerate(self.GRADES, 1)
+            ])
+        with self.db.unit_of_work():
+            self.category_id: int = self.db.get_categories().one().id
+            self.listing: List[int] = [
+                p.id for p in
+                self.db.get_products_by_category(self.category_id)
+            ]
+            self.catalog: MemoryCatalog = MemoryCatalog(self.db.session())
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_ungraded_products_listed(self) -> None:
+        '''The listing holds the products without a grade rank'''
+        self.assertEqual(len(self.listing), len(self.GRADES))
+
+    def test_pages_forward(self) -> None:
+        '''Following the next cursors walks the whole listing'''
+        for page_size in (1, 3, 4, 10):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self._walk(page_size, True), self.listing)
+
+    def test_pages_backward(self) -> None:
+        '''Following the previous cursors from the last page walks the
+        whole listing back'''
+        for page_size in (1, 3, 4, 10):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self._walk(page_size, False), self.listing)
+
+    def test_memory_catalog_pages(self) -> None:
+        '''The MemoryCatalog pages are the same as the DB ones'''
+        for page_size in (1, 3, 4):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self._walk(page_size, True, True),
+                                 self.listing)
+                self.assertEqual(self._walk(page_size, False, True),
+                                 self.listing)
+
+    def test_memory_catalog_unknown_cursor(self) -> None:
+        '''A cursor naming an unknown product gets the same pages from
+        the MemoryCatalog as from the DB'''
+        with self.db.unit_of_work():
+            cursors: List[Cursor] = [
+                (p.grade_rank, p.name, p.id + offset)
+                for p in self.db.get_products_by_category(self.category_id)
+                for offset in (-100, 100)
+            ] + [(None, '', 0), (9, 'z', 0)]
+            for cursor in cursors:
+                for direction in ('after', 'before'):
+                    with self.subTest(cursor=cursor, direction=direction):
+                        pages: List[List[int]] = [[
+                            p.id for p in source.get_products_page(
+                                self.category_id, 3, **{direction: cursor}
+                            ).items
+                        ] for source in (self.db, self.catalog)]
+                        self.assertEqual(pages[1], pages[0])
+
+    def _walk(self, page_size: int, forward: bool,
+              memory: bool = False) -> List[int]:
+        '''Returns the ids of the products of every page, in the listing
+        order, following the next (or previous) cursors'''
+        source: object = self.catalog if memory else self.db
+        ids: List[int] = []
+        cursor: Optional[Cursor] = None
+        with self.db.unit_of_work():
+            if not forward:  # Starts from the last page
+                page: Page = source.get_products_page(
+                    self.category_id, page_size
+                )
+                while page.next_cursor:
+                    cursor = page.next_cursor
+                    page = source.get_products_page(
+                        self.category_id, page_size, after=cursor
+                    )
+                ids = [p.id for p in page.items]
+                while page.previous_cursor:
+                    page = source.get_products_page(
+                        self.category_id, page_size,
+                        before=page.previous_cursor
+                    )
+                    ids = [p.id for p in page.items] + ids
+                return ids
+            while True:
+                page = source.get_products_page(self.category_id, page_size,
+                                                after=cursor)
+                ids.extend(p.id for p in page.items)
+                if not page.next_cursor:
+                    return ids
+                cursor = page.next_cursor
+
+
+class DBWriteTest(unittest.TestCase):
+    '''Tests of the bulk upserts of the products: updates in place,
+    skipped unchanged products, isolation of the faulty ones'''
+
+    def setUp(self) -> None:
+        '''Creates a new SQLite database with two products, the first
+        one saved as substitute of the second one'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        self.uri: str = 'sqlite:///' + os.path.join(self.directory.name,
+                                                    't.db')
+        base, session = db.setup.start_up(self.uri, create=True)
+        self.db: DB = DB(base, session)
+        self.assertEqual(self.db.add_many([self._product(1),
+                                           self._product(2)]), [])
+        with self.db.unit_of_work() as session:
+            session.execute(IsFavoriteSubstituteOf.insert(), [
+                {'substitute_product_id': 1, 'substituted_product_id': 2}
+            ])
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        self.db.session.remove()
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_update_in_place(self) -> None:
+        '''An upsert updates the columns of the product and replaces
+        its stores, adds its categories, keeps its favorites'''
+        self.assertEqual(self.db.add_many([self._product(
+            1, name='renamed', grade='a', stores=['other'],
+            categories=['other']
+        )]), [])
+        with self.db.unit_of_work():
+            product: DBProduct = self.db.get_product_by_id(
+                1, load=('stores', 'substitutes')
+            )
+            self.assertEqual(
+                (product.name, product.nutrition_grade, product.grade_rank,
+                 [s.name for s in product.stores],
+                 sorted(c.name for c in product.categories),
+                 [p.id for p in product.substitutes]),
+                ('renamed 1', 'a', 1, ['other'], ['category', 'other'], [2])
+            )
+            self.assertEqual(len(self.db.search('renamed')), 1)
+
+    def test_unchanged_skipped(self) -> None:
+        '''The products unchanged since their last write are skipped'''
+        self.db.unchanged = 0
+        self.assertEqual(self.db.add_many([self._product(1),
+                                           self._product(3)]), [])
+        self.assertEqual(self.db.unchanged, 1)
+
+    def test_faulty_products_isolated(self) -> None:
+        '''A faulty product rolls its batch back, then the products
+        are written one by one: only the faulty ones are returned, and
+        the names created by the batch rolled back are created again'''
+        faulty: Product = self._product(4, stores=['faulty'])
+        faulty.url = None
+        self.assertEqual(self.db.add_many([
+            self._product(3, stores=['new']), faulty,
+            self._product(5, stores=['faulty'])
+        ]), [faulty])
+        with self.db.unit_of_work():
+            self.assertIsNone(self.db.get_product_by_id(4))
+            for id, store in ((3, 'new'), (5, 'faulty')):
+                self.assertEqual(
+                    [s.name for s in self.db.get_product_by_id(id).stores],
+                    [store]
+                )
+
+    def test_changes_since_version(self) -> None:
+        '''The products written since a data version are read back,
+        but not once the data has been replaced'''
+        with self.db.snapshot():
+            version: int = self.db.data_version()
+        self.assertEqual(self.db.add_many([self._product(1, name='renamed'),
+                                           self._product(3)]), [])
+        self.db.add_categories_to({2: {'other'}})
+        with self.db.snapshot():
+            self.assertEqual(sorted(self.db.get_changes(version)),
+                             [1, 2, 3])
+            self.assertEqual(self.db.get_changes(self.db.data_version()),
+                             [])
+        self.db.session.remove()
+        staging: str = self.uri[:-len('t.db')] + 'staging.db'
+        db.setup.start_up(staging, create=True)
+        db.setup.swap(self.uri, staging)
+        with self.db.snapshot():
+            self.assertIsNone(self.db.get_changes(version))
+
+    @staticmethod
+    def _product(id: int, name: str = 'product', grade: str = 'c',
+                 stores: Optional[List[str]] = None,
+                 categories: Optional[List[str]] = None) -> Product:
+        '''Returns a product, in the category and store by default'''
+        return Product(id=id, name='%s %d' % (name, id), url='url',
+                       nutrition_grades=grade,
+                       stores=stores or ['store'],
+                       categories=categories or ['category'])
+
+
+class DBSearchTest(unittest.TestCase):
+    '''Tests of the full-text search of the products'''
+
+    def setUp(self) -> None:
+        '''Creates a new SQLite database with products to search'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name, 't.db')
+        base, session = db.setup.start_up(uri, create=True)
+        self.db: DB = DB(base, session)
+        self.db.add_many([
+            Product(id=id, name=name, url='url', nutrition_grades='c',
+                    stores=[store], categories=[category])
+            for id, name, store, category in (
+                (1, 'Pizza royale', 'Carrefour', 'pizzas'),
+                (2, 'Chips nature', 'Auchan', 'chips'),
+                (3, 'Tarte', 'Carrefour', 'pizzas surgelées'),
+                (4, 'Pizza 4 fromages', 'Auchan', 'pizzas'),
+            )
+        ])
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        self.db.session.remove()
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_prefixes_of_every_term(self) -> None:
+        '''Every term is matched as a prefix, of the name, the stores
+        or the categories'''
+        for terms, ids in (('piz', {1, 3, 4}), ('pizza carref', {1, 3}),
+                           ('AUCHAN chips', {2}), ('fromages 4', {4}),
+                           ('surgel', {3}), ('pizza burger', set())):
+            with self.subTest(terms=terms):
+                self.assertEqual(self._ids(terms), ids)
+
+    def test_names_first(self) -> None:
+        '''The matches of the names come before the other ones'''
+        self.assertEqual(
+            [p.id for p in self.db.search('pizza')][-1], 3
+        )
+
+    def test_limit_and_syntax(self) -> None:
+        '''At most limit products are returned, and the syntax of the
+        full-text queries in the terms is ignored'''
+        self.assertEqual(len(self.db.search('pizza', limit=2)), 2)
+        for terms in ('', '*', '"pizza', 'pizza OR chips', 'NEAR(pizza'):
+            with self.subTest(terms=terms):
+                self.assertLessEqual(self._ids(terms), {1, 3, 4})
+
+    def test_index_follows_updates(self) -> None:
+        '''An updated product is found by its new name only'''
+        self.db.add_many([Product(id=2, name='Crisps', url='url',
+                                  nutrition_grades='c', stores=['Auchan'],
+                                  categories=['chips'])])
+        self.assertEqual(self._ids('chips nature'), set())
+        self.assertEqual(self._ids('crisps'), {2})
+
+    def _ids(self, terms: str) -> Set[int]:
+        '''Returns the ids of the products matching terms'''
+        with self.db.unit_of_work():
+            return {p.id for p in self.db.search(terms)}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''Tests of the Dump class'''
+from typing import List, Dict, Any
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from OpenFoodFacts import Dump, Product
+
+
+class DumpTest(unittest.TestCase):
+    '''Tests of the reading of the data exports, JSONL and CSV'''
+
+    def setUp(self) -> None:
+        '''Creates a directory for the exports'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        '''Removes the exports'''
+        self.directory.cleanup()
+
+    def test_jsonl(self) -> None:
+        '''The complete products of the wished categories are read,
+        those of their tags too, gzip-compressed or not'''
+        lines: List[str] = [json.dumps(record) for record in (
+            self._record(1, categories='Pizzas'),
+            self._record(2, categories='Sodas'),
+            self._record(3, categories='Snacks',
+                         categories_tags=['en:pizzas']),
+            self._record(4, categories='Pizzas', product_name=''),
+            self._record(None, categories='Pizzas'),
+        )]
+        for compressed in (False, True):
+            with self.subTest(compressed=compressed):
+                dump: Dump = self._dump('export.jsonl', lines, compressed)
+                products: List[Product] = list(dump.products())
+                self.assertEqual([(p.id, p.categories) for p in products],
+                                 [(1, ['pizzas']), (3, ['pizzas'])])
+                self.assertEqual(products[0].last_modified_t, 1)
+                self.assertEqual(dump.malformed, 0)
+
+    def test_malformed_records_skipped(self) -> None:
+        '''Malformed records are skipped and counted, the other
+        products of their chunk are read'''
+        lines: List[str] = [
+            json.dumps(self._record(1)),
+            '{"code": "2", "categories": "pizzas", "product_na',
+            '["pizzas"]',
+            json.dumps(self._record(3, last_modified_t='pizzas')),
+            json.dumps(self._record(4, stores=['pizzas'])),
+            json.dumps(self._record(5)),
+        ]
+        dump: Dump = self._dump('export.jsonl', lines)
+        self.assertEqual([p.id for p in dump.products()], [1, 5])
+        self.assertEqual(dump.malformed, 4)
+
+    def test_csv(self) -> None:
+        '''The products of a CSV export are read, with the URL of
+        their barcode if the export has none'''
+        fields: List[str] = ['code', 'product_name', 'nutrition_grade_fr',
+                             'stores', 'categories', 'last_modified_t']
+        lines: List[str] = ['\t'.join(fields)] + [
+            '\t'.join(str(self._record(id)[field]) for field in fields)
+            for id in (1, 2)
+        ]
+        products: List[Product] = list(
+            self._dump('export.csv', lines).products()
+        )
+        self.assertEqual([p.id for p in products], [1, 2])
+        self.assertEqual(products[0].url, Dump.PRODUCT_URL % 1)
+        self.assertEqual(products[0].nutrition_grades, 'b')
+
+    def _dump(self, name: str, lines: List[str],
+              compressed: bool = False) -> Dump:
+        '''Returns the Dump of the pizzas of an export of lines'''
+        path: str = os.path.join(self.directory.name, name)
+        data: bytes = ('\n'.join(lines) + '\n').encode('utf-8')
+        with open(path, 'wb') as export:
+            export.write(gzip.compress(data) if compressed else data)
+        return Dump(path, ['pizzas'], workers=1, chunk_size=2)
+
+    @staticmethod
+    def _record(code: Any, **fields: Any) -> Dict[str, Any]:
+        '''Returns a complete record of an export'''
+        record: Dict[str, Any] = {
+            'code': str(code) if code else None,
+            'product_name': 'product %s' % code,
+            'nutrition_grade_fr': 'b',
+            'stores': 'store',
+            'categories': 'pizzas',
+            'last_modified_t': 1,
+        }
+        record.update(fields)
+        return record
+
+
+if __name__ == '__main__':
+    unittest.main()
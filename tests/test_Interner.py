@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+'''Tests of the Interner class'''
+import os
+import tempfile
+import threading
+import unittest
+import db.setup
+from db import DB
+from db.Interner import Interner
+
+
+class InternerTest(unittest.TestCase):
+    '''Tests of the ids pending in the transactions of the Sessions of
+    the threads'''
+
+    def setUp(self) -> None:
+        '''Creates an Interner of the stores of a new database'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name, 't.db')
+        base, session = db.setup.start_up(uri, create=True)
+        self.db: DB = DB(base, session)
+        self.interner: Interner = self.db.store_names
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        self.db.session.remove()
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_commit_of_the_session(self) -> None:
+        '''The ids pending are cached once their Session commits'''
+        self.interner.add({'store': 1})
+        self.assertEqual(self.interner.lookup({'store'}), ({'store': 1},
+                                                          set()))
+        self.db.session.commit()
+        self.assertEqual(self.interner.lookup({'store'}), ({'store': 1},
+                                                          set()))
+
+    def test_rollback_of_the_session(self) -> None:
+        '''The ids pending are dropped once their Session rolls back'''
+        self.interner.add({'store': 1})
+        self.db.session.rollback()
+        self.assertEqual(self.interner.lookup({'store'}), ({}, {'store'}))
+
+    def test_commit_of_another_thread(self) -> None:
+        '''The commit of the Session of another thread leaves the ids
+        pending in the Session of this thread pending'''
+        self.interner.add({'store': 1})
+        thread: threading.Thread = threading.Thread(target=self._commit)
+        thread.start()
+        thread.join()
+        self.assertEqual(self.other, ({}, {'store'}))
+        self.db.session.rollback()
+        self.assertEqual(self.interner.lookup({'store'}), ({}, {'store'}))
+
+    def _commit(self) -> None:
+        '''Commits the Session of the current thread, keeps what it
+        looks up in other'''
+        self.db.session.commit()
+        self.other = self.interner.lookup({'store'})
+        self.db.session.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
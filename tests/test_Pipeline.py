@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''Tests of the Pipeline class'''
+from typing import Dict, List, Set, Optional, Any, Generator
+import os
+import tempfile
+import unittest
+from sqlalchemy import select
+import db.setup
+from app.Pipeline import Pipeline
+from db import DB
+from db.setup import Category, HasCategory
+from OpenFoodFacts import API
+
+
+class ListingAPI:
+    '''API listing fixed products by category
+
+    Attributes:
+        listings: The ids of the products listed, by category
+        modified: The timestamp of the last modification of the
+                  products, by id (1 if absent)'''
+
+    def __init__(self, listings: Dict[str, List[int]]) -> None:
+        '''Constructor'''
+        self.listings = listings
+        self.modified: Dict[int, int] = {}
+
+    def search_results(self, category: str, page_size: int = 20,
+                       modified_since: Optional[int] = None,
+                       page: int = 1
+                       ) -> Generator[Dict[str, Any], None, None]:
+        '''Yields the raw results of a category (with modified_since,
+        the ones modified since then, the most recently modified
+        first). Every product belongs upstream to the first category
+        listing it only.'''
+        ids: List[int] = self.listings[category]
+        if modified_since:
+            ids = sorted((id for id in ids
+                          if self.modified.get(id, 1) > modified_since),
+                         key=lambda id: -self.modified[id])
+        for id in ids[(page - 1) * page_size:]:
+            first: str = next(c for c, ids in self.listings.items()
+                              if id in ids)
+            modified: int = self.modified.get(id, 1)
+            yield {'id': id, 'product_name': 'product %d (%d)' % (id,
+                                                                   modified),
+                   'nutrition_grades': 'c', 'url': 'url',
+                   'stores': 'store', 'categories': first,
+                   'last_modified_t': modified}
+
+    to_product = staticmethod(API.to_product)
+
+
+class PipelineTest(unittest.TestCase):
+    '''Tests of the collection of the products listed by several
+    categories'''
+
+    def setUp(self) -> None:
+        '''Creates a new SQLite database'''
+        self.directory: tempfile.TemporaryDirectory = \
+            tempfile.TemporaryDirectory()
+        uri: str = 'sqlite:///' + os.path.join(self.directory.name, 't.db')
+        base, session = db.setup.start_up(uri, create=True)
+        self.db: DB = DB(base, session)
+
+    def tearDown(self) -> None:
+        '''Removes the database'''
+        db.setup.configure()  # Closes the connections
+        self.directory.cleanup()
+
+    def test_duplicates_linked_to_every_category(self) -> None:
+        '''A product listed by several categories is written once, and
+        linked to each of them'''
+        listings: Dict[str, List[int]] = {
+            'chips': [1, 2, 3, 4], 'snacks': [3, 4, 5], 'sucres': [4, 6],
+        }
+        pipeline: Pipeline = Pipeline(ListingAPI(listings), self.db,
+                                      workers=1, batch_size=2, page_size=2)
+        pipeline.run(list(listings))
+        self.assertEqual(pipeline.errors, {})
+        self.assertEqual(pipeline.duplicates, 3)
+        self.assertEqual(self._links(), {
+            category: set(ids) for category, ids in listings.items()
+        })
+
+    def test_incremental_updates_stored_products_only(self) -> None:
+        '''An incremental walk updates every product modified since the
+        watermark, beyond max_products too, but adds none'''
+        api: ListingAPI = ListingAPI({'chips': [1, 2, 3, 4, 5]})
+        Pipeline(api, self.db, workers=1, batch_size=2, page_size=2,
+                 max_products=2).run(['chips'])
+        self.assertEqual(self._names(), {1: 'product 1 (1)',
+                                          2: 'product 2 (1)'})
+        self.assertEqual(self.db.get_watermark('chips'), 1)
+        api.modified = {2: 5, 3: 6, 4: 7, 5: 8}
+        pipeline: Pipeline = Pipeline(api, self.db, workers=1,
+                                      batch_size=2, page_size=2,
+                                      max_products=2)
+        pipeline.run(['chips'], {'chips': 1})
+        self.assertEqual(pipeline.errors, {})
+        self.assertEqual(self._names(), {1: 'product 1 (1)',
+                                          2: 'product 2 (5)'})
+        self.assertEqual(self.db.get_watermark('chips'), 8)
+
+    def _names(self) -> Dict[int, str]:
+        '''Returns the names of the products stored, by id'''
+        return dict(self.db.session.query(self.db.Product.id,
+                                          self.db.Product.name))
+
+    def _links(self) -> Dict[str, Set[int]]:
+        '''Returns the ids of the products linked to each category'''
+        links: Dict[str, Set[int]] = {}
+        for name, product_id in self.db.session.execute(select([
+            Category.name, HasCategory.c.product_id
+        ]).select_from(Category.__table__.join(
+            HasCategory, HasCategory.c.category_id == Category.id
+        ))):
+            links.setdefault(name, set()).add(product_id)
+        return links
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''Tests of the SubstituteIndex class'''
+from typing import Dict, List, Tuple
+import random
+import unittest
+from db.SubstituteIndex import SubstituteIndex
+
+
+class SubstituteIndexTest(unittest.TestCase):
+    '''Tests of the substitutes scored by the index, compared to the
+    scoring of every product
+
+    Class attributes:
+        SIZE: Number of products of the index'''
+    SIZE: int = 2000
+
+    def setUp(self) -> None:
+        '''Creates an index of random products, with skewed categories
+        (a few of them hold most of the products)'''
+        rnd: random.Random = random.Random(9)
+        self.products: Dict[int, Tuple[int, Tuple[int, ...]]] = {
+            id: (rnd.randint(1, 5), tuple({
+                int(rnd.paretovariate(1)) for _ in range(rnd.randint(1, 5))
+            }))
+            for id in range(1, self.SIZE + 1)
+        }
+        self.index: SubstituteIndex = SubstituteIndex()
+        self.index.update(self._rows(self.products))
+
+    def test_top(self) -> None:
+        '''The substitutes are the ones of the scoring of every
+        product, whatever their number'''
+        for id in range(1, self.SIZE + 1, 7):
+            for k in (1, 10, 50):
+                with self.subTest(id=id, k=k):
+                    self.assertEqual(self.index.top(id, k),
+                                     self._top(id, k))
+
+    def test_update(self) -> None:
+        '''Updated products move to their new grade and categories,
+        removed products (without grade rank) are not substitutes'''
+        rnd: random.Random = random.Random(10)
+        for id in rnd.sample(list(self.products), 300):
+            self.products[id] = (rnd.randint(1, 5),
+                                 (rnd.randint(1, 3), rnd.randint(1, 30)))
+        removed: List[int] = rnd.sample(list(self.products), 300)
+        self.index.update(self._rows(self.products))
+        self.index.update((id, None, 1) for id in removed)
+        for id in removed:
+            del self.products[id]
+        for id in list(self.products)[::7]:
+            with self.subTest(id=id):
+                self.assertEqual(self.index.top(id, 10), self._top(id, 10))
+
+    def test_scan_bounded(self) -> None:
+        '''Beyond MAX_SCANNED entries scanned, the substitutes found so
+        far are returned: better graded products sharing categories'''
+        self.index.MAX_SCANNED = 50
+        for id in range(1, self.SIZE + 1, 7):
+            rank, categories = self.products[id]
+            with self.subTest(id=id):
+                substitutes: List[int] = self.index.top(id, 10)
+                self.assertEqual(bool(substitutes), bool(self._top(id, 10)))
+                for substitute in substitutes:
+                    self.assertLess(self.products[substitute][0], rank)
+                    self.assertTrue(set(categories).intersection(
+                        self.products[substitute][1]
+                    ))
+
+    def _top(self, product_id: int, k: int) -> List[int]:
+        '''Returns the k best substitutes of a product, scoring every
+        product'''
+        rank, categories = self.products[product_id]
+        scores: Dict[int, int] = {
+            id: len(set(categories).intersection(product[1]))
+            for id, product in self.products.items() if product[0] < rank
+        }
+        return sorted((id for id in scores if scores[id]), key=lambda id: (
+            -scores[id], self.products[id][0], id
+        ))[:k]
+
+    @staticmethod
+    def _rows(products: Dict[int, Tuple[int, Tuple[int, ...]]]
+              ) -> List[Tuple[int, int, int]]:
+        '''Returns the (product id, grade rank, category id) rows of
+        products'''
+        return [(id, rank, category_id)
+                for id, (rank, categories) in products.items()
+                for category_id in categories]
+
+
+if __name__ == '__main__':
+    unittest.main()
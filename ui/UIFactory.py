@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 '''Factory class used to dynamically instanciated the asked UI.
-Currently, handles a ConsoleUI only'''
+Currently, handles a ConsoleUI and a HttpUI'''
 from .console import ConsoleUI
+from .http import HttpUI
 from .UI import UI
 
 
@@ -14,6 +15,8 @@ class UIFactory:
         type = type.lower()
         if type == 'console':
             ui = ConsoleUI()
+        elif type == 'http':
+            ui = HttpUI()
         else:
             raise ValueError('Unkown type "%s" for UIs' % type)
         if not isinstance(ui, UI):
@@ -2,3 +2,4 @@
 from .UI import UI
 from .UIFactory import UIFactory
 from .console import ConsoleUI
+from .http import HttpUI
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 '''UI in console'''
 from typing import NoReturn, List, Dict, Optional, Any, Union, Callable
+from functools import partial
 import yaml
 import os
 import platform
 from ..UI import UI
 from .Menu import Menu, MenuEntry
 from app import App
-from db import DBCategory, DBProduct
+from db import DBCategory, DBProduct, Page, Cursor
 
 
 class ConsoleUI(UI):
@@ -50,6 +51,29 @@ class ConsoleUI(UI):
             'Retrouver mes aliments substitués.',
             self.favorite_list_menu
         )
+        menu.add(
+            'Rechercher un aliment.',
+            self.search_menu
+        )
+        self.interact(menu)
+
+    def search_menu(self) -> None:
+        '''Actions and display for the search results menu'''
+        print(self.contents['S_SEARCH'])
+        terms: str = input('Recherche > ')
+        menu: Menu = Menu()
+        for product in self.app.search(terms):
+            text_option: str = (
+                '(NUTRISCORE: %s) %-50s'
+                % (product.nutrition_grade.upper(), product.name.capitalize())
+            )
+            menu.add(
+                text_option,
+                self.product_page,
+                args=product.id
+            )
+        if not menu.entries:
+            print('Aucun produit trouvé !\n')
         self.interact(menu)
 
     def category_list_menu(self) -> None:
@@ -76,11 +100,15 @@ class ConsoleUI(UI):
             )
         self.interact(menu)
 
-    def product_list_menu(self, category_id: int) -> None:
-        '''Actions and display for the products list menu'''
+    def product_list_menu(self, category_id: int,
+                          after: Optional[Cursor] = None,
+                          before: Optional[Cursor] = None) -> None:
+        '''Actions and display for the products list menu,
+        page by page'''
         print(self.contents['S_LIST_PRODUCTS'])
         menu: Menu = Menu()
-        for product in self.app.get_products(category_id):
+        page: Page = self.app.get_products_page(category_id, after, before)
+        for product in page.items:
             text_option: str = (
                 '(NUTRISCORE: %s) %-50s'
                 % (product.nutrition_grade.upper(), product.name.capitalize())
@@ -90,6 +118,16 @@ class ConsoleUI(UI):
                 self.product_page,
                 args=product.id
             )
+        if page.previous_cursor:
+            menu.add('Page précédente', partial(
+                self.product_list_menu, category_id,
+                before=page.previous_cursor
+            ), 'p')
+        if page.next_cursor:
+            menu.add('Page suivante', partial(
+                self.product_list_menu, category_id,
+                after=page.next_cursor
+            ), 'n')
         self.interact(menu)
 
     def product_page(self, product_id: int) -> None:
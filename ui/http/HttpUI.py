@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+'''UI as a local HTTP server answering in JSON'''
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Tuple, Optional, Any, Pattern
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import time
+import urllib.parse
+from ..UI import UI
+from app import App
+from db import DBProduct, Cursor
+
+# Response: status, body and ETag
+Response = Tuple[int, bytes, str]
+
+
+class HttpUI(UI):
+    '''Class describing the UI as a local HTTP server, answering in JSON
+    to the GET requests of other tools. Inherits from the UI abstract
+    class.
+    Connections are served concurrently by an asyncio event loop, while
+    the App methods (database work) run in a pool of threads. Responses
+    are cached by URL for the lifetime of their route (then served while
+    they are built again in the background), concurrent requests of a
+    same URL share the same computation, and ETags let the clients
+    revalidate their copies (304 Not Modified).
+
+    Class attributes:
+        ROUTES:        The routes served: pattern of the path, name of
+                       the method building the response data, and
+                       lifetime (in seconds) of the cached responses
+                       (0: never cached)
+        MAX_LIMIT:     Maximum number of products of a substitutes or
+                       search response
+        MAX_RESPONSES: Maximum number of responses cached
+        STATUSES:      Reason phrases of the statuses answered
+
+    Attributes:
+        app:       The Running App
+        executor:  The pool of threads running the App methods
+        responses: The cached responses, with their expiry time, by URL
+        pending:   The responses being built, by URL'''
+    ROUTES: List[Tuple[Pattern, str, int]] = [
+        (re.compile(r'^/categories$'), 'categories', 300),
+        (re.compile(r'^/categories/(\d+)/products$'), 'products', 60),
+        (re.compile(r'^/products/(\d+)$'), 'product', 60),
+        (re.compile(r'^/products/(\d+)/substitutes$'), 'substitutes', 60),
+        (re.compile(r'^/favorites$'), 'favorites', 0),
+        (re.compile(r'^/search$'), 'search', 60),
+    ]
+    MAX_LIMIT: int = 100
+    MAX_RESPONSES: int = 4096
+    STATUSES: Dict[int, str] = {
+        200: 'OK', 304: 'Not Modified', 400: 'Bad Request',
+        404: 'Not Found', 405: 'Method Not Allowed',
+        500: 'Internal Server Error',
+    }
+
+    def start(self, app: App) -> None:
+        '''Main access method, serves the App until interrupted'''
+        self.app: App = app
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=app.params.workers
+        )
+        self.responses: OrderedDict = OrderedDict()
+        self.pending: Dict[str, asyncio.Future] = {}
+        try:
+            asyncio.run(self.serve(app.params.host, app.params.port))
+        except KeyboardInterrupt:
+            print('Au revoir !')
+        finally:
+            self.executor.shutdown()
+
+    async def serve(self, host: str, port: int) -> None:
+        '''Accepts the connections on host:port until cancelled'''
+        server: asyncio.AbstractServer = await asyncio.start_server(
+            self._handle, host, port, backlog=1024
+        )
+        print('Serveur HTTP à l\'écoute sur http://%s:%d/' % (host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        '''Private method serving the requests of a connection, kept
+        alive unless the client closes it'''
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = \
+                    request_line.decode('latin-1').split()
+                headers: Dict[str, str] = {}
+                while True:
+                    line: bytes = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length: int = int(headers.get('content-length', 0))
+                if length:  # Body ignored
+                    await reader.readexactly(length)
+                keep_alive: bool = (
+                    version == 'HTTP/1.1'
+                    and headers.get('connection', '').lower() != 'close'
+                )
+                status, body, extra = await self._respond(method, target,
+                                                          headers)
+                writer.write(self._format(status, body, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass  # Connection lost or malformed request: closed
+        finally:
+            writer.close()
+
+    async def _respond(self, method: str, target: str,
+                       headers: Dict[str, str]
+                       ) -> Tuple[int, bytes, Dict[str, str]]:
+        '''Private method returning the status, body and extra headers
+        of the response to a request'''
+        if method != 'GET':
+            status, body, _ = self._error(405, 'Méthode non autorisée')
+            return status, body, {'Allow': 'GET'}
+        url: urllib.parse.SplitResult = urllib.parse.urlsplit(target)
+        for pattern, name, ttl in self.ROUTES:
+            match: Optional[Any] = pattern.match(url.path)
+            if match:
+                break
+        else:
+            status, body, _ = self._error(404, 'Ressource introuvable')
+            return status, body, {}
+        build: Any = partial(self._build, target, name, ttl, match.groups(),
+                             urllib.parse.parse_qs(url.query))
+        cached: Optional[Tuple[float, Response]] = self.responses.get(target)
+        if cached is None:
+            response: Response = await asyncio.shield(build())
+        else:
+            expiry, response = cached
+            self.responses.move_to_end(target)
+            if expiry < time.monotonic() and target not in self.pending:
+                build()  # Stale: built again aside
+        status, body, etag = response
+        extra: Dict[str, str] = {'ETag': etag} if status == 200 else {}
+        if ttl:
+            extra['Cache-Control'] = 'max-age=%d' % ttl
+        if etag and headers.get('if-none-match') == etag:
+            return 304, b'', extra
+        return status, body, extra
+
+    def _build(self, key: str, name: str, ttl: int, args: Tuple[str, ...],
+               query: Dict[str, List[str]]) -> asyncio.Future:
+        '''Private method returning the future response of a URL, built
+        in the pool of threads once for all the requests waiting for it,
+        then cached for ttl seconds'''
+        if key not in self.pending:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            future: asyncio.Future = loop.run_in_executor(
+                self.executor, partial(self._compute, name, args, query)
+            )
+            self.pending[key] = future
+            future.add_done_callback(partial(self._store, key, ttl))
+        return self.pending[key]
+
+    def _store(self, key: str, ttl: int, future: asyncio.Future) -> None:
+        '''Private method caching a response once built'''
+        del self.pending[key]
+        response: Response = future.result()
+        if ttl and response[0] == 200:
+            self.responses[key] = (time.monotonic() + ttl, response)
+            self.responses.move_to_end(key)
+            while len(self.responses) > self.MAX_RESPONSES:
+                self.responses.popitem(last=False)
+
+    def _compute(self, name: str, args: Tuple[str, ...],
+                 query: Dict[str, List[str]]) -> Response:
+        '''Private method run by the pool of threads: calls the method
+        of the route on a single snapshot of the database and serializes
+        its data'''
+        try:
+            with self.app.snapshot():  # Consistent with a running update
+                data: Any = getattr(self, '_get_' + name)(*args,
+                                                          query=query)
+        except ValueError as error:
+            return self._error(400, str(error))
+        except Exception as error:
+            return self._error(500, str(error))
+        if data is None:
+            return self._error(404, 'Ressource introuvable')
+        body: bytes = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        return 200, body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+    def _get_categories(self, query: Dict[str, List[str]]
+                        ) -> List[Dict[str, Any]]:
+        '''Private method returning the categories'''
+        return [{'id': category.id, 'name': category.name}
+                for category in self.app.get_categories()]
+
+    def _get_products(self, category_id: str,
+                      query: Dict[str, List[str]]) -> Dict[str, Any]:
+        '''Private method returning a page of products of a category,
+        after (or before) the cursor provided (opaque token)'''
+        page: Any = self.app.get_products_page(
+            int(category_id),
+            after=self._decode_cursor(query.get('after')),
+            before=self._decode_cursor(query.get('before'))
+        )
+        return {
+            'products': [self._product(p) for p in page.items],
+            'next': self._encode_cursor(page.next_cursor),
+            'previous': self._encode_cursor(page.previous_cursor),
+        }
+
+    def _get_product(self, product_id: str, query: Dict[str, List[str]]
+                     ) -> Optional[Dict[str, Any]]:
+        '''Private method returning the details of a product, with its
+        stores and its saved substitutes'''
+        product: Optional[DBProduct] = self.app.get_product_details(
+            int(product_id)
+        )
+        return self._details(product) if product else None
+
+    def _get_substitutes(self, product_id: str, query: Dict[str, List[str]]
+                         ) -> Optional[List[Dict[str, Any]]]:
+        '''Private method returning the best substitutes of a product'''
+        substitutes: Dict[int, List[DBProduct]] = \
+            self.app.get_substitutes_for_many(
+                [int(product_id)], self._limit(query, 10)
+            )
+        if int(product_id) not in substitutes:
+            return None
+        return [self._product(p) for p in substitutes[int(product_id)]]
+
+    def _get_favorites(self, query: Dict[str, List[str]]
+                       ) -> List[Dict[str, Any]]:
+        '''Private method returning the saved products, with their
+        stores and substitutes'''
+        return [self._details(p) for p in self.app.get_favorite_products()]
+
+    def _get_search(self, query: Dict[str, List[str]]
+                    ) -> List[Dict[str, Any]]:
+        '''Private method returning the products best matching the terms
+        of the q parameter'''
+        terms: str = ' '.join(query.get('q', [])).strip()
+        if not terms:
+            raise ValueError('Paramètre q manquant')
+        return [self._product(p)
+                for p in self.app.search(terms, self._limit(query, 20))]
+
+    def _limit(self, query: Dict[str, List[str]], default: int) -> int:
+        '''Private method returning the limit parameter, bounded by
+        MAX_LIMIT'''
+        limit: int = int(query.get('limit', [default])[0])
+        if not 0 < limit <= self.MAX_LIMIT:
+            raise ValueError('Paramètre limit hors de [1, %d]'
+                             % self.MAX_LIMIT)
+        return limit
+
+    @staticmethod
+    def _product(product: DBProduct) -> Dict[str, Any]:
+        '''Private static method returning the JSON fields of a product'''
+        return {
+            'id': product.id,
+            'name': product.name,
+            'nutrition_grade': product.nutrition_grade,
+            'url': product.url,
+        }
+
+    @classmethod
+    def _details(cls, product: DBProduct) -> Dict[str, Any]:
+        '''Private class method returning the JSON fields of a product,
+        with its stores and its saved substitutes'''
+        return dict(
+            cls._product(product),
+            stores=[store.name for store in product.stores],
+            substitutes=[cls._product(p) for p in product.substitutes]
+        )
+
+    @staticmethod
+    def _encode_cursor(cursor: Optional[Cursor]) -> Optional[str]:
+        '''Private static method returning the token of a cursor'''
+        if cursor is None:
+            return None
+        return base64.urlsafe_b64encode(
+            json.dumps(cursor).encode('utf-8')
+        ).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(tokens: Optional[List[str]]) -> Optional[Cursor]:
+        '''Private static method returning the cursor of a token'''
+        if not tokens:
+            return None
+        try:
+            rank, name, id = json.loads(base64.urlsafe_b64decode(
+                tokens[0].encode('ascii')
+            ))
+        except (ValueError, TypeError):
+            raise ValueError('Curseur invalide')
+        if not (isinstance(rank, (int, type(None))) and
+                isinstance(name, str) and isinstance(id, int)):
+            raise ValueError('Curseur invalide')
+        return (rank, name, id)
+
+    def _error(self, status: int, message: str) -> Response:
+        '''Private method returning an error response'''
+        return status, json.dumps(
+            {'error': message}, ensure_ascii=False
+        ).encode('utf-8'), ''
+
+    def _format(self, status: int, body: bytes, extra: Dict[str, str],
+                keep_alive: bool) -> bytes:
+        '''Private method returning the bytes of a response'''
+        headers: List[str] = [
+            'HTTP/1.1 %d %s' % (status, self.STATUSES[status]),
+            'Content-Type: application/json; charset=utf-8',
+            'Content-Length: %d' % len(body),
+            'Connection: %s' % ('keep-alive' if keep_alive else 'close'),
+        ]
+        headers.extend('%s: %s' % header for header in extra.items())
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body